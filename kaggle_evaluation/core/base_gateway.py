@@ -2,24 +2,35 @@
 Hosts should not need to review this file before writing their competition specific gateway.
 """
 
+import asyncio
+import collections
+import contextlib
 import enum
 import json
 import os
 import pathlib
+import queue
 import re
 import subprocess
 import sys
+import threading
+import time
 import traceback
+import warnings
 
+from concurrent import futures
 from socket import gaierror
-from typing import Any, final, List, Optional, Tuple, Union
+from typing import Any, Awaitable, Callable, final, Generator, List, Optional, Sequence, Tuple, Union
 
 import grpc
 import numpy as np
 import pandas as pd
 import polars as pl
 
+import kaggle_evaluation.core.instrumentation
+import kaggle_evaluation.core.prediction_cache
 import kaggle_evaluation.core.relay
+import kaggle_evaluation.core.submission_writer
 
 
 _DATAFRAME_LIKE_TYPES = (pl.DataFrame, pl.Series, pd.DataFrame, pd.Series)
@@ -28,6 +39,33 @@ _VALID_ROW_ID_TYPES = _VALID_ROW_ID_SCALAR_TYPES + _DATAFRAME_LIKE_TYPES
 # Files in this directory are visible to the competitor container.
 _FILE_SHARE_DIR = '/kaggle/shared/'
 IS_RERUN = os.getenv('KAGGLE_IS_COMPETITION_RERUN') is not None
+# How often the pipelined replay's request preparer checks whether it should stop while waiting on a full queue.
+_PIPELINE_POLL_SECONDS = 0.1
+# Timing summaries are written next to the submission, so that runs with distinct submission paths keep their own.
+_TIMINGS_JSON_SUFFIX = '.timings.json'
+_TIMINGS_CSV_SUFFIX = '.timings.csv'
+# Options selecting how requests are sent, of which only one can be set. Ensembles are sent by the async replay loop,
+# so those two combine.
+_REPLAY_MODE_OPTIONS = ('pipeline_depth', 'stream_max_in_flight', 'async_max_in_flight', 'ensemble_servers')
+_COMPATIBLE_REPLAY_MODE_OPTIONS = {'async_max_in_flight': 'ensemble_servers', 'ensemble_servers': 'async_max_in_flight'}
+# Stands in for the predictions of data batches that aren't in the prediction cache.
+_NOT_CACHED = object()
+
+
+def _num_uncached(cached_predictions: List[Any]) -> int:
+    return sum(prediction is _NOT_CACHED for prediction in cached_predictions)
+
+
+def _run_coroutine(coroutine: Awaitable) -> Any:
+    """Run a coroutine to completion from synchronous code, on a new event loop in another thread if this thread
+    already runs one, e.g. in a notebook.
+    """
+    try:
+        asyncio.get_running_loop()
+    except RuntimeError:
+        return asyncio.run(coroutine)
+    with futures.ThreadPoolExecutor(max_workers=1, thread_name_prefix='gateway-event-loop') as executor:
+        return executor.submit(asyncio.run, coroutine).result()
 
 
 class GatewayRuntimeErrorType(enum.Enum):
@@ -83,23 +121,630 @@ class BaseGateway:
         self.data_paths = data_paths
         self.target_column_name = target_column_name
         self.row_id_column_name = row_id_column_name
+        self.replay_batch_size: Optional[int] = None
+        self.pipeline_depth: Optional[int] = None
+        self.stream_max_in_flight: Optional[int] = None
+        self.async_max_in_flight: Optional[int] = None
+        # The (address, port) of each inference server in an ensemble, and the function combining their predictions.
+        self.ensemble_servers: Optional[List[Tuple[str, Optional[int]]]] = None
+        self.ensemble_blend: Optional[Callable[[List[Any]], Any]] = None
+        self.submission_path = 'submission.parquet'
+        self.incremental_submission = False
+        self.resume_submission = False
+        self.submission_writer: Optional[kaggle_evaluation.core.submission_writer.SubmissionWriter] = None
+        self.timings: Optional[kaggle_evaluation.core.instrumentation.StageTimings] = None
+        # The only input columns the inference server reads, if it declared them. Set by wait_for_server.
+        self.required_columns: Optional[List[str]] = None
+        # The version of the inference server's model, if it reported one. Set by wait_for_server.
+        self.model_version: Optional[str] = None
+        self.prediction_cache: Optional[kaggle_evaluation.core.prediction_cache.PredictionCache] = None
 
     def set_response_timeout_seconds(self, timeout_seconds: int) -> None:
         # Also store timeout_seconds in an easy place for for competitor to access.
         self.timeout_seconds = timeout_seconds
         # Set a response deadline that will apply after the very first repsonse
         self.client.endpoint_deadline_seconds = timeout_seconds
+        if self.timings is not None:
+            self.timings.response_timeout_seconds = timeout_seconds
+
+    def set_replay_batch_size(self, batch_size: Optional[int]) -> None:
+        """Opt in to batched replay for offline runs: send batch_size consecutive data batches per request to the
+        `predict_batch` endpoint instead of one request per batch to `predict`. None restores the default behavior.
+        """
+        if batch_size is not None and (not isinstance(batch_size, int) or batch_size < 1):
+            raise ValueError(f'Replay batch size must be a positive int or None, got {batch_size}')
+        self.replay_batch_size = batch_size
+
+    def set_pipeline_depth(self, depth: Optional[int]) -> None:
+        """Opt in to pipelined replay: up to `depth` requests are generated and serialized on a background thread while
+        the current request is in flight, and validation runs on another background thread. Requests are still sent
+        one at a time and predictions are returned in order. None restores the default, fully sequential, behavior.
+        """
+        if depth is not None and (not isinstance(depth, int) or depth < 1):
+            raise ValueError(f'Pipeline depth must be a positive int or None, got {depth}')
+        if depth is not None:
+            self._check_replay_mode('pipeline_depth')
+        self.pipeline_depth = depth
+
+    def set_shared_memory_transport(self, enabled: bool) -> None:
+        """Opt in to passing large polars frames to and from the inference server through shared memory, which skips
+        serializing and copying them through the socket. Only takes effect if the server confirms it's on the same
+        host; otherwise requests are sent as usual.
+        """
+        self.client.set_shared_memory(enabled)
+
+    def set_timings(self, enabled: bool) -> None:
+        """Opt in to recording how long every stage of each request takes, along with payload sizes: generating the
+        data batch, serializing it, the round trip, the inference server's deserialization, `predict` call and
+        response serialization, deserializing the response, both validation stages, and writing the submission.
+        Percentiles for each stage are written next to the submission once the run ends, to submission_path with
+        .timings.json and .timings.csv appended.
+        """
+        self.timings = kaggle_evaluation.core.instrumentation.StageTimings(self.client.endpoint_deadline_seconds) if enabled else None
+        self.client.set_timings(self.timings)
+
+    def _timed(self, stage: str):
+        """Time the body of a `with` statement as `stage`, if timings are enabled."""
+        return self.timings.time(stage) if self.timings is not None else contextlib.nullcontext()
+
+    def set_schema_cache(self, enabled: bool) -> None:
+        """Opt in to sending the schema of each distinct polars DataFrame layout to the inference server only once.
+        Later frames with the same columns carry just their data, which for a single wide row is about half of the bytes
+        and most of the decoding work. Servers without support for this receive full frames as usual.
+        """
+        self.client.set_schema_cache(enabled)
+
+    def set_prediction_cache(self, cache: Optional[kaggle_evaluation.core.prediction_cache.PredictionCache]) -> None:
+        """Opt in to reusing predictions stored by earlier replays for the same data batch and model version, and
+        storing new ones, so that unchanged batches skip the inference server. Only takes effect if the server reports
+        its model version. Cached predictions are validated like any others. None restores the default behavior.
+        """
+        self.prediction_cache = cache
+
+    def set_streaming(self, max_in_flight: Optional[int]) -> None:
+        """Opt in to sending requests over a single streaming call instead of one unary call per request. Up to
+        max_in_flight requests are sent before waiting on the oldest response, and predictions are validated in order.
+        Servers without streaming support are handled with unary calls. None restores the default behavior.
+        """
+        if max_in_flight is not None and (not isinstance(max_in_flight, int) or max_in_flight < 1):
+            raise ValueError(f'Streaming max_in_flight must be a positive int or None, got {max_in_flight}')
+        if max_in_flight is not None:
+            self._check_replay_mode('stream_max_in_flight')
+        self.stream_max_in_flight = max_in_flight
+
+    def set_async_replay(self, max_in_flight: Optional[int]) -> None:
+        """Opt in to sending requests from an asyncio event loop through a `relay.AsyncClient`, with up to
+        max_in_flight unary requests in flight at once rather than one. Each request's deadline starts once the gateway
+        awaits its response, as in streamed replay, and predictions are validated in order. Combines with batched replay
+        and the prediction cache. None restores the default behavior.
+        """
+        if max_in_flight is not None and (not isinstance(max_in_flight, int) or max_in_flight < 1):
+            raise ValueError(f'Async max_in_flight must be a positive int or None, got {max_in_flight}')
+        if max_in_flight is not None:
+            self._check_replay_mode('async_max_in_flight')
+        self.async_max_in_flight = max_in_flight
+
+    def set_ensemble(self, servers: Optional[Sequence[Union[int, str]]], blend: Optional[Callable[[List[Any]], Any]] = None) -> None:
+        """Opt in to sending every request to several inference servers at once and blending their predictions.
+
+        Requests go out concurrently through one `relay.AsyncClient` per server, so each batch takes as long as the
+        slowest server rather than all of them in turn. Each request is serialized once and sent to every server, unless
+        it goes through shared memory, which needs a copy per server. blend receives the servers' predictions for one
+        data batch, in the order of servers, and returns the prediction that is validated and written to the
+        submission. Combines with set_async_replay, batched replay and the prediction cache. None restores the default
+        behavior.
+
+        Args:
+            servers: Each server's port on the usual inference server host, or its 'host' or 'host:port'. Servers
+                given without a port are found on GRPC_PORTS like the default server.
+            blend: Combines a list of predictions into one. Required with servers.
+        """
+        if servers is None:
+            self.ensemble_servers, self.ensemble_blend = None, None
+            return
+        if not servers:
+            raise ValueError('An ensemble needs at least one inference server')
+        self._check_replay_mode('ensemble_servers')
+        if not callable(blend):
+            raise ValueError(f'An ensemble needs a callable blend function, got {blend}')
+        ensemble_servers = []
+        for server in servers:
+            if isinstance(server, int):
+                ensemble_servers.append((self.client.channel_address, server))
+                continue
+            address, separator, port = str(server).rpartition(':')
+            if not separator:
+                ensemble_servers.append((port, None))
+            elif port.isdigit():
+                ensemble_servers.append((address, int(port)))
+            else:
+                raise ValueError(f'Ensemble servers must be ports or \'host\' or \'host:port\' strings, got {server}')
+        self.ensemble_servers = ensemble_servers
+        self.ensemble_blend = blend
+
+    def _check_replay_mode(self, option: str) -> None:
+        """Raise if a replay mode that can't be combined with option is already set, rather than ignoring one of them."""
+        for other_option in _REPLAY_MODE_OPTIONS:
+            if other_option in (option, _COMPATIBLE_REPLAY_MODE_OPTIONS.get(option)) or getattr(self, other_option) is None:
+                continue
+            raise ValueError(f'{option} cannot be combined with {other_option}, as only one replay mode can be used at a time')
+
+    def set_incremental_submission(self, enabled: bool, resume: bool = False) -> None:
+        """Opt in to writing each validated batch to disk as soon as it arrives rather than holding every prediction
+        in memory until the end of the run. With resume set, a run picks up after the last batch checkpointed by an
+        earlier incomplete run with the same submission_path; the batches already written aren't sent again.
+        """
+        if resume and not enabled:
+            raise ValueError('Resuming requires incremental submission writing')
+        self.incremental_submission = enabled
+        self.resume_submission = resume
 
     def get_all_predictions(self) -> Tuple[List[Any], List[Any]]:
+        """Returns the predictions and row IDs for every batch, or empty lists if they were written incrementally."""
+        if self.async_max_in_flight is not None or self.ensemble_servers is not None:
+            return _run_coroutine(self._get_all_predictions_async())
+        if self.stream_max_in_flight is not None:
+            return self._get_all_predictions_streamed()
+        if self.pipeline_depth is not None:
+            return self._get_all_predictions_pipelined()
+        if self.replay_batch_size is not None:
+            return self._get_all_predictions_batched()
+
         all_predictions = []
         all_row_ids = []
-        for data_batch, row_ids in self.generate_data_batches():
-            predictions = self.predict(*data_batch)
+        for data_batch, row_ids in self._iter_data_batches():
+            predictions = self._predict_uncached('predict', [data_batch])[0]
+            self._validate_predictions(predictions, row_ids, data_batch)
+            self._collect_predictions(all_predictions, all_row_ids, [predictions], [row_ids])
+        return all_predictions, all_row_ids
+
+    def _iter_data_batches(self) -> Generator[Tuple[Any, Any], None, None]:
+        """generate_data_batches, minus any batches an earlier run already wrote to a resumed submission."""
+        num_written = self.submission_writer.num_batches if self.submission_writer is not None else 0
+        data_batches = self.generate_data_batches()
+        row_ids = None
+        for _ in range(num_written):
+            try:
+                _, row_ids = next(data_batches)
+            except StopIteration:
+                raise GatewayRuntimeError(
+                    GatewayRuntimeErrorType.GATEWAY_RAISED_EXCEPTION, f'Resumed submission has {num_written} batches but the data has fewer'
+                ) from None
+        if isinstance(row_ids, _VALID_ROW_ID_SCALAR_TYPES) and row_ids != self.submission_writer.last_row_id:
+            raise GatewayRuntimeError(
+                GatewayRuntimeErrorType.GATEWAY_RAISED_EXCEPTION,
+                f'Resumed submission ends at row ID {self.submission_writer.last_row_id} but the data has {row_ids} at that batch',
+            )
+        if self.timings is None:
+            yield from data_batches
+            return
+        while True:
+            start_time = time.perf_counter()
+            try:
+                data_batch = next(data_batches)
+            except StopIteration:
+                return
+            self.timings.record_seconds('generate_data_batch', time.perf_counter() - start_time)
+            yield data_batch
+
+    def _collect_predictions(self, all_predictions: List[Any], all_row_ids: List[Any], predictions_batches: List[Any], row_ids_batches: List[Any]) -> None:
+        """Keep validated predictions for the submission, either in memory or by writing them out immediately."""
+        if self.submission_writer is None:
+            all_predictions.extend(predictions_batches)
+            all_row_ids.extend(row_ids_batches)
+            return
+        for predictions, row_ids in zip(predictions_batches, row_ids_batches):
+            last_row_id = row_ids if isinstance(row_ids, _VALID_ROW_ID_SCALAR_TYPES) else None
+            try:
+                with self._timed('write_submission_batch'):
+                    self.submission_writer.append(self._build_submission([predictions], [row_ids]), last_row_id)
+            except ValueError as err:
+                raise GatewayRuntimeError(GatewayRuntimeErrorType.INVALID_SUBMISSION, f'Inconsistent prediction types: {err}') from None
+
+    def _group_data_batches(self, group_size: int) -> Generator[Tuple[List[Any], List[Any]], None, None]:
+        """Collect consecutive outputs of generate_data_batches into lists of at most group_size data batches and row IDs."""
+        data_batches = []
+        row_ids_batches = []
+        for data_batch, row_ids in self._iter_data_batches():
+            data_batches.append(data_batch)
+            row_ids_batches.append(row_ids)
+            if len(data_batches) == group_size:
+                yield data_batches, row_ids_batches
+                data_batches, row_ids_batches = [], []
+        if data_batches:
+            yield data_batches, row_ids_batches
+
+    def _get_all_predictions_batched(self) -> Tuple[List[Any], List[Any]]:
+        all_predictions = []
+        all_row_ids = []
+        for data_batches, row_ids_batches in self._group_data_batches(self.replay_batch_size):
+            predictions_batches = self._predict_uncached('predict_batch', data_batches)
+            self._validate_predictions_batches(predictions_batches, row_ids_batches, data_batches)
+            self._collect_predictions(all_predictions, all_row_ids, predictions_batches, row_ids_batches)
+        return all_predictions, all_row_ids
+
+    def _get_all_predictions_pipelined(self) -> Tuple[List[Any], List[Any]]:
+        endpoint = 'predict' if self.replay_batch_size is None else 'predict_batch'
+        prepared_requests = queue.Queue(maxsize=self.pipeline_depth)
+        stop_preparing = threading.Event()
+
+        def put(item) -> bool:
+            while not stop_preparing.is_set():
+                try:
+                    prepared_requests.put(item, timeout=_PIPELINE_POLL_SECONDS)
+                    return True
+                except queue.Full:
+                    continue
+            return False
+
+        def prepare_requests() -> None:
+            try:
+                for data_batches, row_ids_batches in self._group_data_batches(self.replay_batch_size or 1):
+                    if not put((data_batches, row_ids_batches, *self._prepare_request(endpoint, data_batches))):
+                        return
+                put(None)
+            except BaseException as err:
+                put(err)
+
+        preparer = threading.Thread(target=prepare_requests, name='gateway-request-preparer', daemon=True)
+        preparer.start()
+        # A single worker keeps validation in the same order as the predictions.
+        validator = futures.ThreadPoolExecutor(max_workers=1, thread_name_prefix='gateway-validator')
+        validations = []
+        num_checked_validations = 0
+        all_predictions = []
+        all_row_ids = []
+
+        def validate_and_collect(predictions_batches, row_ids_batches, data_batches) -> None:
+            self._validate_predictions_batches(predictions_batches, row_ids_batches, data_batches)
+            self._collect_predictions(all_predictions, all_row_ids, predictions_batches, row_ids_batches)
+
+        try:
+            while True:
+                item = prepared_requests.get()
+                if item is None:
+                    break
+                if isinstance(item, BaseException):
+                    raise item
+                data_batches, row_ids_batches, request, cached_predictions, cache_keys = item
+
+                # Surface validation failures from earlier batches before sending more requests.
+                while num_checked_validations < len(validations) and validations[num_checked_validations].done():
+                    validations[num_checked_validations].result()
+                    num_checked_validations += 1
+
+                try:
+                    predictions_batches = cached_predictions
+                    if request is not None:
+                        predictions = self._send_prepared_request(endpoint, request, _num_uncached(cached_predictions))
+                        predictions_batches = self._merge_cached_predictions(endpoint, predictions, cached_predictions, cache_keys)
+                except BaseException:
+                    # Earlier batches failing validation takes precedence, as it would when running sequentially.
+                    for validation in validations[num_checked_validations:]:
+                        validation.result()
+                    raise
+                validations.append(validator.submit(validate_and_collect, predictions_batches, row_ids_batches, data_batches))
+
+            for validation in validations[num_checked_validations:]:
+                validation.result()
+            return all_predictions, all_row_ids
+        finally:
+            stop_preparing.set()
+            validator.shutdown(cancel_futures=True)
+            preparer.join()
+
+    def _get_all_predictions_streamed(self) -> Tuple[List[Any], List[Any]]:
+        endpoint = 'predict' if self.replay_batch_size is None else 'predict_batch'
+        all_predictions = []
+        all_row_ids = []
+        stream = None
+        awaiting_response = collections.deque()
+
+        def receive_and_validate() -> None:
+            data_batches, row_ids_batches, sent_request, cached_predictions, cache_keys = awaiting_response.popleft()
+            predictions_batches = cached_predictions
+            if sent_request:
+                try:
+                    predictions = stream.receive(deadline_seconds=self.client.endpoint_deadline_seconds * _num_uncached(cached_predictions))
+                except Exception as e:
+                    self.handle_server_error(e, endpoint)
+                predictions_batches = self._merge_cached_predictions(endpoint, predictions, cached_predictions, cache_keys)
+            self._validate_predictions_batches(predictions_batches, row_ids_batches, data_batches)
+            self._collect_predictions(all_predictions, all_row_ids, predictions_batches, row_ids_batches)
+
+        try:
+            for data_batches, row_ids_batches in self._group_data_batches(self.replay_batch_size or 1):
+                request, cached_predictions, cache_keys = self._prepare_request(endpoint, data_batches)
+
+                if stream is None and request is not None:
+                    # Only earlier batches that were all cached can be waiting, and they're validated first.
+                    while awaiting_response:
+                        receive_and_validate()
+                    # The first request goes through the unary path, which also waits for the server to start.
+                    predictions = self._send_prepared_request(endpoint, request, _num_uncached(cached_predictions))
+                    predictions_batches = self._merge_cached_predictions(endpoint, predictions, cached_predictions, cache_keys)
+                    self._validate_predictions_batches(predictions_batches, row_ids_batches, data_batches)
+                    self._collect_predictions(all_predictions, all_row_ids, predictions_batches, row_ids_batches)
+                    stream = self.client.open_stream(self.stream_max_in_flight)
+                    continue
+
+                if len(awaiting_response) == self.stream_max_in_flight:
+                    receive_and_validate()
+                if request is not None:
+                    stream.submit(request)
+                awaiting_response.append((data_batches, row_ids_batches, request is not None, cached_predictions, cache_keys))
+            while awaiting_response:
+                receive_and_validate()
+        finally:
+            if stream is not None:
+                stream.close()
+        return all_predictions, all_row_ids
+
+    def _make_async_client(self, channel_address: Optional[str] = None, port: Optional[int] = None) -> kaggle_evaluation.core.relay.AsyncClient:
+        """An AsyncClient with self.client's transport settings, for the server at channel_address and port, or the
+        server self.client connected to by default.
+        """
+        if channel_address is None:
+            # Shared, as it's already been negotiated with this server.
+            compression_policy, channel_address, port = self.client.compression_policy, self.client.channel_address, self.client.port
+        else:
+            compression_policy = None
+        client = kaggle_evaluation.core.relay.AsyncClient(
+            channel_address, compression_policy=compression_policy, port=port, schema_cache=self.client.schema_cache is not None
+        )
+        if self.client.shared_memory is not None:
+            client.set_shared_memory(True, self.client.shared_memory.min_size_bytes)
+        client.endpoint_deadline_seconds = self.client.endpoint_deadline_seconds
+        client.set_timings(self.timings)
+        return client
+
+    async def _get_all_predictions_async(self) -> Tuple[List[Any], List[Any]]:
+        endpoint = 'predict' if self.replay_batch_size is None else 'predict_batch'
+        if self.ensemble_servers is None:
+            clients = [self._make_async_client()]
+        else:
+            clients = [self._make_async_client(address, port) for address, port in self.ensemble_servers]
+            # Requests are serialized once for every server, so the clients share the schemas they've sent.
+            for client in clients[1:]:
+                client.schema_cache = clients[0].schema_cache
+        max_in_flight = self.async_max_in_flight or 1
+        all_predictions = []
+        all_row_ids = []
+        awaiting_response = collections.deque()
+
+        async def receive_and_validate() -> None:
+            data_batches, row_ids_batches, responses, cached_predictions, cache_keys = awaiting_response.popleft()
+            predictions_batches = cached_predictions
+            if responses is not None:
+                # As in streamed replay, each deadline starts once its response is awaited rather than when it was sent.
+                num_data_batches = _num_uncached(cached_predictions)
+                try:
+                    responses = await asyncio.gather(
+                        *(
+                            client.receive(response, deadline_seconds=client.endpoint_deadline_seconds * num_data_batches)
+                            for client, response in zip(clients, responses)
+                        )
+                    )
+                except Exception as e:
+                    # Finish cancelling the other calls while the channels are still open, so none outlive the loop.
+                    for response in responses:
+                        response.cancel()
+                    await asyncio.gather(*responses, return_exceptions=True)
+                    self.handle_server_error(e, endpoint)
+                predictions = responses[0] if self.ensemble_servers is None else self._blend_predictions(endpoint, responses)
+                predictions_batches = self._merge_cached_predictions(endpoint, predictions, cached_predictions, cache_keys)
+            self._validate_predictions_batches(predictions_batches, row_ids_batches, data_batches)
+            self._collect_predictions(all_predictions, all_row_ids, predictions_batches, row_ids_batches)
+
+        try:
+            sent_first_request = False
+            for data_batches, row_ids_batches in self._group_data_batches(self.replay_batch_size or 1):
+                cached_predictions, cache_keys = self._lookup_cached_predictions(data_batches)
+                request = self._serialize_uncached(endpoint, data_batches, cached_predictions, clients[0])
+                requests = [
+                    request if client.can_send_requests_from(clients[0]) else self._serialize_uncached(endpoint, data_batches, cached_predictions, client)
+                    for client in clients
+                ]
+                if len(awaiting_response) == max_in_flight:
+                    await receive_and_validate()
+                responses = None
+                if requests[0] is not None:
+                    responses = [client.submit(request) for client, request in zip(clients, requests)]
+                    # Let the calls start before preparing the next request.
+                    await asyncio.sleep(0)
+                awaiting_response.append((data_batches, row_ids_batches, responses, cached_predictions, cache_keys))
+                if responses is not None and not sent_first_request:
+                    # The first request waits for the server to start up and negotiates the transport, so it's answered
+                    # before any other is sent. Only earlier batches that were all cached can be waiting ahead of it.
+                    while awaiting_response:
+                        await receive_and_validate()
+                    sent_first_request = True
+            while awaiting_response:
+                await receive_and_validate()
+            return all_predictions, all_row_ids
+        finally:
+            pending_responses = [response for _, _, responses, _, _ in awaiting_response for response in responses or ()]
+            for response in pending_responses:
+                response.cancel()
+            await asyncio.gather(*pending_responses, return_exceptions=True)
+            # Every channel is closed before asyncio.run closes the loop, even if closing one of them fails.
+            await asyncio.gather(*(client.close() for client in clients), return_exceptions=True)
+
+    def _blend_predictions(self, endpoint: str, responses: List[Any]) -> Any:
+        """Combine each ensemble server's response into a single `predict` or `predict_batch` response."""
+        with self._timed('blend_predictions'):
+            if endpoint == 'predict_batch':
+                if any(not isinstance(predictions, list) or len(predictions) != len(responses[0]) for predictions in responses):
+                    raise GatewayRuntimeError(
+                        GatewayRuntimeErrorType.INVALID_SUBMISSION, 'predict_batch must return a list with one prediction per data batch from every server'
+                    )
+            try:
+                if endpoint == 'predict':
+                    return self.ensemble_blend(list(responses))
+                return [self.ensemble_blend(list(predictions)) for predictions in zip(*responses)]
+            except GatewayRuntimeError:
+                raise
+            except Exception as err:
+                # The inputs are the servers' predictions, so they're the likely cause.
+                raise GatewayRuntimeError(GatewayRuntimeErrorType.INVALID_SUBMISSION, f'Failed to blend the ensemble\'s predictions: {err}') from None
+
+    def _lookup_cached_predictions(self, data_batches: List[Any]) -> Tuple[List[Any], Optional[List[str]]]:
+        """The prediction cache's prediction for each data batch, or _NOT_CACHED, and their keys. Without an active
+        cache, every data batch is _NOT_CACHED and the keys are None.
+        """
+        if self.prediction_cache is None or self.model_version is None:
+            return [_NOT_CACHED] * len(data_batches), None
+        with self._timed('prediction_cache_lookup'):
+            cache_keys = [self.prediction_cache.key(self.model_version, data_batch) for data_batch in data_batches]
+            return [self.prediction_cache.get(key, _NOT_CACHED) for key in cache_keys], cache_keys
+
+    def _merge_cached_predictions(self, endpoint: str, predictions: Any, cached_predictions: List[Any], cache_keys: Optional[List[str]]) -> Any:
+        """Combine the server's response for the data batches that weren't cached with the cached predictions, in
+        order, and cache the new predictions. Returns a list with one prediction per data batch, or the unchecked
+        `predict_batch` response if there's no active cache.
+        """
+        if endpoint == 'predict':
+            predictions = [predictions]
+        if cache_keys is None:
+            return predictions
+        uncached_indices = [i for i, prediction in enumerate(cached_predictions) if prediction is _NOT_CACHED]
+        if not isinstance(predictions, list) or len(predictions) != len(uncached_indices):
+            raise GatewayRuntimeError(
+                GatewayRuntimeErrorType.INVALID_SUBMISSION,
+                f'predict_batch must return a list with one prediction per data batch ({len(uncached_indices)} expected)',
+            )
+        predictions_batches = list(cached_predictions)
+        for i, prediction in zip(uncached_indices, predictions):
+            predictions_batches[i] = prediction
+            self.prediction_cache.put(cache_keys[i], prediction)
+        return predictions_batches
+
+    def _predict_uncached(self, endpoint: str, data_batches: List[Any]) -> Any:
+        """Predictions for each data batch, only calling `predict` or `predict_batch` for those that aren't cached."""
+        cached_predictions, cache_keys = self._lookup_cached_predictions(data_batches)
+        uncached_data_batches = [data_batch for data_batch, prediction in zip(data_batches, cached_predictions) if prediction is _NOT_CACHED]
+        if not uncached_data_batches:
+            return cached_predictions
+        if endpoint == 'predict':
+            predictions = self.predict(*uncached_data_batches[0])
+        else:
+            predictions = self.predict_batch(uncached_data_batches)
+        return self._merge_cached_predictions(endpoint, predictions, cached_predictions, cache_keys)
+
+    def _prepare_request(self, endpoint: str, data_batches: List[Any]) -> Tuple[Optional[Any], List[Any], Optional[List[str]]]:
+        """Serialize a request for the data batches that aren't cached, or None if they all are, along with the
+        results of `_lookup_cached_predictions`.
+        """
+        cached_predictions, cache_keys = self._lookup_cached_predictions(data_batches)
+        return self._serialize_uncached(endpoint, data_batches, cached_predictions, self.client), cached_predictions, cache_keys
+
+    def _serialize_uncached(
+        self, endpoint: str, data_batches: List[Any], cached_predictions: List[Any], client: kaggle_evaluation.core.relay.Client
+    ) -> Optional[Any]:
+        """A request for the data batches that aren't cached, serialized for client, or None if they all are."""
+        uncached_data_batches = [data_batch for data_batch, prediction in zip(data_batches, cached_predictions) if prediction is _NOT_CACHED]
+        if not uncached_data_batches:
+            return None
+        if endpoint == 'predict':
+            return client.serialize_request(endpoint, *uncached_data_batches[0])
+        return client.serialize_request(endpoint, uncached_data_batches)
+
+    def _send_prepared_request(self, endpoint: str, request: Any, num_data_batches: int) -> Any:
+        try:
+            return self.client.send_request(request, deadline_seconds=self.client.endpoint_deadline_seconds * num_data_batches)
+        except Exception as e:
+            self.handle_server_error(e, endpoint)
+
+    def _validate_predictions_batches(self, predictions_batches: Any, row_ids_batches: List[Any], data_batches: List[Any]) -> List[Any]:
+        """Run both validation stages on each prediction unpacked from a multi-batch response."""
+        if not isinstance(predictions_batches, list) or len(predictions_batches) != len(data_batches):
+            raise GatewayRuntimeError(
+                GatewayRuntimeErrorType.INVALID_SUBMISSION,
+                f'predict_batch must return a list with one prediction per data batch ({len(data_batches)} expected)',
+            )
+        for predictions, row_ids, data_batch in zip(predictions_batches, row_ids_batches, data_batches):
+            self._validate_predictions(predictions, row_ids, data_batch)
+        return predictions_batches
+
+    def _validate_predictions(self, predictions: Any, row_ids: Any, data_batch: Any) -> None:
+        with self._timed('competition_agnostic_validation'):
             self.competition_agnostic_validation(predictions, row_ids)
+        with self._timed('competition_specific_validation'):
             self.competition_specific_validation(predictions, row_ids, data_batch)
-            all_predictions.append(predictions)
-            all_row_ids.append(row_ids)
-        return all_predictions, all_row_ids
+
+    def wait_for_server(self) -> None:
+        """Connect to the inference server and confirm it's handling requests before sending any data, so that the
+        first `predict` call's latency reflects the model rather than the connection setup.
+
+        Also fetches the input columns the server declared it reads, if any, into `required_columns`. Competition
+        gateways can use them to drop unused columns from the data they send. Likewise fetches the server's
+        `model_version`, which keys the prediction cache.
+
+        With an ensemble, waits for every server instead. The required columns are then the union of the servers'
+        columns, and the model version combines every server's version with the blend function's name. Predictions
+        aren't cached if the blend has no distinct name, e.g. if it's a lambda.
+        """
+        try:
+            if self.ensemble_servers is None:
+                self.required_columns, self.model_version = self._read_server_declarations(self.client)
+            else:
+                self._wait_for_ensemble()
+        except Exception as e:
+            self.handle_server_error(e, kaggle_evaluation.core.relay.READY_ENDPOINT)
+        if self.prediction_cache is not None and self.model_version is None:
+            if self.ensemble_servers is not None and self._ensemble_blend_name() is None:
+                reason = f'the ensemble blend {self.ensemble_blend} has no name that tells it apart from other blends; use a module level function'
+            else:
+                reason = 'the inference server did not report a model_version'
+            warnings.warn(f'Not caching predictions, as {reason}', category=RuntimeWarning)
+
+    def _read_server_declarations(self, client: kaggle_evaluation.core.relay.Client) -> Tuple[Optional[List[str]], Optional[str]]:
+        """Wait until client's server is ready, then fetch the input columns and model version it declared, if any."""
+        endpoints = client.wait_until_ready() or []
+        required_columns, model_version = None, None
+        if kaggle_evaluation.core.relay.COLUMNS_ENDPOINT in endpoints:
+            required_columns = list(client.send(kaggle_evaluation.core.relay.COLUMNS_ENDPOINT))
+        if kaggle_evaluation.core.relay.MODEL_VERSION_ENDPOINT in endpoints:
+            model_version = str(client.send(kaggle_evaluation.core.relay.MODEL_VERSION_ENDPOINT))
+        return required_columns, model_version
+
+    def _wait_for_ensemble(self) -> None:
+        """wait_for_server for every ensemble server, fixing the port of any server that was given without one."""
+        declarations = []
+        for i, (address, port) in enumerate(self.ensemble_servers):
+            client = kaggle_evaluation.core.relay.Client(address, port=port)
+            try:
+                declarations.append(self._read_server_declarations(client))
+            finally:
+                client.close()
+            self.ensemble_servers[i] = (address, client.port)
+
+        if all(required_columns is not None for required_columns, _ in declarations):
+            self.required_columns = list(dict.fromkeys(column for required_columns, _ in declarations for column in required_columns))
+        blend_name = self._ensemble_blend_name()
+        if blend_name is not None and all(model_version is not None for _, model_version in declarations):
+            self.model_version = f'{blend_name}({", ".join(model_version for _, model_version in declarations)})'
+
+    def _ensemble_blend_name(self) -> Optional[str]:
+        """The blend's import path, or None if that wouldn't tell it apart from other blends, as for lambdas, nested
+        functions and callable objects, whose predictions mustn't share cache entries.
+        """
+        qualname = getattr(self.ensemble_blend, '__qualname__', None)
+        if qualname is None or '<' in qualname:
+            return None
+        return f'{self.ensemble_blend.__module__}.{qualname}'
+
+    def predict_batch(self, data_batches: List[Any]) -> Any:
+        """Sends several data batches to the user container in a single request, instructing it to generate a
+        `predict_batch` response. Each data batch is the tuple of arguments `predict` would have received.
+
+        The deadline scales with the number of data batches so that each one keeps the usual response timeout.
+
+        Returns:
+            Any: The predictions from the user container, expected to be a list with one entry per data batch.
+        """
+        request = self.client.serialize_request('predict_batch', list(data_batches))
+        return self._send_prepared_request('predict_batch', request, len(data_batches))
 
     def predict(self, *args, **kwargs) -> Any:
         """self.predict will send all data in args and kwargs to the user container, and
@@ -117,8 +762,15 @@ class BaseGateway:
         error = None
         try:
             self.unpack_data_paths()
+            self.wait_for_server()
+            if self.incremental_submission:
+                self.submission_writer = kaggle_evaluation.core.submission_writer.SubmissionWriter(self.submission_path, resume=self.resume_submission)
             predictions, row_ids = self.get_all_predictions()
-            self.write_submission(predictions, row_ids)
+            with self._timed('write_submission'):
+                if self.submission_writer is not None:
+                    self.submission_writer.finalize()
+                else:
+                    self.write_submission(predictions, row_ids)
         except kaggle_evaluation.core.base_gateway.GatewayRuntimeError as gre:
             error = gre
         except Exception:
@@ -130,9 +782,16 @@ class BaseGateway:
                 kaggle_evaluation.core.base_gateway.GatewayRuntimeErrorType.GATEWAY_RAISED_EXCEPTION, error_str
             )
 
+        if self.submission_writer is not None:
+            # Leaves the checkpoint in place if the run failed, so that it can be resumed.
+            self.submission_writer.close()
         self.client.close()
         if self.server:
             self.server.stop(0)
+        if self.timings is not None:
+            # Written even if the run failed, as the timings may show why.
+            self.timings.write_json(f'{self.submission_path}{_TIMINGS_JSON_SUFFIX}')
+            self.timings.write_csv(f'{self.submission_path}{_TIMINGS_CSV_SUFFIX}')
 
         if kaggle_evaluation.core.base_gateway.IS_RERUN:
             self.write_result(error)
@@ -316,12 +975,12 @@ class BaseGateway:
                 f'Invalid data_batches type passed to `_create_submission_dataframe`. Got {type(data_batches)}; expected a list, DataFrame, or Series',
             )
 
-    def write_submission(
+    def _build_submission(
         self,
         predictions: Union[List, pl.Series, pl.DataFrame, pd.Series, pd.DataFrame],
         row_ids: Union[List, pl.Series, pl.DataFrame, pd.Series, pd.DataFrame],
-    ) -> None:
-        """Export the predictions to a submission.parquet."""
+    ) -> Union[pl.DataFrame, pd.DataFrame]:
+        """Combine predictions and row IDs into a single submission DataFrame with the row ID columns first."""
         submission = self._convert_to_df(predictions, self.target_column_name)
         row_ids = self._convert_to_df(row_ids, self.row_id_column_name)
 
@@ -332,15 +991,27 @@ class BaseGateway:
         # Existing row ID columns may be overwritten, but that's fine.
         if isinstance(submission, pd.DataFrame):
             submission.loc[:, row_ids.columns] = row_ids
-            submission[desired_column_order].to_parquet('submission.parquet', index=False)
+            return submission[desired_column_order]
         elif isinstance(submission, pl.DataFrame):
             submission = submission.with_columns(row_ids)
-            submission.select(desired_column_order).write_parquet('submission.parquet')
+            return submission.select(desired_column_order)
         else:
             raise GatewayRuntimeError(
                 GatewayRuntimeErrorType.GATEWAY_RAISED_EXCEPTION, f"Unsupported predictions type {type(submission)}; can't write submission file"
             )
 
+    def write_submission(
+        self,
+        predictions: Union[List, pl.Series, pl.DataFrame, pd.Series, pd.DataFrame],
+        row_ids: Union[List, pl.Series, pl.DataFrame, pd.Series, pd.DataFrame],
+    ) -> None:
+        """Export the predictions to self.submission_path, submission.parquet by default."""
+        submission = self._build_submission(predictions, row_ids)
+        if isinstance(submission, pd.DataFrame):
+            submission.to_parquet(self.submission_path, index=False)
+        else:
+            submission.write_parquet(self.submission_path)
+
     def write_result(self, error: Optional[GatewayRuntimeError] = None) -> None:
         """Export a result.json containing error details if applicable."""
         result = {'Succeeded': error is None}
@@ -368,7 +1039,8 @@ class BaseGateway:
             message_match = re.search('"Exception calling application: (.*)"', exception_str, re.IGNORECASE)
             message = message_match.group(1) if message_match else exception_str
             raise GatewayRuntimeError(GatewayRuntimeErrorType.SERVER_RAISED_EXCEPTION, message) from None
-        if isinstance(exception, grpc._channel._InactiveRpcError):
+        # Covers failed unary calls and failed streams alike.
+        if isinstance(exception, grpc.RpcError):
             raise GatewayRuntimeError(GatewayRuntimeErrorType.SERVER_CONNECTION_FAILED, exception_str) from None
         if isinstance(exception, kaggle_evaluation.core.relay.GRPCDeadlineError):
             raise GatewayRuntimeError(GatewayRuntimeErrorType.GRPC_DEADLINE_EXCEEDED, exception_str) from None
@@ -0,0 +1,218 @@
+"""Reproducible benchmarks for payload serialization and unary round trips.
+
+Every payload type that `relay._serialize` accepts is benchmarked with fixed random data, with DataFrames at several
+widths and lengths. Results are plain dicts, written as JSON along with the package versions and transport settings
+used, so that runs with different settings or code can be compared mechanically.
+
+Run from the command line with `python -m kaggle_evaluation.core.benchmark --output results.json`.
+"""
+
+import argparse
+import importlib.metadata
+import io
+import json
+import os
+import platform
+import time
+
+from typing import Any, Callable, Dict, List, Optional
+
+import numpy as np
+import polars as pl
+
+import kaggle_evaluation
+import kaggle_evaluation.core.relay
+
+
+# (rows, columns) of the benchmarked DataFrames. One row by a few hundred columns matches a typical time series batch.
+FRAME_SHAPES = ((1, 10), (1, 100), (1, 1_000), (1_000, 10), (1_000, 100), (100_000, 10))
+ARRAY_LENGTHS = (1_000, 100_000)
+# Each measurement repeats until it has taken at least this long, and at least _MIN_REPEATS times.
+_MIN_SECONDS = 0.2
+_MIN_REPEATS = 5
+_PACKAGES = ('grpcio', 'numpy', 'pandas', 'polars', 'protobuf', 'pyarrow')
+
+
+def sample_payloads(seed: int = 0) -> Dict[str, Any]:
+    """One value of each supported payload type, plus DataFrames, Series and arrays of several sizes, by name."""
+    rng = np.random.default_rng(seed)
+    payloads = {
+        'str': 'x' * 100,
+        'bool': True,
+        'int': 12345,
+        'float': 1.5,
+        'none': None,
+        'numpy_scalar': np.float64(1.5),
+        'bytes_io': io.BytesIO(rng.bytes(1 << 16)),
+        'nested_list': [[i, float(i), str(i)] for i in range(1_000)],
+        'float_list': rng.standard_normal(1_000).tolist(),
+        'nested_tuple': tuple((i, float(i)) for i in range(1_000)),
+        'nested_dict': {f'key_{i}': {'values': [i, i + 1], 'name': str(i)} for i in range(1_000)},
+    }
+    for rows, columns in FRAME_SHAPES:
+        frame = pl.DataFrame(rng.standard_normal((rows, columns)), schema=[f'column_{i}' for i in range(columns)])
+        payloads[f'polars_dataframe_{rows}x{columns}'] = frame
+        payloads[f'pandas_dataframe_{rows}x{columns}'] = frame.to_pandas()
+    for length in ARRAY_LENGTHS:
+        values = rng.standard_normal(length)
+        payloads[f'polars_series_{length}'] = pl.Series('values', values)
+        payloads[f'pandas_series_{length}'] = pl.Series('values', values).to_pandas()
+        payloads[f'numpy_array_{length}'] = values
+    return payloads
+
+
+def _time_calls(function: Callable[[], Any]) -> List[float]:
+    """Durations of repeated calls, after one warm-up call."""
+    function()
+    samples = []
+    start_time = time.perf_counter()
+    while len(samples) < _MIN_REPEATS or time.perf_counter() - start_time < _MIN_SECONDS:
+        call_start_time = time.perf_counter()
+        function()
+        samples.append(time.perf_counter() - call_start_time)
+    return samples
+
+
+def _summarize(samples: List[float], payload_bytes: Optional[int] = None) -> dict:
+    values = np.asarray(samples)
+    summary = {
+        'repeats': len(values),
+        'seconds_median': float(np.median(values)),
+        'seconds_min': float(values.min()),
+        'seconds_p90': float(np.percentile(values, 90)),
+    }
+    if payload_bytes is not None:
+        summary['payload_bytes'] = payload_bytes
+        summary['megabytes_per_second'] = payload_bytes / summary['seconds_median'] / 1e6
+    return summary
+
+
+def benchmark_serialization(codec: str = 'none', schema_cache: bool = False, numpy_buffers: bool = False, seed: int = 0) -> List[dict]:
+    """Time `_serialize` and `_deserialize` for every sample payload.
+
+    Args:
+        codec: Compression codec for DataFrame and Series payloads, one of relay.COMPRESSION_CODECS.
+        schema_cache: Encode polars DataFrames as record batches whose schema the receiver has already cached.
+        numpy_buffers: Encode numpy values as raw buffers and pack lists of scalars into arrays.
+        seed: Seed for the sample data.
+
+    Returns:
+        One result per payload and direction. Throughput is relative to the serialized size.
+    """
+    results = []
+    for name, value in sample_payloads(seed).items():
+        compression_policy = kaggle_evaluation.core.relay.CompressionPolicy(codec)
+        cache = kaggle_evaluation.core.relay.ArrowSchemaCache() if schema_cache else None
+
+        def serialize():
+            return kaggle_evaluation.core.relay._serialize(value, compression_policy, schema_cache=cache, numpy_buffers=numpy_buffers)
+
+        payload = serialize()
+        if cache is not None:
+            # The first payload registers its schema with the receiving side, later ones omit it.
+            kaggle_evaluation.core.relay._deserialize(payload)
+            cache.confirm([payload])
+            payload = serialize()
+        payload_bytes = payload.ByteSize()
+        results.append({'benchmark': 'serialize', 'payload': name, **_summarize(_time_calls(serialize), payload_bytes)})
+        results.append(
+            {
+                'benchmark': 'deserialize',
+                'payload': name,
+                **_summarize(_time_calls(lambda: kaggle_evaluation.core.relay._deserialize(payload)), payload_bytes),
+            }
+        )
+    return results
+
+
+def _acknowledge(*args, **kwargs) -> None:
+    return None
+
+
+def benchmark_round_trip(
+    payload_names: Optional[List[str]] = None, shared_memory: bool = False, schema_cache: bool = False, codec: Optional[str] = None, seed: int = 0
+) -> List[dict]:
+    """Time unary requests carrying each payload to a local server started with `define_server`.
+
+    The server's listener returns None, so each round trip is dominated by sending the payload.
+
+    Args:
+        payload_names: Which sample payloads to send. Defaults to every DataFrame.
+        shared_memory: Enable the client's shared memory transport.
+        schema_cache: Enable the client's schema cache.
+        codec: Compression codec for requests. Defaults to the client's default for a local server.
+        seed: Seed for the sample data.
+    """
+    payloads = sample_payloads(seed)
+    if payload_names is None:
+        payload_names = [name for name in payloads if '_dataframe_' in name]
+    port = kaggle_evaluation.core.relay._get_available_port()
+    server = kaggle_evaluation.core.relay.define_server(_acknowledge, port=port)
+    server.start()
+    compression_policy = kaggle_evaluation.core.relay.CompressionPolicy(codec) if codec is not None else None
+    client = kaggle_evaluation.core.relay.Client(
+        port=port, compression_policy=compression_policy, shared_memory=shared_memory, schema_cache=schema_cache
+    )
+    try:
+        # The first request negotiates the transport and has no deadline.
+        client.send('_acknowledge')
+        results = []
+        for name in payload_names:
+            samples = _time_calls(lambda: client.send('_acknowledge', payloads[name]))
+            results.append({'benchmark': 'round_trip', 'payload': name, **_summarize(samples)})
+        return results
+    finally:
+        client.close()
+        server.stop(0)
+
+
+def environment() -> dict:
+    """The versions and machine details that benchmark results depend on."""
+    packages = {}
+    for package in _PACKAGES:
+        try:
+            packages[package] = importlib.metadata.version(package)
+        except importlib.metadata.PackageNotFoundError:
+            packages[package] = None
+    return {
+        'kaggle_evaluation': kaggle_evaluation.__version__,
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'cpu_count': os.cpu_count(),
+        'packages': packages,
+        'timestamp': time.strftime('%Y-%m-%dT%H:%M:%S%z'),
+    }
+
+
+def write_results(path: str, results: List[dict], settings: dict) -> None:
+    """Write benchmark results as JSON, along with the settings used and the environment."""
+    with open(path, 'w') as f_open:
+        json.dump({'environment': environment(), 'settings': settings, 'results': results}, f_open, indent=2)
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description='Benchmark KaggleEvaluation payload serialization and round trips.')
+    parser.add_argument('--output', default='benchmark_results.json', help='Where to write the JSON results.')
+    parser.add_argument('--codec', default='none', choices=kaggle_evaluation.core.relay.COMPRESSION_CODECS)
+    parser.add_argument('--shared-memory', action='store_true', help='Use the shared memory transport for round trips.')
+    parser.add_argument('--schema-cache', action='store_true', help='Send polars DataFrames with cached schemas.')
+    parser.add_argument('--numpy-buffers', action='store_true', help='Serialize numpy values as raw buffers.')
+    parser.add_argument('--skip-round-trip', action='store_true')
+    parser.add_argument('--seed', type=int, default=0)
+    args = parser.parse_args()
+
+    settings = {
+        'codec': args.codec,
+        'shared_memory': args.shared_memory,
+        'schema_cache': args.schema_cache,
+        'numpy_buffers': args.numpy_buffers,
+        'seed': args.seed,
+    }
+    results = benchmark_serialization(args.codec, args.schema_cache, args.numpy_buffers, args.seed)
+    if not args.skip_round_trip:
+        results += benchmark_round_trip(shared_memory=args.shared_memory, schema_cache=args.schema_cache, codec=args.codec, seed=args.seed)
+    write_results(args.output, results, settings)
+
+
+if __name__ == '__main__':
+    main()
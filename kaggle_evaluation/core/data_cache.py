@@ -0,0 +1,110 @@
+"""Persistent columnar cache for gateway input files.
+
+Parsing wide CSVs dominates gateway startup for long replays. The first read of a CSV converts it to an
+uncompressed Arrow IPC file which later runs memory map instead of re-parsing, so repeated reads are bound by
+page cache rather than CSV parsing.
+
+Cache entries are keyed by the absolute path of the source file. Each entry records the source file's size,
+modification time and content hash; a stale size or mtime triggers a rehash, and the entry is only rebuilt if the
+content actually changed.
+"""
+
+import hashlib
+import json
+import os
+import pathlib
+
+from typing import Optional, Tuple, Union
+
+import polars as pl
+
+
+CACHE_DIR_ENV_VAR = 'KAGGLE_EVALUATION_CACHE_DIR'
+_DEFAULT_CACHE_DIR = os.path.join(os.path.expanduser('~'), '.cache', 'kaggle_evaluation')
+_HASH_CHUNK_BYTES = 1 << 20
+# Bump this if the on-disk layout changes so that stale entries are ignored rather than misread.
+_CACHE_FORMAT_VERSION = 1
+
+
+def default_cache_dir() -> str:
+    return os.getenv(CACHE_DIR_ENV_VAR, _DEFAULT_CACHE_DIR)
+
+
+def _hash_file(path: str) -> str:
+    digest = hashlib.blake2b(digest_size=20)
+    with open(path, 'rb') as f_open:
+        for chunk in iter(lambda: f_open.read(_HASH_CHUNK_BYTES), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def _write_json_atomic(path: str, contents: dict) -> None:
+    tmp_path = f'{path}.{os.getpid()}.tmp'
+    with open(tmp_path, 'w') as f_open:
+        json.dump(contents, f_open)
+    os.replace(tmp_path, path)
+
+
+class DataCache:
+    """Converts CSV files to memory mapped Arrow IPC files on first use.
+
+    Args:
+        cache_dir: Directory for cache entries. Defaults to $KAGGLE_EVALUATION_CACHE_DIR or ~/.cache/kaggle_evaluation.
+    """
+
+    def __init__(self, cache_dir: Optional[Union[str, pathlib.Path]] = None):
+        self.cache_dir = str(cache_dir) if cache_dir else default_cache_dir()
+        os.makedirs(self.cache_dir, exist_ok=True)
+
+    def _entry_paths(self, source_path: str) -> Tuple[str, str]:
+        entry_name = hashlib.blake2b(source_path.encode(), digest_size=16).hexdigest()
+        entry_base = os.path.join(self.cache_dir, entry_name)
+        return entry_base + '.arrow', entry_base + '.json'
+
+    def cached_path(self, path: Union[str, pathlib.Path]) -> str:
+        """Return the path of an up-to-date Arrow IPC copy of the CSV at `path`, building it if necessary."""
+        source_path = os.path.abspath(path)
+        data_path, metadata_path = self._entry_paths(source_path)
+        stat = os.stat(source_path)
+
+        metadata = None
+        if os.path.exists(metadata_path) and os.path.exists(data_path):
+            try:
+                with open(metadata_path) as f_open:
+                    metadata = json.load(f_open)
+            except (OSError, ValueError):
+                metadata = None
+        if metadata is not None and metadata.get('format_version') != _CACHE_FORMAT_VERSION:
+            metadata = None
+
+        if metadata is not None and metadata['size'] == stat.st_size and metadata['mtime_ns'] == stat.st_mtime_ns:
+            return data_path
+
+        content_hash = _hash_file(source_path)
+        if metadata is None or metadata['hash'] != content_hash:
+            tmp_data_path = f'{data_path}.{os.getpid()}.tmp'
+            # Stream the conversion so that files larger than memory can be cached.
+            pl.scan_csv(source_path).sink_ipc(tmp_data_path, compression='uncompressed', engine='streaming')
+            os.replace(tmp_data_path, data_path)
+
+        _write_json_atomic(
+            metadata_path,
+            {
+                'format_version': _CACHE_FORMAT_VERSION,
+                'source_path': source_path,
+                'size': stat.st_size,
+                'mtime_ns': stat.st_mtime_ns,
+                'hash': content_hash,
+            },
+        )
+        return data_path
+
+    def read_csv(self, path: Union[str, pathlib.Path]) -> pl.DataFrame:
+        """Drop-in replacement for `pl.read_csv(path)` backed by the cache."""
+        return pl.read_ipc(self.cached_path(path), memory_map=True)
+
+    def invalidate(self, path: Union[str, pathlib.Path]) -> None:
+        """Remove the cache entry for a single source file, if one exists."""
+        for entry_path in self._entry_paths(os.path.abspath(path)):
+            if os.path.exists(entry_path):
+                os.remove(entry_path)
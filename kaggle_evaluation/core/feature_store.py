@@ -0,0 +1,219 @@
+"""Incremental rolling features for inference servers.
+
+Time series models typically derive the same features on every `predict` call: returns over a few lags, rolling
+means and volatilities of those returns, spreads between columns. Recomputing them from a history DataFrame that
+grows (and is re-concatenated) by one row per call makes each call slower than the last.
+
+RollingFeatureStore keeps the recent history in preallocated ring buffers, one row per update, alongside running sums
+for each rolling window. Each update is a fixed number of vectorized operations over the columns regardless of how
+much history has been seen, and every feature is read straight from the buffers.
+"""
+
+import threading
+
+from typing import Callable, Dict, List, Optional, Sequence, Union
+
+import numpy as np
+import polars as pl
+
+
+class RollingFeatureStore:
+    """Rolling window statistics over a fixed set of numeric columns, updated one row at a time.
+
+    Rolling statistics are computed over one step returns: differences of log values if log_returns is set, otherwise
+    differences of the raw values. Missing values are NaN and are skipped by the rolling statistics.
+
+    Args:
+        column_names: The columns to track. If None, every numeric column of the first frame passed to `update` other
+            than those in exclude_columns.
+        windows: Rolling window lengths, in updates.
+        max_lag: The longest lag that `lagged` and `log_return` will be asked for.
+        log_returns: Take logs of the values before differencing; non-positive values become NaN.
+        exclude_columns: Columns to ignore when inferring column_names, e.g. row IDs.
+    """
+
+    def __init__(
+        self,
+        column_names: Optional[Sequence[str]] = None,
+        windows: Sequence[int] = (5, 20),
+        max_lag: int = 4,
+        log_returns: bool = True,
+        exclude_columns: Sequence[str] = (),
+    ):
+        if not windows or min(windows) < 1:
+            raise ValueError(f'Windows must be positive, got {windows}')
+        if max_lag < 1:
+            raise ValueError(f'max_lag must be positive, got {max_lag}')
+        self.windows = tuple(sorted(set(windows)))
+        self.max_lag = max_lag
+        self.log_returns = log_returns
+        self.exclude_columns = tuple(exclude_columns)
+        # One more row than the longest lookback, so that the row leaving a window is still in the buffer.
+        self.capacity = max(max(self.windows), max_lag) + 1
+        self.column_names: Optional[List[str]] = None
+        self.num_updates = 0
+        if column_names is not None:
+            self._allocate(list(column_names))
+
+    def _allocate(self, column_names: List[str]) -> None:
+        self.column_names = column_names
+        self._feature_names: Optional[List[str]] = None
+        num_columns = len(column_names)
+        self._column_indices = {name: i for i, name in enumerate(column_names)}
+        self._values = np.full((self.capacity, num_columns), np.nan)
+        self._returns = np.full((self.capacity, num_columns), np.nan)
+        self._sums = {window: np.zeros(num_columns) for window in self.windows}
+        self._sums_of_squares = {window: np.zeros(num_columns) for window in self.windows}
+        self._counts = {window: np.zeros(num_columns, dtype=np.int64) for window in self.windows}
+
+    def reset(self) -> None:
+        """Forget every update, keeping the columns."""
+        self.num_updates = 0
+        if self.column_names is not None:
+            self._allocate(self.column_names)
+
+    def _row_to_array(self, row: Union[np.ndarray, pl.DataFrame]) -> np.ndarray:
+        if isinstance(row, pl.DataFrame):
+            if len(row) != 1:
+                raise ValueError(f'The feature store is updated one row at a time, got {len(row)} rows')
+            if self.column_names is None:
+                self._allocate([name for name, dtype in row.schema.items() if dtype.is_numeric() and name not in self.exclude_columns])
+            # Converting the numpy array is much cheaper than casting the columns of a single row frame.
+            return row[self.column_names].to_numpy().astype(np.float64)[0]
+        row = np.asarray(row, dtype=np.float64)
+        if self.column_names is None:
+            self._allocate([str(i) for i in range(len(row))])
+        if row.shape != (len(self.column_names),):
+            raise ValueError(f'Expected {len(self.column_names)} values, got an array of shape {row.shape}')
+        return row
+
+    def _slot(self, lag: int = 0) -> int:
+        """The ring buffer position of the row from `lag` updates ago."""
+        return (self.num_updates - 1 - lag) % self.capacity
+
+    def update(self, row: Union[np.ndarray, pl.DataFrame]) -> None:
+        """Add the next row, e.g. the single row test batch passed to `predict`."""
+        values = self._row_to_array(row)
+        if self.log_returns:
+            with np.errstate(divide='ignore', invalid='ignore'):
+                values = np.log(np.where(values > 0, values, np.nan))
+        step_return = values - self._values[self._slot()] if self.num_updates > 0 else np.full_like(values, np.nan)
+
+        for window in self.windows:
+            if self.num_updates >= window:
+                leaving = self._returns[self._slot(window - 1)]
+                leaving_mask = ~np.isnan(leaving)
+                self._sums[window] -= np.where(leaving_mask, leaving, 0.0)
+                self._sums_of_squares[window] -= np.where(leaving_mask, leaving**2, 0.0)
+                self._counts[window] -= leaving_mask
+            entering_mask = ~np.isnan(step_return)
+            self._sums[window] += np.where(entering_mask, step_return, 0.0)
+            self._sums_of_squares[window] += np.where(entering_mask, step_return**2, 0.0)
+            self._counts[window] += entering_mask
+
+        self.num_updates += 1
+        slot = self._slot()
+        self._values[slot] = values
+        self._returns[slot] = step_return
+        if self.num_updates % self.capacity == 0:
+            self._refresh_sums()
+
+    def _refresh_sums(self) -> None:
+        """Recompute the running sums from the buffers, so that floating point drift can't accumulate. Amortized over
+        a full cycle of the ring buffer this costs one extra pass per update.
+        """
+        for window in self.windows:
+            recent = self.history(window, returns=True)
+            self._sums[window] = np.nansum(recent, axis=0)
+            self._sums_of_squares[window] = np.nansum(recent**2, axis=0)
+            self._counts[window] = (~np.isnan(recent)).sum(axis=0)
+
+    def column_indices(self, names: Sequence[str]) -> np.ndarray:
+        """Positions of the named columns in the arrays returned by this store."""
+        return np.array([self._column_indices[name] for name in names], dtype=np.int64)
+
+    def lagged(self, lag: int = 0) -> np.ndarray:
+        """The (log) values from `lag` updates ago, or NaN if there weren't that many updates."""
+        if not 0 <= lag <= self.max_lag:
+            raise ValueError(f'Lag must be between 0 and {self.max_lag}, got {lag}')
+        if lag >= self.num_updates:
+            return np.full(len(self.column_names), np.nan)
+        return self._values[self._slot(lag)].copy()
+
+    def log_return(self, lag: int = 1) -> np.ndarray:
+        """Return over the last `lag` updates: a log return if log_returns is set, otherwise a difference."""
+        if lag < 1:
+            raise ValueError(f'Lag must be positive, got {lag}')
+        return self.lagged(0) - self.lagged(lag)
+
+    def spread(self, first_columns: np.ndarray, second_columns: np.ndarray, lag: int = 1) -> np.ndarray:
+        """Differences between the returns of pairs of columns, given as index arrays from `column_indices`."""
+        returns = self.log_return(lag)
+        return returns[first_columns] - returns[second_columns]
+
+    def rolling_mean(self, window: int) -> np.ndarray:
+        """Mean of the one step returns in the window, NaN where there are none."""
+        counts = self._counts[window]
+        with np.errstate(divide='ignore', invalid='ignore'):
+            return np.where(counts > 0, self._sums[window] / counts, np.nan)
+
+    def rolling_std(self, window: int) -> np.ndarray:
+        """Sample standard deviation of the one step returns in the window, NaN where there are fewer than two."""
+        counts = self._counts[window]
+        with np.errstate(divide='ignore', invalid='ignore'):
+            means = self._sums[window] / counts
+            variances = (self._sums_of_squares[window] - counts * means**2) / (counts - 1)
+        return np.where(counts > 1, np.sqrt(np.maximum(variances, 0.0)), np.nan)
+
+    def history(self, length: int, returns: bool = False) -> np.ndarray:
+        """The last `length` rows of (log) values, or one step returns, oldest first. Rows before the first update
+        are NaN.
+        """
+        if not 0 < length <= self.capacity:
+            raise ValueError(f'History length must be between 1 and {self.capacity}, got {length}')
+        buffer = self._returns if returns else self._values
+        slots = (self.num_updates - length + np.arange(length)) % self.capacity
+        rows = buffer[slots]
+        rows[: max(length - self.num_updates, 0)] = np.nan
+        return rows
+
+    def features(self) -> Dict[str, np.ndarray]:
+        """Every standard feature for the latest row: returns at each lag, rolling means and volatilities."""
+        features = {f'return_{lag}': self.log_return(lag) for lag in range(1, self.max_lag + 1)}
+        for window in self.windows:
+            features[f'mean_{window}'] = self.rolling_mean(window)
+            features[f'volatility_{window}'] = self.rolling_std(window)
+        return features
+
+    def features_frame(self) -> pl.DataFrame:
+        """`features` as a single row DataFrame, with columns named `<column>_<feature>`."""
+        features = self.features()
+        if self._feature_names is None:
+            self._feature_names = [f'{column}_{name}' for name in features for column in self.column_names]
+        return pl.from_numpy(np.concatenate(list(features.values()))[np.newaxis, :], schema=self._feature_names)
+
+
+class FeatureStoreListener:
+    """Wraps an endpoint listener so that every call first updates a feature store, which the listener can then read.
+
+    The store only sees every call if the listener runs in the serving process, so this can't be combined with a
+    server process pool. Calls are serialized by a lock, as the store's updates aren't thread safe and the listener
+    must read the store as its own update left it, so a server with several workers runs one call at a time.
+
+    Args:
+        listener: The endpoint function, e.g. `predict`.
+        feature_store: The store to update.
+        argument_index: Which positional argument of each call to pass to `feature_store.update`.
+    """
+
+    def __init__(self, listener: Callable, feature_store: RollingFeatureStore, argument_index: int = 0):
+        self.__name__ = listener.__name__
+        self.listener = listener
+        self.feature_store = feature_store
+        self.argument_index = argument_index
+        self._lock = threading.Lock()
+
+    def __call__(self, *args, **kwargs):
+        with self._lock:
+            self.feature_store.update(args[self.argument_index])
+            return self.listener(*args, **kwargs)
@@ -14,7 +14,7 @@ _sym_db = _symbol_database.Default()
 
 
 
-DESCRIPTOR = _descriptor_pool.Default().AddSerializedFile(b'\n\x17kaggle_evaluation.proto\x12\x18kaggle_evaluation_client\"\xf9\x01\n\x17KaggleEvaluationRequest\x12\x0c\n\x04name\x18\x01 \x01(\t\x12/\n\x04\x61rgs\x18\x02 \x03(\x0b\x32!.kaggle_evaluation_client.Payload\x12M\n\x06kwargs\x18\x03 \x03(\x0b\x32=.kaggle_evaluation_client.KaggleEvaluationRequest.KwargsEntry\x1aP\n\x0bKwargsEntry\x12\x0b\n\x03key\x18\x01 \x01(\t\x12\x30\n\x05value\x18\x02 \x01(\x0b\x32!.kaggle_evaluation_client.Payload:\x02\x38\x01\"N\n\x18KaggleEvaluationResponse\x12\x32\n\x07payload\x18\x01 \x01(\x0b\x32!.kaggle_evaluation_client.Payload\"\x8d\x04\n\x07Payload\x12\x13\n\tstr_value\x18\x01 \x01(\tH\x00\x12\x14\n\nbool_value\x18\x02 \x01(\x08H\x00\x12\x13\n\tint_value\x18\x03 \x01(\x12H\x00\x12\x15\n\x0b\x66loat_value\x18\x04 \x01(\x02H\x00\x12\x14\n\nnone_value\x18\x05 \x01(\x08H\x00\x12;\n\nlist_value\x18\x06 \x01(\x0b\x32%.kaggle_evaluation_client.PayloadListH\x00\x12<\n\x0btuple_value\x18\x07 \x01(\x0b\x32%.kaggle_evaluation_client.PayloadListH\x00\x12:\n\ndict_value\x18\x08 \x01(\x0b\x32$.kaggle_evaluation_client.PayloadMapH\x00\x12 \n\x16pandas_dataframe_value\x18\t \x01(\x0cH\x00\x12 \n\x16polars_dataframe_value\x18\n \x01(\x0cH\x00\x12\x1d\n\x13pandas_series_value\x18\x0b \x01(\x0cH\x00\x12\x1d\n\x13polars_series_value\x18\x0c \x01(\x0cH\x00\x12\x1b\n\x11numpy_array_value\x18\r \x01(\x0cH\x00\x12\x1c\n\x12numpy_scalar_value\x18\x0e \x01(\x0cH\x00\x12\x18\n\x0e\x62ytes_io_value\x18\x0f \x01(\x0cH\x00\x42\x07\n\x05value\"B\n\x0bPayloadList\x12\x33\n\x08payloads\x18\x01 \x03(\x0b\x32!.kaggle_evaluation_client.Payload\"\xad\x01\n\nPayloadMap\x12I\n\x0bpayload_map\x18\x01 \x03(\x0b\x32\x34.kaggle_evaluation_client.PayloadMap.PayloadMapEntry\x1aT\n\x0fPayloadMapEntry\x12\x0b\n\x03key\x18\x01 \x01(\t\x12\x30\n\x05value\x18\x02 \x01(\x0b\x32!.kaggle_evaluation_client.Payload:\x02\x38\x01\x32\x8a\x01\n\x17KaggleEvaluationService\x12o\n\x04Send\x12\x31.kaggle_evaluation_client.KaggleEvaluationRequest\x1a\x32.kaggle_evaluation_client.KaggleEvaluationResponse\"\x00\x62\x06proto3')
+DESCRIPTOR = _descriptor_pool.Default().AddSerializedFile(b'\n\x17kaggle_evaluation.proto\x12\x18kaggle_evaluation_client\"\xf9\x01\n\x17KaggleEvaluationRequest\x12\x0c\n\x04name\x18\x01 \x01(\t\x12/\n\x04\x61rgs\x18\x02 \x03(\x0b\x32!.kaggle_evaluation_client.Payload\x12M\n\x06kwargs\x18\x03 \x03(\x0b\x32=.kaggle_evaluation_client.KaggleEvaluationRequest.KwargsEntry\x1aP\n\x0bKwargsEntry\x12\x0b\n\x03key\x18\x01 \x01(\t\x12\x30\n\x05value\x18\x02 \x01(\x0b\x32!.kaggle_evaluation_client.Payload:\x02\x38\x01\"\xd0\x01\n\x18KaggleEvaluationResponse\x12\x32\n\x07payload\x18\x01 \x01(\x0b\x32!.kaggle_evaluation_client.Payload\x12P\n\x07timings\x18\x02 \x03(\x0b\x32?.kaggle_evaluation_client.KaggleEvaluationResponse.TimingsEntry\x1a.\n\x0cTimingsEntry\x12\x0b\n\x03key\x18\x01 \x01(\t\x12\r\n\x05value\x18\x02 \x01(\x01:\x02\x38\x01\"\xd4\x07\n\x07Payload\x12\x13\n\tstr_value\x18\x01 \x01(\tH\x00\x12\x14\n\nbool_value\x18\x02 \x01(\x08H\x00\x12\x13\n\tint_value\x18\x03 \x01(\x12H\x00\x12\x15\n\x0b\x66loat_value\x18\x04 \x01(\x02H\x00\x12\x14\n\nnone_value\x18\x05 \x01(\x08H\x00\x12;\n\nlist_value\x18\x06 \x01(\x0b\x32%.kaggle_evaluation_client.PayloadListH\x00\x12<\n\x0btuple_value\x18\x07 \x01(\x0b\x32%.kaggle_evaluation_client.PayloadListH\x00\x12:\n\ndict_value\x18\x08 \x01(\x0b\x32$.kaggle_evaluation_client.PayloadMapH\x00\x12 \n\x16pandas_dataframe_value\x18\t \x01(\x0cH\x00\x12 \n\x16polars_dataframe_value\x18\n \x01(\x0cH\x00\x12\x1d\n\x13pandas_series_value\x18\x0b \x01(\x0cH\x00\x12\x1d\n\x13polars_series_value\x18\x0c \x01(\x0cH\x00\x12\x1b\n\x11numpy_array_value\x18\r \x01(\x0cH\x00\x12\x1c\n\x12numpy_scalar_value\x18\x0e \x01(\x0cH\x00\x12\x18\n\x0e\x62ytes_io_value\x18\x0f \x01(\x0cH\x00\x12K\n\x13shared_memory_value\x18\x10 \x01(\x0b\x32,.kaggle_evaluation_client.SharedMemoryHandleH\x00\x12S\n\x1bpolars_record_batches_value\x18\x11 \x01(\x0b\x32,.kaggle_evaluation_client.ArrowRecordBatchesH\x00\x12I\n\x18numpy_buffer_array_value\x18\x12 \x01(\x0b\x32%.kaggle_evaluation_client.NumpyBufferH\x00\x12J\n\x19numpy_buffer_scalar_value\x18\x13 \x01(\x0b\x32%.kaggle_evaluation_client.NumpyBufferH\x00\x12\x42\n\x11packed_list_value\x18\x14 \x01(\x0b\x32%.kaggle_evaluation_client.NumpyBufferH\x00\x12H\n\x17packed_numpy_list_value\x18\x15 \x01(\x0b\x32%.kaggle_evaluation_client.NumpyBufferH\x00\x42\x07\n\x05value\"9\n\x0bNumpyBuffer\x12\r\n\x05\x64type\x18\x01 \x01(\t\x12\r\n\x05shape\x18\x02 \x03(\x04\x12\x0c\n\x04\x64\x61ta\x18\x03 \x01(\x0c\"E\n\x12\x41rrowRecordBatches\x12\x11\n\tschema_id\x18\x01 \x01(\x06\x12\x0e\n\x06schema\x18\x02 \x01(\x0c\x12\x0c\n\x04\x62ody\x18\x03 \x01(\x0c\"0\n\x12SharedMemoryHandle\x12\x0c\n\x04name\x18\x01 \x01(\t\x12\x0c\n\x04kind\x18\x02 \x01(\t\"B\n\x0bPayloadList\x12\x33\n\x08payloads\x18\x01 \x03(\x0b\x32!.kaggle_evaluation_client.Payload\"\xad\x01\n\nPayloadMap\x12I\n\x0bpayload_map\x18\x01 \x03(\x0b\x32\x34.kaggle_evaluation_client.PayloadMap.PayloadMapEntry\x1aT\n\x0fPayloadMapEntry\x12\x0b\n\x03key\x18\x01 \x01(\t\x12\x30\n\x05value\x18\x02 \x01(\x0b\x32!.kaggle_evaluation_client.Payload:\x02\x38\x01\x32\x85\x02\n\x17KaggleEvaluationService\x12o\n\x04Send\x12\x31.kaggle_evaluation_client.KaggleEvaluationRequest\x1a\x32.kaggle_evaluation_client.KaggleEvaluationResponse\"\x00\x12y\n\nSendStream\x12\x31.kaggle_evaluation_client.KaggleEvaluationRequest\x1a\x32.kaggle_evaluation_client.KaggleEvaluationResponse\"\x00(\x01\x30\x01\x62\x06proto3')
 
 _globals = globals()
 _builder.BuildMessageAndEnumDescriptors(DESCRIPTOR, _globals)
@@ -23,22 +23,32 @@ if _descriptor._USE_C_DESCRIPTORS == False:
   DESCRIPTOR._options = None
   _globals['_KAGGLEEVALUATIONREQUEST_KWARGSENTRY']._options = None
   _globals['_KAGGLEEVALUATIONREQUEST_KWARGSENTRY']._serialized_options = b'8\001'
+  _globals['_KAGGLEEVALUATIONRESPONSE_TIMINGSENTRY']._options = None
+  _globals['_KAGGLEEVALUATIONRESPONSE_TIMINGSENTRY']._serialized_options = b'8\001'
   _globals['_PAYLOADMAP_PAYLOADMAPENTRY']._options = None
   _globals['_PAYLOADMAP_PAYLOADMAPENTRY']._serialized_options = b'8\001'
   _globals['_KAGGLEEVALUATIONREQUEST']._serialized_start=54
   _globals['_KAGGLEEVALUATIONREQUEST']._serialized_end=303
   _globals['_KAGGLEEVALUATIONREQUEST_KWARGSENTRY']._serialized_start=223
   _globals['_KAGGLEEVALUATIONREQUEST_KWARGSENTRY']._serialized_end=303
-  _globals['_KAGGLEEVALUATIONRESPONSE']._serialized_start=305
-  _globals['_KAGGLEEVALUATIONRESPONSE']._serialized_end=383
-  _globals['_PAYLOAD']._serialized_start=386
-  _globals['_PAYLOAD']._serialized_end=911
-  _globals['_PAYLOADLIST']._serialized_start=913
-  _globals['_PAYLOADLIST']._serialized_end=979
-  _globals['_PAYLOADMAP']._serialized_start=982
-  _globals['_PAYLOADMAP']._serialized_end=1155
-  _globals['_PAYLOADMAP_PAYLOADMAPENTRY']._serialized_start=1071
-  _globals['_PAYLOADMAP_PAYLOADMAPENTRY']._serialized_end=1155
-  _globals['_KAGGLEEVALUATIONSERVICE']._serialized_start=1158
-  _globals['_KAGGLEEVALUATIONSERVICE']._serialized_end=1296
+  _globals['_KAGGLEEVALUATIONRESPONSE']._serialized_start=306
+  _globals['_KAGGLEEVALUATIONRESPONSE']._serialized_end=514
+  _globals['_KAGGLEEVALUATIONRESPONSE_TIMINGSENTRY']._serialized_start=468
+  _globals['_KAGGLEEVALUATIONRESPONSE_TIMINGSENTRY']._serialized_end=514
+  _globals['_PAYLOAD']._serialized_start=517
+  _globals['_PAYLOAD']._serialized_end=1497
+  _globals['_NUMPYBUFFER']._serialized_start=1499
+  _globals['_NUMPYBUFFER']._serialized_end=1556
+  _globals['_ARROWRECORDBATCHES']._serialized_start=1558
+  _globals['_ARROWRECORDBATCHES']._serialized_end=1627
+  _globals['_SHAREDMEMORYHANDLE']._serialized_start=1629
+  _globals['_SHAREDMEMORYHANDLE']._serialized_end=1677
+  _globals['_PAYLOADLIST']._serialized_start=1679
+  _globals['_PAYLOADLIST']._serialized_end=1745
+  _globals['_PAYLOADMAP']._serialized_start=1748
+  _globals['_PAYLOADMAP']._serialized_end=1921
+  _globals['_PAYLOADMAP_PAYLOADMAPENTRY']._serialized_start=1837
+  _globals['_PAYLOADMAP_PAYLOADMAPENTRY']._serialized_end=1921
+  _globals['_KAGGLEEVALUATIONSERVICE']._serialized_start=1924
+  _globals['_KAGGLEEVALUATIONSERVICE']._serialized_end=2185
 # @@protoc_insertion_point(module_scope)
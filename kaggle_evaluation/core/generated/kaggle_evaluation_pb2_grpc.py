@@ -19,6 +19,11 @@ class KaggleEvaluationServiceStub(object):
                 request_serializer=kaggle__evaluation__pb2.KaggleEvaluationRequest.SerializeToString,
                 response_deserializer=kaggle__evaluation__pb2.KaggleEvaluationResponse.FromString,
                 )
+        self.SendStream = channel.stream_stream(
+                '/kaggle_evaluation_client.KaggleEvaluationService/SendStream',
+                request_serializer=kaggle__evaluation__pb2.KaggleEvaluationRequest.SerializeToString,
+                response_deserializer=kaggle__evaluation__pb2.KaggleEvaluationResponse.FromString,
+                )
 
 
 class KaggleEvaluationServiceServicer(object):
@@ -30,6 +35,13 @@ class KaggleEvaluationServiceServicer(object):
         context.set_details('Method not implemented!')
         raise NotImplementedError('Method not implemented!')
 
+    def SendStream(self, request_iterator, context):
+        """Keeps a single call open for many requests, such as a full replay. Responses are sent in request order.
+        """
+        context.set_code(grpc.StatusCode.UNIMPLEMENTED)
+        context.set_details('Method not implemented!')
+        raise NotImplementedError('Method not implemented!')
+
 
 def add_KaggleEvaluationServiceServicer_to_server(servicer, server):
     rpc_method_handlers = {
@@ -38,6 +50,11 @@ def add_KaggleEvaluationServiceServicer_to_server(servicer, server):
                     request_deserializer=kaggle__evaluation__pb2.KaggleEvaluationRequest.FromString,
                     response_serializer=kaggle__evaluation__pb2.KaggleEvaluationResponse.SerializeToString,
             ),
+            'SendStream': grpc.stream_stream_rpc_method_handler(
+                    servicer.SendStream,
+                    request_deserializer=kaggle__evaluation__pb2.KaggleEvaluationRequest.FromString,
+                    response_serializer=kaggle__evaluation__pb2.KaggleEvaluationResponse.SerializeToString,
+            ),
     }
     generic_handler = grpc.method_handlers_generic_handler(
             'kaggle_evaluation_client.KaggleEvaluationService', rpc_method_handlers)
@@ -64,3 +81,20 @@ class KaggleEvaluationService(object):
             kaggle__evaluation__pb2.KaggleEvaluationResponse.FromString,
             options, channel_credentials,
             insecure, call_credentials, compression, wait_for_ready, timeout, metadata)
+
+    @staticmethod
+    def SendStream(request_iterator,
+            target,
+            options=(),
+            channel_credentials=None,
+            call_credentials=None,
+            insecure=False,
+            compression=None,
+            wait_for_ready=None,
+            timeout=None,
+            metadata=None):
+        return grpc.experimental.stream_stream(request_iterator, target, '/kaggle_evaluation_client.KaggleEvaluationService/SendStream',
+            kaggle__evaluation__pb2.KaggleEvaluationRequest.SerializeToString,
+            kaggle__evaluation__pb2.KaggleEvaluationResponse.FromString,
+            options, channel_credentials,
+            insecure, call_credentials, compression, wait_for_ready, timeout, metadata)
@@ -0,0 +1,84 @@
+"""Timing and payload size measurements for the gateway loop and the relay.
+
+Every stage of a request's life is recorded as one sample per occurrence: generating the data batch, serializing
+the request, the round trip, the inference server's own deserialization, listener call and response serialization,
+deserializing the response, and both validation stages. The server measures its stages itself and returns them with
+each response, so the network's share of a round trip is the round trip minus the server stages.
+
+Samples are kept in memory and summarized as percentiles when written out, which is cheap even for long replays.
+"""
+
+import collections
+import contextlib
+import csv
+import json
+import threading
+import time
+
+from typing import Dict, Iterator, List, Optional
+
+import numpy as np
+
+
+PERCENTILES = (50, 90, 99)
+_SUMMARY_FIELDS = ['stage', 'unit', 'count', 'total', 'mean'] + [f'p{i}' for i in PERCENTILES] + ['max']
+
+
+class StageTimings:
+    """Collects durations, in seconds, and payload sizes, in bytes, for named stages. Safe to share between threads.
+
+    Args:
+        response_timeout_seconds: The per-request response budget, included in the exported summary for reference.
+    """
+
+    def __init__(self, response_timeout_seconds: Optional[float] = None):
+        self.response_timeout_seconds = response_timeout_seconds
+        self._seconds: Dict[str, List[float]] = collections.defaultdict(list)
+        self._bytes: Dict[str, List[int]] = collections.defaultdict(list)
+        self._lock = threading.Lock()
+
+    def record_seconds(self, stage: str, seconds: float) -> None:
+        with self._lock:
+            self._seconds[stage].append(seconds)
+
+    def record_bytes(self, stage: str, num_bytes: int) -> None:
+        with self._lock:
+            self._bytes[stage].append(num_bytes)
+
+    @contextlib.contextmanager
+    def time(self, stage: str) -> Iterator[None]:
+        """Record how long the body of a `with` statement takes, including if it raises."""
+        start_time = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.record_seconds(stage, time.perf_counter() - start_time)
+
+    def samples(self, stage: str) -> List[float]:
+        """Every recorded sample for a stage, in seconds or bytes."""
+        with self._lock:
+            return list(self._seconds.get(stage) or self._bytes.get(stage) or [])
+
+    def summary(self) -> List[dict]:
+        """One row per stage with the sample count, total, mean, percentiles and maximum, in recording order."""
+        with self._lock:
+            samples_by_stage = [(stage, 'seconds', list(samples)) for stage, samples in self._seconds.items()]
+            samples_by_stage += [(stage, 'bytes', list(samples)) for stage, samples in self._bytes.items()]
+        rows = []
+        for stage, unit, samples in samples_by_stage:
+            values = np.asarray(samples, dtype=np.float64)
+            row = {'stage': stage, 'unit': unit, 'count': len(values), 'total': float(values.sum()), 'mean': float(values.mean())}
+            row.update({f'p{i}': float(value) for i, value in zip(PERCENTILES, np.percentile(values, PERCENTILES))})
+            row['max'] = float(values.max())
+            rows.append(row)
+        return rows
+
+    def write_json(self, path: str) -> None:
+        with open(path, 'w') as f_open:
+            json.dump({'response_timeout_seconds': self.response_timeout_seconds, 'stages': self.summary()}, f_open, indent=2)
+
+    def write_csv(self, path: str) -> None:
+        with open(path, 'w', newline='') as f_open:
+            writer = csv.DictWriter(f_open, fieldnames=_SUMMARY_FIELDS)
+            writer.writeheader()
+            writer.writerows(self.summary())
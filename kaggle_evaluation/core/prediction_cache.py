@@ -0,0 +1,172 @@
+"""Persistent cache of inference server predictions, for replaying the same data against an unchanged model.
+
+Replays are often rerun with nothing but the gateway's own downstream code changed: validation, submission writing or
+scoring. Each `predict` response is stored on disk under a hash of its arguments, serialized canonically, and the
+model version the inference server reports, so later replays can skip the inference round trip for those batches.
+
+Entries for each model version live in their own directory, so that a version can be invalidated by removing its
+directory in one step. The least recently used entries are evicted once the cache exceeds its size limit. Entries are
+written atomically, and unreadable entries are treated as misses, so concurrent replays can safely share a cache.
+"""
+
+import hashlib
+import os
+import pathlib
+import shutil
+import threading
+import uuid
+
+from typing import Any, List, Optional, Sequence, Tuple, Union
+
+import kaggle_evaluation.core.data_cache
+import kaggle_evaluation.core.relay
+from kaggle_evaluation.core.generated import kaggle_evaluation_pb2 as kaggle_evaluation_proto
+
+
+_DEFAULT_MAX_SIZE_BYTES = 1 << 30
+# Once over the size limit, evict down to this fraction of it so that eviction doesn't run on every write.
+_EVICTION_TARGET_FRACTION = 0.9
+_ENTRY_SUFFIX = '.payload'
+_REMOVED_DIR_SUFFIX = '.removed'
+# Bump this if the key or entry format changes so that stale entries are ignored rather than misread.
+_CACHE_FORMAT_VERSION = 1
+
+
+def default_cache_dir() -> str:
+    return os.path.join(kaggle_evaluation.core.data_cache.default_cache_dir(), 'predictions')
+
+
+def _version_dir_name(model_version: str) -> str:
+    return hashlib.blake2b(f'{_CACHE_FORMAT_VERSION}:{model_version}'.encode(), digest_size=16).hexdigest()
+
+
+class PredictionCache:
+    """Stores `predict` responses on disk, keyed by the request's arguments and the model version.
+
+    Only use this with inference servers whose predictions depend on nothing but their arguments: cached batches never
+    reach the server, so a model that keeps state across calls, e.g. in a feature store, would see gaps.
+
+    Args:
+        cache_dir: Directory for cache entries. Defaults to a `predictions` directory in the data cache directory.
+        max_size_bytes: Evict the least recently used entries once the entries add up to more than this.
+    """
+
+    def __init__(self, cache_dir: Optional[Union[str, pathlib.Path]] = None, max_size_bytes: int = _DEFAULT_MAX_SIZE_BYTES):
+        if max_size_bytes < 1:
+            raise ValueError(f'max_size_bytes must be positive, got {max_size_bytes}')
+        self.cache_dir = str(cache_dir) if cache_dir else default_cache_dir()
+        self.max_size_bytes = max_size_bytes
+        os.makedirs(self.cache_dir, exist_ok=True)
+        self._lock = threading.Lock()
+        # An estimate, as other processes may share the cache. Eviction recounts from disk.
+        self._size_bytes = sum(size for _, _, size in self._entries())
+
+    def _version_dirs(self) -> List[str]:
+        return [entry.path for entry in os.scandir(self.cache_dir) if entry.is_dir() and not entry.name.endswith(_REMOVED_DIR_SUFFIX)]
+
+    def _entries(self) -> List[Tuple[str, float, int]]:
+        """The path, last access time and size of every entry, for every model version."""
+        entries = []
+        for version_dir in self._version_dirs():
+            try:
+                version_entries = [entry for entry in os.scandir(version_dir) if entry.name.endswith(_ENTRY_SUFFIX)]
+            except FileNotFoundError:
+                continue  # Invalidated by another process.
+            for entry in version_entries:
+                try:
+                    stat = entry.stat()
+                except FileNotFoundError:
+                    continue  # Evicted by another process.
+                entries.append((entry.path, stat.st_mtime, stat.st_size))
+        return entries
+
+    def key(self, model_version: str, args: Sequence[Any]) -> str:
+        """The cache key for a `predict` call with these positional arguments.
+
+        The arguments are hashed as they would be sent with no compression, shared memory or schema caching, so the
+        key doesn't depend on how the gateway's transport is configured.
+        """
+        payload = kaggle_evaluation.core.relay._serialize(list(args), kaggle_evaluation.core.relay.CompressionPolicy('none'))
+        digest = hashlib.blake2b(payload.SerializeToString(deterministic=True), digest_size=20).hexdigest()
+        return os.path.join(_version_dir_name(model_version), digest)
+
+    def _path(self, key: str) -> str:
+        return os.path.join(self.cache_dir, key + _ENTRY_SUFFIX)
+
+    def get(self, key: str, default: Any = None) -> Any:
+        """The cached prediction for key, or default if there isn't a readable one."""
+        path = self._path(key)
+        try:
+            with open(path, 'rb') as f_open:
+                payload = kaggle_evaluation_proto.Payload.FromString(f_open.read())
+            prediction = kaggle_evaluation.core.relay._deserialize(payload)
+        except FileNotFoundError:
+            return default
+        except Exception:
+            # Shouldn't happen as entries are written atomically, but a damaged entry must never be returned.
+            self._remove(path)
+            return default
+        try:
+            # The modification time doubles as the last access time for eviction, as atime is often disabled.
+            os.utime(path)
+        except FileNotFoundError:
+            pass
+        return prediction
+
+    def put(self, key: str, prediction: Any) -> None:
+        """Store a prediction. Failing to store one doesn't affect the replay, so errors are ignored."""
+        path = self._path(key)
+        data = kaggle_evaluation.core.relay._serialize(prediction, kaggle_evaluation.core.relay.CompressionPolicy('none')).SerializeToString()
+        tmp_path = f'{path}.{os.getpid()}.{uuid.uuid4().hex}.tmp'
+        try:
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            with open(tmp_path, 'wb') as f_open:
+                f_open.write(data)
+            os.replace(tmp_path, path)
+        except OSError:
+            self._remove(tmp_path)
+            return
+        with self._lock:
+            self._size_bytes += len(data)
+            over_limit = self._size_bytes > self.max_size_bytes
+        if over_limit:
+            self._evict()
+
+    def _remove(self, path: str) -> None:
+        try:
+            os.remove(path)
+        except FileNotFoundError:
+            pass
+
+    def _evict(self) -> None:
+        """Remove the least recently used entries until the cache is back under its target size."""
+        with self._lock:
+            entries = sorted(self._entries(), key=lambda entry: entry[1])
+            size_bytes = sum(size for _, _, size in entries)
+            target_bytes = self.max_size_bytes * _EVICTION_TARGET_FRACTION
+            for path, _, entry_bytes in entries:
+                if size_bytes <= target_bytes:
+                    break
+                self._remove(path)
+                size_bytes -= entry_bytes
+            self._size_bytes = size_bytes
+
+    def invalidate(self, model_version: Optional[str] = None) -> None:
+        """Remove every entry for one model version, or for all versions if model_version is None.
+
+        Each version's directory is renamed before it's deleted, so other replays sharing the cache see either every
+        entry or none of them.
+        """
+        if model_version is None:
+            version_dirs = self._version_dirs()
+        else:
+            version_dirs = [os.path.join(self.cache_dir, _version_dir_name(model_version))]
+        for version_dir in version_dirs:
+            removed_dir = f'{version_dir}.{uuid.uuid4().hex}{_REMOVED_DIR_SUFFIX}'
+            try:
+                os.rename(version_dir, removed_dir)
+            except FileNotFoundError:
+                continue
+            shutil.rmtree(removed_dir, ignore_errors=True)
+        with self._lock:
+            self._size_bytes = sum(size for _, _, size in self._entries())
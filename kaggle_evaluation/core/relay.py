@@ -5,15 +5,29 @@ special data science types like DataFrames or np.ndarrays, with gRPC + protobuf
 as a backing implementation.
 """
 
+import asyncio
+import collections
+import contextlib
+import functools
+import hashlib
 import io
+import ipaddress
 import json
+import multiprocessing
+import os
+import queue
+import re
 import socket
+import tempfile
+import threading
 import time
+import urllib.parse
 
 from concurrent import futures
-from typing import Any, Callable, Optional, Tuple
+from typing import Any, Callable, Dict, Iterator, List, Optional, Sequence, Tuple
 
 import grpc
+import grpc.aio
 import numpy as np
 import pandas as pd
 import polars as pl
@@ -23,6 +37,7 @@ from grpc._channel import _InactiveRpcError
 
 import kaggle_evaluation.core.generated.kaggle_evaluation_pb2 as kaggle_evaluation_proto
 import kaggle_evaluation.core.generated.kaggle_evaluation_pb2_grpc as kaggle_evaluation_grpc
+import kaggle_evaluation.core.instrumentation
 
 
 class GRPCDeadlineError(Exception):
@@ -62,15 +77,33 @@ _GRPC_CHANNEL_OPTIONS = [
     ('grpc.http2.min_ping_interval_without_data_ms', 1_000),
     ('grpc.service_config', json.dumps(_SERVICE_CONFIG)),
 ]
+# The client connects through whichever channel becomes ready first. A short reconnect backoff lets a channel to a
+# server that isn't up yet notice it soon after it starts, rather than after gRPC's default backoff of up to minutes.
+_CLIENT_CHANNEL_OPTIONS = _GRPC_CHANNEL_OPTIONS + [
+    ('grpc.initial_reconnect_backoff_ms', 50),
+    ('grpc.min_reconnect_backoff_ms', 50),
+    ('grpc.max_reconnect_backoff_ms', 1_000),
+]
 
 
 DEFAULT_DEADLINE_SECONDS = 60 * 60
-_RETRY_SLEEP_SECONDS = 1 / len(GRPC_PORTS)
 # Enforce a relatively strict server startup time so users can get feedback quickly if they're not
 # configuring KaggleEvaluation correctly. We really don't want notebooks timing out after nine hours
 # somebody forgot to start their inference_server. Slow steps like loading models
 # can happen during the first inference call if necessary.
 STARTUP_LIMIT_SECONDS = 60 * 15
+# How often the client confirms the server's host still resolves while waiting for it to start.
+_CONNECT_POLL_SECONDS = 1
+# How long the port named in the rendezvous file is tried on its own before probing every port.
+_RENDEZVOUS_GRACE_SECONDS = 0.5
+# define_server records its port here so that local clients can connect without probing every port.
+RENDEZVOUS_PATH_ENV_VAR = 'KAGGLE_EVALUATION_RENDEZVOUS_PATH'
+# Endpoint answered by the server itself, for clients to confirm it can handle requests.
+READY_ENDPOINT = '__kaggle_evaluation_ready__'
+# Optional endpoint through which a server declares the only input columns its listeners read.
+COLUMNS_ENDPOINT = '__kaggle_evaluation_columns__'
+# Optional endpoint through which a server reports the version of its model, for caching its predictions.
+MODEL_VERSION_ENDPOINT = '__kaggle_evaluation_model_version__'
 
 ### Utils shared by client and server for data transfer
 
@@ -81,22 +114,633 @@ _POLARS_TYPE_DENYLIST = set([pl.Enum, pl.Object, pl.Unknown])
 
 def _get_available_port() -> int:
     """Identify the first available port out of all GRPC_PORTS"""
+    return _get_available_ports(1)[0]
+
+
+def _get_available_ports(count: int) -> List[int]:
+    """Identify the first `count` available ports out of all GRPC_PORTS, e.g. to run several servers side by side."""
+    available_ports = []
     for port in GRPC_PORTS:
         with socket.socket(socket.AF_INET, socket.SOCK_STREAM) as s:
             try:
                 s.bind(('localhost', port))
             except Exception:
                 continue
-        return port
+        available_ports.append(port)
+        if len(available_ports) == count:
+            return available_ports
+
+    if not available_ports:
+        raise ValueError(f'None of the expected ports {GRPC_PORTS} are available.')
+    raise ValueError(f'Only {len(available_ports)} of the expected ports {GRPC_PORTS} are available, {count} are needed.')
+
+
+def _rendezvous_path() -> str:
+    return os.getenv(RENDEZVOUS_PATH_ENV_VAR, os.path.join(tempfile.gettempdir(), 'kaggle_evaluation_server.json'))
+
+
+def _write_rendezvous(port: int) -> None:
+    """Record the port a local server listens on. Best effort: clients fall back to probing every port."""
+    path = _rendezvous_path()
+    tmp_path = f'{path}.{os.getpid()}.tmp'
+    try:
+        with open(tmp_path, 'w') as f_open:
+            json.dump({'port': port, 'pid': os.getpid()}, f_open)
+        os.replace(tmp_path, path)
+    except OSError:
+        pass
+
+
+def _load_rendezvous() -> Optional[Tuple[int, int]]:
+    """The port and process ID in the rendezvous file, if it's readable."""
+    try:
+        with open(_rendezvous_path()) as f_open:
+            contents = json.load(f_open)
+        return int(contents['port']), int(contents['pid'])
+    except (OSError, ValueError, KeyError, TypeError):
+        return None
+
+
+def _is_process_alive(pid: int) -> bool:
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        return True
+    except (OSError, OverflowError):
+        return False
+    return True
+
+
+def _read_rendezvous() -> Optional[int]:
+    """The port of the server that last wrote the rendezvous file, unless its process has exited."""
+    rendezvous = _load_rendezvous()
+    if rendezvous is None or not _is_process_alive(rendezvous[1]):
+        return None
+    return rendezvous[0]
+
+
+def _remove_rendezvous(port: int) -> None:
+    """Remove the rendezvous file once its server has stopped, unless another server has since replaced it."""
+    if _load_rendezvous() == (port, os.getpid()):
+        with contextlib.suppress(OSError):
+            os.unlink(_rendezvous_path())
+
+
+def _is_loopback_address(address: str) -> bool:
+    """Whether a hostname or IP address refers to this machine. Unresolvable addresses are treated as remote."""
+    try:
+        return ipaddress.ip_address(socket.gethostbyname(address)).is_loopback
+    except (OSError, ValueError):
+        return False
+
+
+def _is_loopback_peer(peer: str) -> bool:
+    """Whether a gRPC peer string such as `ipv4:127.0.0.1:50051` or `ipv6:%5B::1%5D:50051` refers to this machine."""
+    transport, _, address = urllib.parse.unquote(peer).partition(':')
+    if transport == 'unix':
+        return True
+    if transport not in ('ipv4', 'ipv6'):
+        return False
+    host = address.rsplit(':', 1)[0].strip('[]')
+    try:
+        return ipaddress.ip_address(host).is_loopback
+    except ValueError:
+        return False
+
+
+def _write_arrow_ipc_buffer(table: pyarrow.Table, codec: str) -> pyarrow.Buffer:
+    """Write a table as an Arrow IPC stream with as few copies as protobuf allows.
+
+    Uncompressed streams are sized with a dry run and then written directly into a preallocated buffer. Compressed
+    sizes aren't known ahead of time, so those streams go to a growable Arrow buffer instead of an io.BytesIO.
+    Either way the only copy left is the final one into the `bytes` object that protobuf requires.
+    """
+    compression = None if codec == 'none' else codec
+    options = pyarrow.ipc.IpcWriteOptions(compression=compression)
+    if compression is None:
+        mock_sink = pyarrow.MockOutputStream()
+        with pyarrow.ipc.new_stream(mock_sink, table.schema, options=options) as writer:
+            writer.write_table(table)
+        buffer = pyarrow.allocate_buffer(mock_sink.size())
+        sink = pyarrow.FixedSizeBufferWriter(buffer)
+    else:
+        sink = pyarrow.BufferOutputStream()
+    with pyarrow.ipc.new_stream(sink, table.schema, options=options) as writer:
+        writer.write_table(table)
+    if compression is not None:
+        buffer = sink.getvalue()
+    return buffer
+
+
+def _write_arrow_ipc(table: pyarrow.Table, codec: str) -> bytes:
+    return _write_arrow_ipc_buffer(table, codec).to_pybytes()
+
+
+def _read_arrow_ipc(data: bytes) -> pyarrow.Table:
+    """Read an Arrow IPC stream without copying: uncompressed columns reference `data` directly."""
+    with pyarrow.ipc.open_stream(pyarrow.py_buffer(data)) as reader:
+        return reader.read_all()
+
+
+COMPRESSION_CODECS = ('none', 'lz4', 'zstd')
+# Codecs every KaggleEvaluation build can read, so they're safe to use before negotiation completes.
+_BASELINE_CODECS = ('none', 'lz4')
+# The client proposes a compression policy on every request; the server replies with the codecs it can decode.
+_COMPRESSION_POLICY_METADATA_KEY = 'kaggle-evaluation-compression-policy'
+_AVAILABLE_CODECS_METADATA_KEY = 'kaggle-evaluation-available-codecs'
+_REMOTE_NETWORK_BYTES_PER_SECOND = 1e9
+_LOOPBACK_NETWORK_BYTES_PER_SECOND = 1e10
+# Weight given to the newest measurement in the adaptive mode's moving averages.
+_ADAPTIVE_SMOOTHING = 0.2
+
+
+def _available_codecs() -> Tuple[str, ...]:
+    return tuple(codec for codec in COMPRESSION_CODECS if codec == 'none' or pyarrow.Codec.is_available(codec))
+
+
+class CompressionPolicy:
+    """Controls how DataFrame, Series and Arrow payloads are compressed.
+
+    Args:
+        codec: One of COMPRESSION_CODECS. Used for every payload at or above min_size_bytes unless adaptive is set.
+        min_size_bytes: Payloads with a smaller in-memory size are never compressed.
+        adaptive: Pick the codec per payload by estimating compression time plus transfer time for each candidate,
+            using measured compression throughput and ratios alongside network_bytes_per_second.
+        network_bytes_per_second: Assumed link throughput for the adaptive mode.
+
+    The Client's policy governs a connection: it's proposed to the server with every request and the server uses it
+    for its responses. The server's own policy only applies to clients that don't propose one. Both sides restrict
+    the codec to what the other can decode, falling back to lz4.
+    """
+
+    def __init__(
+        self,
+        codec: str = 'lz4',
+        min_size_bytes: int = 0,
+        adaptive: bool = False,
+        network_bytes_per_second: float = _REMOTE_NETWORK_BYTES_PER_SECOND,
+    ):
+        if codec not in COMPRESSION_CODECS:
+            raise ValueError(f'Unsupported compression codec {codec}; expected one of {COMPRESSION_CODECS}')
+        if min_size_bytes < 0:
+            raise ValueError(f'min_size_bytes must be non-negative, got {min_size_bytes}')
+        if network_bytes_per_second <= 0:
+            raise ValueError(f'network_bytes_per_second must be positive, got {network_bytes_per_second}')
+        self.codec = codec
+        self.min_size_bytes = min_size_bytes
+        self.adaptive = adaptive
+        self.network_bytes_per_second = network_bytes_per_second
+        self.allowed_codecs: Tuple[str, ...] = _available_codecs()
+        # codec -> [compression bytes per second, compressed / uncompressed ratio]
+        self._measurements: Dict[str, list] = {}
+        self._lock = threading.Lock()
+
+    @classmethod
+    def default_for_address(cls, address: str) -> 'CompressionPolicy':
+        """No compression over loopback, where it only costs CPU time; lz4 otherwise."""
+        if _is_loopback_address(address):
+            return cls('none', network_bytes_per_second=_LOOPBACK_NETWORK_BYTES_PER_SECOND)
+        return cls('lz4')
+
+    def to_header(self) -> str:
+        """Encode the policy, along with the codecs this process can decode, for the peer."""
+        return json.dumps(
+            {
+                'codec': self.codec,
+                'min_size_bytes': self.min_size_bytes,
+                'adaptive': self.adaptive,
+                'network_bytes_per_second': self.network_bytes_per_second,
+                'available_codecs': _available_codecs(),
+            }
+        )
+
+    @classmethod
+    def from_header(cls, header: str) -> 'CompressionPolicy':
+        settings = json.loads(header)
+        peer_codecs = settings.pop('available_codecs', _BASELINE_CODECS)
+        policy = cls(**settings)
+        policy.restrict_to(peer_codecs)
+        return policy
+
+    def restrict_to(self, codecs: Sequence[str]) -> None:
+        """Only use codecs the peer has reported it can decode."""
+        self.allowed_codecs = tuple(codec for codec in _available_codecs() if codec in codecs)
+
+    def choose(self, num_bytes: int) -> str:
+        """Select the codec for a payload with an in-memory size of num_bytes."""
+        if num_bytes < self.min_size_bytes:
+            return 'none'
+        if not self.adaptive:
+            if self.codec in self.allowed_codecs:
+                return self.codec
+            return 'lz4' if 'lz4' in self.allowed_codecs else 'none'
+
+        with self._lock:
+            candidates = [codec for codec in self.allowed_codecs if codec != 'none']
+            for codec in candidates:
+                if codec not in self._measurements:
+                    return codec  # Measure each codec once before estimating
+            best_codec = 'none'
+            best_seconds = num_bytes / self.network_bytes_per_second
+            for codec in candidates:
+                bytes_per_second, ratio = self._measurements[codec]
+                estimated_seconds = num_bytes / bytes_per_second + num_bytes * ratio / self.network_bytes_per_second
+                if estimated_seconds < best_seconds:
+                    best_codec, best_seconds = codec, estimated_seconds
+            return best_codec
+
+    def record(self, codec: str, num_bytes: int, compressed_bytes: int, seconds: float) -> None:
+        """Update the adaptive mode's throughput and ratio estimates after compressing a payload."""
+        if not self.adaptive or codec == 'none' or num_bytes == 0:
+            return
+        bytes_per_second = num_bytes / max(seconds, 1e-9)
+        ratio = compressed_bytes / num_bytes
+        with self._lock:
+            if codec not in self._measurements:
+                self._measurements[codec] = [bytes_per_second, ratio]
+            else:
+                measurement = self._measurements[codec]
+                measurement[0] += _ADAPTIVE_SMOOTHING * (bytes_per_second - measurement[0])
+                measurement[1] += _ADAPTIVE_SMOOTHING * (ratio - measurement[1])
+
+
+_DEFAULT_COMPRESSION_POLICY = CompressionPolicy('lz4')
+
+
+def _compress_payload(policy: CompressionPolicy, num_bytes: int, write: Callable[[str], bytes]) -> bytes:
+    """Run a writer with the codec chosen by the policy, feeding the measured cost back to the policy."""
+    codec = policy.choose(num_bytes)
+    start_time = time.perf_counter()
+    serialized = write(codec)
+    policy.record(codec, num_bytes, len(serialized), time.perf_counter() - start_time)
+    return serialized
+
+
+_SHARED_MEMORY_METADATA_KEY = 'kaggle-evaluation-shared-memory'
+# /dev/shm is memory backed on Linux. Elsewhere the files still avoid the socket, but may be written back to disk.
+_SHARED_MEMORY_DIR = '/dev/shm' if os.path.isdir('/dev/shm') else tempfile.gettempdir()
+_SHARED_MEMORY_PREFIX = 'kaggle_evaluation_'
+# Receivers only map files with names like those written by SharedMemoryTransport, and only from _SHARED_MEMORY_DIR.
+_SHARED_MEMORY_NAME_PATTERN = re.compile(rf'{_SHARED_MEMORY_PREFIX}[A-Za-z0-9_]+\.arrows')
+# Below this size, creating and mapping a file costs more than sending the bytes.
+_SHARED_MEMORY_MIN_BYTES = 1 << 16
+
+
+def _shared_memory_path(name: str) -> str:
+    if not _SHARED_MEMORY_NAME_PATTERN.fullmatch(name):
+        raise ValueError(f'Invalid shared memory name {name}')
+    return os.path.join(_SHARED_MEMORY_DIR, name)
+
+
+class SharedMemoryTransport:
+    """Passes large polars frames between processes on the same host through memory mapped files.
+
+    The sender writes an uncompressed Arrow IPC stream straight into a new file in shared memory and sends only its
+    name. The receiver maps the file, unlinks it so that the memory is freed once the last reference to the frame is
+    dropped, and reads the frame without copying the column data.
+
+    Args:
+        min_size_bytes: Smaller frames are sent inline as usual.
+        track_files: Remember every file written until it's released, so that files a receiver never consumed can be
+            removed.
+    """
+
+    def __init__(self, min_size_bytes: int = _SHARED_MEMORY_MIN_BYTES, track_files: bool = True):
+        self.min_size_bytes = min_size_bytes
+        self.track_files = track_files
+        # Files written but not yet known to be consumed.
+        self._unreleased_names: set = set()
+        self._lock = threading.Lock()
+
+    def _create_file(self, suffix: str = '.arrows') -> str:
+        fd, path = tempfile.mkstemp(prefix=_SHARED_MEMORY_PREFIX, suffix=suffix, dir=_SHARED_MEMORY_DIR)
+        os.close(fd)
+        return path
+
+    def create_probe(self) -> str:
+        """Create an empty file whose name a peer can look for to confirm it shares this host's shared memory."""
+        return os.path.basename(self._create_file())
+
+    def write(self, table: pyarrow.Table, kind: str) -> kaggle_evaluation_proto.SharedMemoryHandle:
+        mock_sink = pyarrow.MockOutputStream()
+        with pyarrow.ipc.new_stream(mock_sink, table.schema) as writer:
+            writer.write_table(table)
+        path = self._create_file()
+        with pyarrow.create_memory_map(path, mock_sink.size()) as sink:
+            with pyarrow.ipc.new_stream(sink, table.schema) as writer:
+                writer.write_table(table)
+        name = os.path.basename(path)
+        if self.track_files:
+            with self._lock:
+                self._unreleased_names.add(name)
+        return kaggle_evaluation_proto.SharedMemoryHandle(name=name, kind=kind)
+
+    def forget_consumed(self) -> None:
+        """Stop tracking files that receivers have already consumed, which they unlink as they map them."""
+        with self._lock:
+            names = list(self._unreleased_names)
+        consumed = {name for name in names if not os.path.exists(os.path.join(_SHARED_MEMORY_DIR, name))}
+        with self._lock:
+            self._unreleased_names -= consumed
+
+    def release(self, names: Optional[Sequence[str]] = None) -> None:
+        """Remove files that a receiver never consumed, such as those of a failed request. Defaults to all of them."""
+        with self._lock:
+            names = set(self._unreleased_names if names is None else names) & self._unreleased_names
+            self._unreleased_names -= names
+        for name in names:
+            with contextlib.suppress(FileNotFoundError):
+                os.unlink(os.path.join(_SHARED_MEMORY_DIR, name))
 
-    raise ValueError(f'None of the expected ports {GRPC_PORTS} are available.')
 
+def _read_shared_memory(handle: kaggle_evaluation_proto.SharedMemoryHandle) -> pyarrow.Table:
+    """Map a frame written by SharedMemoryTransport. The columns keep the mapping alive after the file is unlinked."""
+    path = _shared_memory_path(handle.name)
+    source = pyarrow.memory_map(path)
+    os.unlink(path)
+    with pyarrow.ipc.open_stream(source) as reader:
+        return reader.read_all()
 
-def _serialize(data: Any) -> kaggle_evaluation_proto.Payload:
+
+def _iter_payloads(payloads: Sequence[kaggle_evaluation_proto.Payload], case: str) -> Iterator[Any]:
+    """The values of every payload with the given oneof case among some payloads, including nested ones."""
+    for payload in payloads:
+        payload_case = payload.WhichOneof('value')
+        if payload_case == case:
+            yield getattr(payload, case)
+        elif payload_case in ('list_value', 'tuple_value'):
+            yield from _iter_payloads(getattr(payload, payload_case).payloads, case)
+        elif payload_case == 'dict_value':
+            yield from _iter_payloads(payload.dict_value.payload_map.values(), case)
+
+
+def _shared_memory_names(payloads: Sequence[kaggle_evaluation_proto.Payload]) -> List[str]:
+    """The names of every shared memory file referenced by some payloads, including nested ones."""
+    return [handle.name for handle in _iter_payloads(payloads, 'shared_memory_value')]
+
+
+# Servers report in trailing metadata that they can read polars_record_batches_value payloads.
+_SCHEMA_CACHE_METADATA_KEY = 'kaggle-evaluation-schema-cache'
+# Distinct schemas remembered by each side. Senders typically use a handful, e.g. one per frame passed to predict.
+_MAX_CACHED_SCHEMAS = 256
+_UNKNOWN_SCHEMA_MESSAGE = 'Unknown Arrow schema id'
+# Compressed record batches are written through this much native buffering, so the Python sink sees few writes.
+_RECORD_BATCH_WRITER_BUFFER_BYTES = 1 << 16
+# Clients set this to have the server report how long it spent on each stage of every request.
+_TIMINGS_METADATA_KEY = 'kaggle-evaluation-timings'
+
+
+def _schema_id(serialized_schema: bytes) -> int:
+    return int.from_bytes(hashlib.blake2b(serialized_schema, digest_size=8).digest(), 'little')
+
+
+def _has_dictionary(data_type: pyarrow.DataType) -> bool:
+    return pyarrow.types.is_dictionary(data_type) or any(_has_dictionary(data_type.field(i).type) for i in range(data_type.num_fields))
+
+
+class _CompressedRecordBatchWriter:
+    """Writes tables with one schema as compressed Arrow IPC record batch messages.
+
+    RecordBatch.serialize can't compress, and a stream writer starts with the schema message, so the writer keeps a
+    stream open with the schema already written and hands out only the messages each table adds to it.
+    """
+
+    def __init__(self, schema: pyarrow.Schema, codec: str):
+        self._sink = io.BytesIO()
+        self._stream = pyarrow.BufferedOutputStream(pyarrow.PythonFile(self._sink, mode='w'), buffer_size=_RECORD_BATCH_WRITER_BUFFER_BYTES)
+        self._writer = pyarrow.ipc.new_stream(self._stream, schema, options=pyarrow.ipc.IpcWriteOptions(compression=codec))
+        # The schema message is only written along with the first batch, which is discarded by the first write.
+        self._writer.write_batch(pyarrow.RecordBatch.from_pylist([], schema=schema))
+        self._lock = threading.Lock()
+
+    def write(self, table: pyarrow.Table) -> bytes:
+        with self._lock:
+            self._stream.flush()
+            self._sink.seek(0)
+            self._sink.truncate()
+            self._writer.write_table(table)
+            self._stream.flush()
+            return self._sink.getvalue()
+
+
+class ArrowSchemaCache:
+    """Sends each distinct Arrow schema once, so that later frames with the same columns only carry record batches.
+
+    An Arrow IPC stream starts with the full schema. For a single row of several hundred columns that's about half of
+    the bytes. Instead, frames are sent as their record batch messages plus a schema ID, a hash of the serialized
+    schema that receivers cache schemas under. The schema itself is attached until a request carrying it succeeds,
+    which shows the receiver has cached it.
+
+    Frames with dictionary encoded (categorical) columns are left as ordinary IPC streams, as the dictionaries can't
+    be decoded without the rest of the stream.
+    """
+
+    def __init__(self):
+        # (schema, schema_id, serialized schema or None if it has dictionaries), most recently used first.
+        self._schemas: List[Tuple[pyarrow.Schema, int, Optional[bytes]]] = []
+        self._confirmed_ids: set = set()
+        # Compressed record batch writers of cached schemas, by (schema_id, codec).
+        self._writers: Dict[Tuple[int, str], _CompressedRecordBatchWriter] = {}
+        self._lock = threading.Lock()
+
+    def _lookup(self, schema: pyarrow.Schema) -> Tuple[int, Optional[bytes]]:
+        with self._lock:
+            for i, (cached_schema, schema_id, serialized_schema) in enumerate(self._schemas):
+                if cached_schema.equals(schema, check_metadata=True):
+                    if i > 0:
+                        self._schemas.insert(0, self._schemas.pop(i))
+                    return schema_id, serialized_schema
+        serialized_schema = schema.serialize().to_pybytes()
+        schema_id = _schema_id(serialized_schema)
+        if any(_has_dictionary(field.type) for field in schema):
+            serialized_schema = None
+        with self._lock:
+            self._schemas.insert(0, (schema, schema_id, serialized_schema))
+            evicted_ids = {evicted_id for _, evicted_id, _ in self._schemas[_MAX_CACHED_SCHEMAS:]}
+            del self._schemas[_MAX_CACHED_SCHEMAS:]
+            for key in [key for key in self._writers if key[0] in evicted_ids]:
+                del self._writers[key]
+        return schema_id, serialized_schema
+
+    def _write_record_batches(self, table: pyarrow.Table, schema_id: int, codec: str) -> bytes:
+        """Write a table's record batches as Arrow IPC messages, without the schema message that starts a stream."""
+        if codec == 'none':
+            return b''.join(batch.serialize().to_pybytes() for batch in table.to_batches())
+        key = (schema_id, codec)
+        with self._lock:
+            writer = self._writers.get(key)
+            if writer is None:
+                writer = self._writers[key] = _CompressedRecordBatchWriter(table.schema, codec)
+        try:
+            return writer.write(table)
+        except Exception:
+            # The stream may hold part of a failed write, so start a new one next time.
+            with self._lock:
+                if self._writers.get(key) is writer:
+                    del self._writers[key]
+            raise
+
+    def encode(self, table: pyarrow.Table, compression_policy: CompressionPolicy) -> Optional[kaggle_evaluation_proto.ArrowRecordBatches]:
+        """Encode a table's record batches, or return None if it has to be sent as a full IPC stream."""
+        schema_id, serialized_schema = self._lookup(table.schema)
+        if serialized_schema is None:
+            return None
+        body = _compress_payload(compression_policy, table.nbytes, lambda codec: self._write_record_batches(table, schema_id, codec))
+        with self._lock:
+            confirmed = schema_id in self._confirmed_ids
+        return kaggle_evaluation_proto.ArrowRecordBatches(schema_id=schema_id, schema=b'' if confirmed else serialized_schema, body=body)
+
+    def confirm(self, payloads: Sequence[kaggle_evaluation_proto.Payload]) -> None:
+        """Record that the receiver cached the schemas attached to a successful request's payloads."""
+        schema_ids = [value.schema_id for value in _iter_payloads(payloads, 'polars_record_batches_value') if value.schema]
+        if schema_ids:
+            with self._lock:
+                self._confirmed_ids.update(schema_ids)
+
+    def attach_schemas(self, payloads: Sequence[kaggle_evaluation_proto.Payload]) -> None:
+        """Forget which schemas the receiver has cached, e.g. after it restarted, and attach them to payloads again."""
+        with self._lock:
+            self._confirmed_ids.clear()
+            serialized_schemas = {schema_id: serialized_schema for _, schema_id, serialized_schema in self._schemas}
+        for value in _iter_payloads(payloads, 'polars_record_batches_value'):
+            if not value.schema and value.schema_id in serialized_schemas:
+                value.schema = serialized_schemas[value.schema_id]
+
+
+# Schemas received in polars_record_batches_value payloads, shared by every connection as IDs are content hashes.
+_received_schemas: 'collections.OrderedDict[int, pyarrow.Schema]' = collections.OrderedDict()
+_received_schemas_lock = threading.Lock()
+
+
+def _read_arrow_record_batches(value: kaggle_evaluation_proto.ArrowRecordBatches) -> pyarrow.Table:
+    with _received_schemas_lock:
+        schema = _received_schemas.get(value.schema_id)
+        if schema is not None:
+            _received_schemas.move_to_end(value.schema_id)
+    if schema is None:
+        if not value.schema:
+            raise ValueError(f'{_UNKNOWN_SCHEMA_MESSAGE} {value.schema_id}, the schema must be resent')
+        if _schema_id(value.schema) != value.schema_id:
+            raise ValueError(f'Arrow schema does not match its id {value.schema_id}')
+        schema = pyarrow.ipc.read_schema(pyarrow.py_buffer(value.schema))
+        with _received_schemas_lock:
+            _received_schemas[value.schema_id] = schema
+            while len(_received_schemas) > _MAX_CACHED_SCHEMAS:
+                _received_schemas.popitem(last=False)
+    messages = pyarrow.ipc.MessageReader.open_stream(pyarrow.py_buffer(value.body))
+    return pyarrow.Table.from_batches([pyarrow.ipc.read_record_batch(message, schema) for message in messages], schema)
+
+
+def _write_parquet(df: pd.DataFrame, codec: str) -> bytes:
+    buffer = io.BytesIO()
+    df.to_parquet(buffer, index=False, compression=None if codec == 'none' else codec)
+    return buffer.getvalue()
+
+
+def _write_polars_parquet(df: pl.DataFrame, codec: str) -> bytes:
+    buffer = io.BytesIO()
+    df.write_parquet(buffer, compression='uncompressed' if codec == 'none' else codec, statistics=False)
+    return buffer.getvalue()
+
+
+# Both sides report in metadata that they can read the numpy_buffer_* and packed_*list_value payloads.
+_NUMPY_BUFFERS_METADATA_KEY = 'kaggle-evaluation-numpy-buffers'
+# The dtype kinds sent as raw buffers: bools, numbers, datetimes, timedeltas and fixed width strings. Others, such as
+# structured dtypes, fall back to the NPY format.
+_NUMPY_BUFFER_KINDS = frozenset('biufcmMSU')
+# The dtypes python scalars are packed as. Python floats are 64 bit, unlike float_value.
+_PACKED_LIST_DTYPES = {float: np.dtype('<f8'), int: np.dtype('<i8'), bool: np.dtype('|b1')}
+
+
+def _numpy_buffer_payload(field: str, array: np.ndarray) -> kaggle_evaluation_proto.Payload:
+    """A payload with array's buffer in the NumpyBuffer field named field."""
+    little_endian_dtype = array.dtype.newbyteorder('<')
+    if array.dtype != little_endian_dtype:
+        array = array.astype(little_endian_dtype)
+    payload = kaggle_evaluation_proto.Payload()
+    # Filled in place, as passing a NumpyBuffer to the Payload constructor would copy the data again.
+    value = getattr(payload, field)
+    value.dtype = little_endian_dtype.str
+    value.shape.extend(array.shape)
+    value.data = array.tobytes()
+    return payload
+
+
+def _decode_numpy_buffer(value: kaggle_evaluation_proto.NumpyBuffer, writable: bool = False) -> np.ndarray:
+    """An array over the payload's buffer. Read-only and without copying the buffer unless writable is set, which
+    copies it once so that receivers can modify the array, as they can arrays read with np.load.
+    """
+    dtype = np.dtype(value.dtype)
+    if dtype.kind not in _NUMPY_BUFFER_KINDS:
+        raise TypeError(f'Unsupported numpy buffer dtype {value.dtype}')
+    data = bytearray(value.data) if writable else value.data
+    return np.frombuffer(data, dtype=dtype).reshape(tuple(value.shape))
+
+
+def _can_encode_numpy_buffer(dtype: np.dtype) -> bool:
+    return dtype.kind in _NUMPY_BUFFER_KINDS and dtype.itemsize > 0
+
+
+def _scalar_list_type(data: list) -> Optional[type]:
+    """The scalar type of a list, or equal length nested lists, whose scalars all have one type that can be packed
+    into an array, or None if data isn't such a list.
+    """
+    rows = [data]
+    while True:
+        length = len(rows[0])
+        if length == 0 or any(len(row) != length for row in rows):
+            return None
+        if type(rows[0][0]) is not list:
+            break
+        rows = [item for row in rows for item in row]
+        if any(type(row) is not list for row in rows):
+            return None
+    scalar_type = type(rows[0][0])
+    if scalar_type not in _PACKED_LIST_DTYPES and not (issubclass(scalar_type, (np.number, np.bool_)) and _can_encode_numpy_buffer(np.dtype(scalar_type))):
+        return None
+    if any(type(item) is not scalar_type for row in rows for item in row):
+        return None
+    return scalar_type
+
+
+def _pack_list(data: list) -> Optional[kaggle_evaluation_proto.Payload]:
+    """A list of scalars of a single type as one array, or None if it can't be packed."""
+    scalar_type = _scalar_list_type(data)
+    if scalar_type is None:
+        return None
+    try:
+        array = np.array(data, dtype=_PACKED_LIST_DTYPES.get(scalar_type))
+    except OverflowError:
+        return None  # Python ints beyond 64 bits.
+    return _numpy_buffer_payload('packed_list_value' if scalar_type in _PACKED_LIST_DTYPES else 'packed_numpy_list_value', array)
+
+
+def _unpack_numpy_list(array: np.ndarray) -> list:
+    """Nested lists of the numpy scalars in array, the counterpart of ndarray.tolist for numpy scalars."""
+    if array.ndim == 1:
+        return list(array)
+    return [_unpack_numpy_list(i) for i in array]
+
+
+def _serialize(
+    data: Any,
+    compression_policy: CompressionPolicy = _DEFAULT_COMPRESSION_POLICY,
+    shared_memory: Optional[SharedMemoryTransport] = None,
+    schema_cache: Optional[ArrowSchemaCache] = None,
+    numpy_buffers: bool = False,
+) -> kaggle_evaluation_proto.Payload:
     """Maps input data of one of several allow-listed types to a protobuf message to be sent over gRPC.
 
     Args:
         data: The input data to be mapped. Any of the types listed below are accepted.
+        compression_policy: Selects the codec for DataFrame and Series payloads.
+        shared_memory: If set, large polars DataFrames and Series are passed through shared memory instead. Only
+            for receivers on the same host.
+        schema_cache: If set, polars DataFrames are sent without any schema the receiver has already cached.
+        numpy_buffers: Send numpy arrays and scalars as raw buffers rather than NPY files, and pack lists of scalars
+            of a single type into one array. Only for receivers that report support for them.
 
     Returns:
         The Payload protobuf message.
@@ -114,6 +758,8 @@ def _serialize(data: Any) -> kaggle_evaluation_proto.Payload:
         # https://numpy.org/doc/stable/reference/arrays.scalars.html
         assert data.shape == ()  # Additional validation that the np.generic type remains solely for scalars
         assert isinstance(data, np.number) or isinstance(data, np.bool_)  # No support for bytes, strings, objects, etc
+        if numpy_buffers:
+            return _numpy_buffer_payload('numpy_buffer_scalar_value', np.asarray(data))
         buffer = io.BytesIO()
         np.save(buffer, data, allow_pickle=False)
         return kaggle_evaluation_proto.Payload(numpy_scalar_value=buffer.getvalue())
@@ -129,21 +775,31 @@ def _serialize(data: Any) -> kaggle_evaluation_proto.Payload:
         return kaggle_evaluation_proto.Payload(none_value=True)
     # Iterables for nested types
     if isinstance(data, list):
-        return kaggle_evaluation_proto.Payload(list_value=kaggle_evaluation_proto.PayloadList(payloads=map(_serialize, data)))
+        packed = _pack_list(data) if numpy_buffers else None
+        if packed is not None:
+            return packed
+        return kaggle_evaluation_proto.Payload(
+            list_value=kaggle_evaluation_proto.PayloadList(
+                payloads=(_serialize(i, compression_policy, shared_memory, schema_cache, numpy_buffers) for i in data)
+            )
+        )
     elif isinstance(data, tuple):
-        return kaggle_evaluation_proto.Payload(tuple_value=kaggle_evaluation_proto.PayloadList(payloads=map(_serialize, data)))
+        return kaggle_evaluation_proto.Payload(
+            tuple_value=kaggle_evaluation_proto.PayloadList(
+                payloads=(_serialize(i, compression_policy, shared_memory, schema_cache, numpy_buffers) for i in data)
+            )
+        )
     elif isinstance(data, dict):
         serialized_dict = {}
         for key, value in data.items():
             if not isinstance(key, str):
                 raise TypeError(f'KaggleEvaluation only supports dicts with keys of type str, found {type(key)}.')
-            serialized_dict[key] = _serialize(value)
+            serialized_dict[key] = _serialize(value, compression_policy, shared_memory, schema_cache, numpy_buffers)
         return kaggle_evaluation_proto.Payload(dict_value=kaggle_evaluation_proto.PayloadMap(payload_map=serialized_dict))
     # Allowlisted special types
     if isinstance(data, pd.DataFrame):
-        buffer = io.BytesIO()
-        data.to_parquet(buffer, index=False, compression='lz4')
-        return kaggle_evaluation_proto.Payload(pandas_dataframe_value=buffer.getvalue())
+        serialized = _compress_payload(compression_policy, data.memory_usage(index=False).sum(), lambda codec: _write_parquet(data, codec))
+        return kaggle_evaluation_proto.Payload(pandas_dataframe_value=serialized)
     elif isinstance(data, pl.DataFrame):
         data_types = set(i.base_type() for i in data.dtypes)
         banned_types = _POLARS_TYPE_DENYLIST.intersection(data_types)
@@ -151,21 +807,26 @@ def _serialize(data: Any) -> kaggle_evaluation_proto.Payload:
             raise TypeError(f'Unsupported Polars data type(s): {banned_types}')
 
         table = data.to_arrow()
-        buffer = io.BytesIO()
-        with pyarrow.ipc.new_stream(buffer, table.schema, options=pyarrow.ipc.IpcWriteOptions(compression='lz4')) as writer:
-            writer.write_table(table)
-        return kaggle_evaluation_proto.Payload(polars_dataframe_value=buffer.getvalue())
+        if shared_memory is not None and table.nbytes >= shared_memory.min_size_bytes:
+            return kaggle_evaluation_proto.Payload(shared_memory_value=shared_memory.write(table, 'polars_dataframe_value'))
+        record_batches = schema_cache.encode(table, compression_policy) if schema_cache is not None else None
+        if record_batches is not None:
+            return kaggle_evaluation_proto.Payload(polars_record_batches_value=record_batches)
+        serialized = _compress_payload(compression_policy, table.nbytes, lambda codec: _write_arrow_ipc(table, codec))
+        return kaggle_evaluation_proto.Payload(polars_dataframe_value=serialized)
     elif isinstance(data, pd.Series):
-        buffer = io.BytesIO()
         # Can't serialize a pd.Series directly to parquet, must use intermediate DataFrame
-        pd.DataFrame(data).to_parquet(buffer, index=False, compression='lz4')
-        return kaggle_evaluation_proto.Payload(pandas_series_value=buffer.getvalue())
+        serialized = _compress_payload(compression_policy, data.memory_usage(index=False), lambda codec: _write_parquet(pd.DataFrame(data), codec))
+        return kaggle_evaluation_proto.Payload(pandas_series_value=serialized)
     elif isinstance(data, pl.Series):
-        buffer = io.BytesIO()
+        if shared_memory is not None and data.estimated_size() >= shared_memory.min_size_bytes:
+            return kaggle_evaluation_proto.Payload(shared_memory_value=shared_memory.write(pl.DataFrame(data).to_arrow(), 'polars_series_value'))
         # Can't serialize a pl.Series directly to parquet, must use intermediate DataFrame
-        pl.DataFrame(data).write_parquet(buffer, compression='lz4', statistics=False)
-        return kaggle_evaluation_proto.Payload(polars_series_value=buffer.getvalue())
+        serialized = _compress_payload(compression_policy, data.estimated_size(), lambda codec: _write_polars_parquet(pl.DataFrame(data), codec))
+        return kaggle_evaluation_proto.Payload(polars_series_value=serialized)
     elif isinstance(data, np.ndarray):
+        if numpy_buffers and _can_encode_numpy_buffer(data.dtype):
+            return _numpy_buffer_payload('numpy_buffer_array_value', data)
         buffer = io.BytesIO()
         np.save(buffer, data, allow_pickle=False)
         return kaggle_evaluation_proto.Payload(numpy_array_value=buffer.getvalue())
@@ -209,9 +870,7 @@ def _deserialize(payload: kaggle_evaluation_proto.Payload) -> Any:
     elif payload.WhichOneof('value') == 'pandas_dataframe_value':
         return pd.read_parquet(io.BytesIO(payload.pandas_dataframe_value))
     elif payload.WhichOneof('value') == 'polars_dataframe_value':
-        with pyarrow.ipc.open_stream(payload.polars_dataframe_value) as reader:
-            table = reader.read_all()
-        return pl.from_arrow(table)
+        return pl.from_arrow(_read_arrow_ipc(payload.polars_dataframe_value), rechunk=False)
     elif payload.WhichOneof('value') == 'pandas_series_value':
         # Pandas will still read a single column csv as a DataFrame.
         df = pd.read_parquet(io.BytesIO(payload.pandas_series_value))
@@ -229,6 +888,23 @@ def _deserialize(payload: kaggle_evaluation_proto.Payload) -> Any:
         return data
     elif payload.WhichOneof('value') == 'bytes_io_value':
         return io.BytesIO(payload.bytes_io_value)
+    elif payload.WhichOneof('value') == 'polars_record_batches_value':
+        return pl.from_arrow(_read_arrow_record_batches(payload.polars_record_batches_value), rechunk=False)
+    elif payload.WhichOneof('value') == 'numpy_buffer_array_value':
+        return _decode_numpy_buffer(payload.numpy_buffer_array_value, writable=True)
+    elif payload.WhichOneof('value') == 'numpy_buffer_scalar_value':
+        data = _decode_numpy_buffer(payload.numpy_buffer_scalar_value)[()]
+        assert isinstance(data, np.number) or isinstance(data, np.bool_)  # No support for bytes, strings, objects, etc
+        return data
+    elif payload.WhichOneof('value') == 'packed_list_value':
+        return _decode_numpy_buffer(payload.packed_list_value).tolist()
+    elif payload.WhichOneof('value') == 'packed_numpy_list_value':
+        return _unpack_numpy_list(_decode_numpy_buffer(payload.packed_numpy_list_value))
+    elif payload.WhichOneof('value') == 'shared_memory_value':
+        df = pl.from_arrow(_read_shared_memory(payload.shared_memory_value), rechunk=False)
+        if payload.shared_memory_value.kind == 'polars_series_value':
+            return df.to_series()
+        return df
 
     raise TypeError(f'Found unknown Payload case {payload.WhichOneof("value")}')
 
@@ -241,21 +917,246 @@ class Client:
     Class which allows callers to make KaggleEvaluation requests.
     """
 
-    def __init__(self, channel_address: str = 'localhost') -> None:
+    def __init__(
+        self,
+        channel_address: str = 'localhost',
+        compression_policy: Optional[CompressionPolicy] = None,
+        port: Optional[int] = None,
+        shared_memory: bool = False,
+        schema_cache: bool = False,
+    ) -> None:
+        """
+        Args:
+            channel_address: Host running the server.
+            compression_policy: Compression for requests and, once proposed to the server, for responses. Defaults to
+                no compression over loopback and lz4 otherwise.
+            port: Only connect on this port, e.g. when several servers run on one host. Defaults to trying all GRPC_PORTS.
+            shared_memory: Pass large polars frames through shared memory rather than the socket, in both directions,
+                if the server turns out to be on the same host. See `set_shared_memory`.
+            schema_cache: Send the schema of each distinct polars DataFrame layout only once. See `set_schema_cache`.
+        """
         self.channel_address = channel_address
+        self.ports = [port] if port is not None else GRPC_PORTS
+        # The port of the connected server, once found.
+        self.port: Optional[int] = None
         self.channel: Optional[grpc.Channel] = None
         self._made_first_connection = False
+        self._received_first_response = False
         self.endpoint_deadline_seconds = DEFAULT_DEADLINE_SECONDS
         self.stub: Optional[kaggle_evaluation_grpc.KaggleEvaluationServiceStub] = None
+        self.shared_memory: Optional[SharedMemoryTransport] = None
+        # Set once the server confirms it can read this host's shared memory.
+        self._shared_memory_confirmed = False
+        self._shared_memory_probe: Optional[str] = None
+        self.schema_cache: Optional[ArrowSchemaCache] = None
+        # Set once the server reports that it caches schemas.
+        self._schema_cache_supported = False
+        # Set once the server reports that it reads numpy buffers.
+        self._numpy_buffers_supported = False
+        self.timings: Optional[kaggle_evaluation.core.instrumentation.StageTimings] = None
+        self.set_compression_policy(compression_policy or CompressionPolicy.default_for_address(channel_address))
+        self.set_shared_memory(shared_memory)
+        self.set_schema_cache(schema_cache)
+
+    def set_compression_policy(self, compression_policy: CompressionPolicy) -> None:
+        self.compression_policy = compression_policy
+        # Stick to codecs every server can decode until the server reports its own.
+        self.compression_policy.restrict_to(_BASELINE_CODECS)
+        self._update_metadata()
+
+    def set_shared_memory(self, enabled: bool, min_size_bytes: int = _SHARED_MEMORY_MIN_BYTES) -> None:
+        """Pass polars frames of at least min_size_bytes through shared memory, once the server has confirmed it can
+        read it. This skips serializing, copying through the socket, and deserializing the column data.
+
+        The client proposes shared memory by naming an empty probe file it created. A server only accepts if the client
+        connected over loopback and the probe file is visible to it, so a server in another container or on another
+        host keeps using the socket. Must be set before the first request.
+        """
+        if self._received_first_response:
+            raise RuntimeError('Shared memory must be configured before the first request')
+        self._remove_shared_memory_probe()
+        self.shared_memory = SharedMemoryTransport(min_size_bytes) if enabled else None
+        if enabled and _is_loopback_address(self.channel_address):
+            self._shared_memory_probe = self.shared_memory.create_probe()
+        self._update_metadata()
 
-    def _send_with_deadline(self, request) -> kaggle_evaluation_proto.KaggleEvaluationResponse:
+    def set_schema_cache(self, enabled: bool) -> None:
+        """Send polars DataFrames as bare record batches plus the ID of a schema sent once before, for servers that
+        support it. Worthwhile when many requests carry frames with the same columns, especially narrow frames with
+        many columns, such as a single date's row of a wide panel.
+        """
+        self.schema_cache = ArrowSchemaCache() if enabled else None
+
+    def set_timings(self, timings: Optional[kaggle_evaluation.core.instrumentation.StageTimings]) -> None:
+        """Record the time taken by each stage of every request, and payload sizes, in `timings`. The server reports
+        its own stages with each response. None stops recording.
+        """
+        self.timings = timings
+        self._update_metadata()
+
+    def _remove_shared_memory_probe(self) -> None:
+        if self._shared_memory_probe is not None:
+            with contextlib.suppress(FileNotFoundError):
+                os.unlink(os.path.join(_SHARED_MEMORY_DIR, self._shared_memory_probe))
+            self._shared_memory_probe = None
+
+    def _update_metadata(self) -> None:
+        metadata = [(_COMPRESSION_POLICY_METADATA_KEY, self.compression_policy.to_header()), (_NUMPY_BUFFERS_METADATA_KEY, 'enabled')]
+        if self._shared_memory_probe is not None:
+            metadata.append((_SHARED_MEMORY_METADATA_KEY, self._shared_memory_probe))
+        if self.timings is not None:
+            metadata.append((_TIMINGS_METADATA_KEY, 'enabled'))
+        self._metadata = tuple(metadata)
+
+    def _negotiate_transport(self, trailing_metadata: Optional[Sequence[Tuple[str, str]]]) -> None:
+        """Adopt the capabilities the server reported in a call's trailing metadata."""
+        for key, value in trailing_metadata or ():
+            if key == _AVAILABLE_CODECS_METADATA_KEY:
+                self.compression_policy.restrict_to(value.split(','))
+            elif key == _SHARED_MEMORY_METADATA_KEY:
+                self._shared_memory_confirmed = self.shared_memory is not None and value == 'enabled'
+            elif key == _SCHEMA_CACHE_METADATA_KEY:
+                self._schema_cache_supported = value == 'enabled'
+            elif key == _NUMPY_BUFFERS_METADATA_KEY:
+                self._numpy_buffers_supported = value == 'enabled'
+
+    def _request_shared_memory(self) -> Optional[SharedMemoryTransport]:
+        return self.shared_memory if self._shared_memory_confirmed else None
+
+    def _request_schema_cache(self) -> Optional[ArrowSchemaCache]:
+        return self.schema_cache if self._schema_cache_supported else None
+
+    def can_send_requests_from(self, other: 'Client') -> bool:
+        """Whether requests serialized by other can be sent through this client as they are, e.g. to send one request
+        to several servers. This client's server must decode everything other's server agreed to, and the clients must
+        share a schema cache if other uses one. Requests through shared memory can't be shared, as only one server can
+        read each file.
+        """
+        if other is self:
+            return True
+        schema_cache = other._request_schema_cache()
+        return (
+            other._request_shared_memory() is None
+            and (schema_cache is None or schema_cache is self._request_schema_cache())
+            and (self._numpy_buffers_supported or not other._numpy_buffers_supported)
+            and set(other.compression_policy.allowed_codecs) <= set(self.compression_policy.allowed_codecs)
+        )
+
+    def _release_shared_memory(self, request: kaggle_evaluation_proto.KaggleEvaluationRequest) -> None:
+        """Remove any of a completed request's shared memory files that the server didn't consume."""
+        if self.shared_memory is not None:
+            self.shared_memory.release(_shared_memory_names([*request.args, *request.kwargs.values()]))
+
+    def _read_response(self, name: str, response: kaggle_evaluation_proto.KaggleEvaluationResponse, round_trip_seconds: float) -> Any:
+        """Deserialize a response, recording its timings if enabled."""
+        if self.timings is None:
+            return _deserialize(response.payload)
+        self.timings.record_seconds('round_trip', round_trip_seconds)
+        self.timings.record_bytes('response_bytes', response.ByteSize())
+        for stage, seconds in response.timings.items():
+            self.timings.record_seconds(f'server_{name}' if stage == 'listener' else f'server_{stage}', seconds)
+        with self.timings.time('deserialize_response'):
+            return _deserialize(response.payload)
+
+    def _confirm_schemas(self, request: kaggle_evaluation_proto.KaggleEvaluationRequest) -> None:
+        """Stop attaching the schemas sent with a request that succeeded, as the server has cached them."""
+        if self.schema_cache is not None:
+            self.schema_cache.confirm([*request.args, *request.kwargs.values()])
+
+    def _candidate_ports(self) -> Tuple[List[int], Optional[int]]:
+        """The ports to probe, starting with the one in the rendezvous file if it's a candidate, and that port."""
+        ports = list(self.ports)
+        rendezvous_port = _read_rendezvous() if len(ports) > 1 and _is_loopback_address(self.channel_address) else None
+        if rendezvous_port not in ports:
+            return ports, None
+        ports.remove(rendezvous_port)
+        return [rendezvous_port] + ports, rendezvous_port
+
+    def _connect(self) -> None:
+        """Find the server and keep a single channel to it for every later request.
+
+        Every candidate port is probed concurrently over one channel per port, which is reused across reconnection
+        attempts, and the first channel to become ready wins. For a local server, the port recorded in the
+        rendezvous file by `define_server` gets a short head start, so that a stale server on another port isn't
+        picked over the current one.
+        """
+        ports, rendezvous_port = self._candidate_ports()
+        channels = {}
+        ready_futures = []
+        ready_ports = queue.Queue()
+
+        def probe(port: int) -> None:
+            channels[port] = grpc.insecure_channel(f'{self.channel_address}:{port}', options=_CLIENT_CHANNEL_OPTIONS)
+            ready_future = grpc.channel_ready_future(channels[port])
+            ready_future.add_done_callback(lambda future: None if future.cancelled() else ready_ports.put(port))
+            ready_futures.append(ready_future)
+
+        first_call_time = time.time()
+        try:
+            probe(ports[0])
+            if rendezvous_port is not None:
+                with contextlib.suppress(queue.Empty):
+                    self.port = ready_ports.get(timeout=_RENDEZVOUS_GRACE_SECONDS)
+            if self.port is None:
+                for port in ports[1:]:
+                    probe(port)
+            # Allow time for the server to start as long as its container is running
+            while self.port is None and time.time() - first_call_time < STARTUP_LIMIT_SECONDS:
+                try:
+                    self.port = ready_ports.get(timeout=_CONNECT_POLL_SECONDS)
+                except queue.Empty:
+                    # Confirm the inference_server container is still alive & it's worth waiting on the server.
+                    # If the inference_server container is no longer running this will throw a socket.gaierror.
+                    socket.gethostbyname(self.channel_address)
+        finally:
+            for ready_future in ready_futures:
+                ready_future.cancel()
+            for port, channel in channels.items():
+                if port != self.port:
+                    channel.close()
+
+        if self.port is None:
+            raise RuntimeError(f'Failed to connect to server after waiting {STARTUP_LIMIT_SECONDS} seconds')
+        self.channel = channels[self.port]
+        self.stub = kaggle_evaluation_grpc.KaggleEvaluationServiceStub(self.channel)
+        self._made_first_connection = True
+
+    def wait_until_ready(self) -> Optional[List[str]]:
+        """Connect to the server and confirm that it's handling requests, without calling any user code.
+
+        Separating this from the first real request means that request's latency only reflects the model, and the
+        first request still isn't subject to endpoint_deadline_seconds.
+
+        Returns:
+            The names of the server's endpoints, or None if the server predates this handshake.
+        """
+        if not self._made_first_connection:
+            self._connect()
+        request = kaggle_evaluation_proto.KaggleEvaluationRequest(name=READY_ENDPOINT)
+        try:
+            response, call = self.stub.Send.with_call(request, metadata=self._metadata, wait_for_ready=True, timeout=STARTUP_LIMIT_SECONDS)
+        except grpc.RpcError as err:
+            if f'No listener for {READY_ENDPOINT} was registered' in str(err):
+                return None
+            raise err
+        self._negotiate_transport(call.trailing_metadata())
+        return _deserialize(response.payload)
+
+    def _send_with_deadline(
+        self, request, deadline_seconds: Optional[float] = None
+    ) -> kaggle_evaluation_proto.KaggleEvaluationResponse:
         """Sends a message to the server while also:
         - Throwing an error as soon as the inference_server container has been shut down.
         - Setting a deadline of STARTUP_LIMIT_SECONDS for the inference_server to startup.
+        - Setting a deadline of deadline_seconds, or endpoint_deadline_seconds by default, for requests after the first.
         """
-        if self._made_first_connection:
+        if not self._made_first_connection:
+            self._connect()
+
+        if self._received_first_response:
+            timeout = deadline_seconds if deadline_seconds is not None else self.endpoint_deadline_seconds
             try:
-                return self.stub.Send(request, wait_for_ready=False, timeout=self.endpoint_deadline_seconds)
+                return self.stub.Send(request, metadata=self._metadata, wait_for_ready=False, timeout=timeout)
             except _InactiveRpcError as err:
                 if 'StatusCode.DEADLINE_EXCEEDED' in str(err):
                     raise GRPCDeadlineError()
@@ -264,26 +1165,11 @@ class Client:
             except Exception as err:
                 raise err
 
-        first_call_time = time.time()
-        # Allow time for the server to start as long as its container is running
-        while time.time() - first_call_time < STARTUP_LIMIT_SECONDS:
-            for port in GRPC_PORTS:
-                self.channel = grpc.insecure_channel(f'{self.channel_address}:{port}', options=_GRPC_CHANNEL_OPTIONS)
-                self.stub = kaggle_evaluation_grpc.KaggleEvaluationServiceStub(self.channel)
-                try:
-                    response = self.stub.Send(request, wait_for_ready=False)
-                    self._made_first_connection = True
-                    return response
-                except grpc._channel._InactiveRpcError as err:
-                    if 'StatusCode.UNAVAILABLE' not in str(err):
-                        raise err
-                # Confirm the inference_server container is still alive & it's worth waiting on the server.
-                # If the inference_server container is no longer running this will throw a socket.gaierror.
-                socket.gethostbyname(self.channel_address)
-                time.sleep(_RETRY_SLEEP_SECONDS)
-
-        if not self._made_first_connection:
-            raise RuntimeError(f'Failed to connect to server after waiting {STARTUP_LIMIT_SECONDS} seconds')
+        # The first request has no deadline, as it may include slow one-off steps like loading a model.
+        response, call = self.stub.Send.with_call(request, metadata=self._metadata, wait_for_ready=False)
+        self._received_first_response = True
+        self._negotiate_transport(call.trailing_metadata())
+        return response
 
     def serialize_request(self, name: str, *args, **kwargs) -> kaggle_evaluation_proto.KaggleEvaluationRequest:
         """Serialize a single request. Exists as a separate function from `send`
@@ -292,9 +1178,19 @@ class Client:
         already_serialized = (len(args) == 1) and isinstance(args[0], kaggle_evaluation_proto.KaggleEvaluationRequest)
         if already_serialized:
             return args[0]  # args is a tuple of length 1 containing the request
-        return kaggle_evaluation_proto.KaggleEvaluationRequest(
-            name=name, args=map(_serialize, args), kwargs={key: _serialize(value) for key, value in kwargs.items()}
+        start_time = time.perf_counter()
+        shared_memory = self._request_shared_memory()
+        schema_cache = self._request_schema_cache()
+        numpy_buffers = self._numpy_buffers_supported
+        request = kaggle_evaluation_proto.KaggleEvaluationRequest(
+            name=name,
+            args=(_serialize(i, self.compression_policy, shared_memory, schema_cache, numpy_buffers) for i in args),
+            kwargs={key: _serialize(value, self.compression_policy, shared_memory, schema_cache, numpy_buffers) for key, value in kwargs.items()},
         )
+        if self.timings is not None:
+            self.timings.record_seconds('serialize_request', time.perf_counter() - start_time)
+            self.timings.record_bytes('request_bytes', request.ByteSize())
+        return request
 
     def send(self, name: str, *args, **kwargs) -> Any:
         """Sends a single KaggleEvaluation request.
@@ -308,12 +1204,372 @@ class Client:
             The response, which is of one of several allow-listed data types.
         """
         request = self.serialize_request(name, *args, **kwargs)
-        response = self._send_with_deadline(request)
-        return _deserialize(response.payload)
+        return self.send_request(request)
+
+    def send_request(self, request: kaggle_evaluation_proto.KaggleEvaluationRequest, deadline_seconds: Optional[float] = None) -> Any:
+        """Sends a request built by `serialize_request`.
+
+        Args:
+            request: The serialized request.
+            deadline_seconds: Overrides endpoint_deadline_seconds for this request, e.g. for requests covering many batches.
+
+        Returns:
+            The response, which is of one of several allow-listed data types.
+        """
+        start_time = time.perf_counter()
+        try:
+            try:
+                response = self._send_with_deadline(request, deadline_seconds)
+            except grpc.RpcError as err:
+                if self.schema_cache is None or _UNKNOWN_SCHEMA_MESSAGE not in str(err):
+                    raise err
+                # The server no longer has a schema it cached earlier, e.g. because it restarted.
+                self.schema_cache.attach_schemas([*request.args, *request.kwargs.values()])
+                response = self._send_with_deadline(request, deadline_seconds)
+        finally:
+            self._release_shared_memory(request)
+        round_trip_seconds = time.perf_counter() - start_time
+        self._confirm_schemas(request)
+        return self._read_response(request.name, response, round_trip_seconds)
+
+    def open_stream(self, max_in_flight: int = 2) -> 'RequestStream':
+        """Open a `SendStream` call for sending many requests without per-call overhead. Must only be called after
+        the first request has been sent, which is what waits for the server to start up.
+        """
+        if not self._made_first_connection:
+            raise RuntimeError('Streams can only be opened once a connection to the server has been made')
+        return RequestStream(self, max_in_flight)
 
     def close(self) -> None:
         if self.channel is not None:
             self.channel.close()
+        if self.shared_memory is not None:
+            self.shared_memory.release()
+        self._remove_shared_memory_probe()
+
+
+_STREAM_END = object()
+
+
+class RequestStream:
+    """A single `SendStream` call carrying many requests, with responses received in request order.
+
+    At most max_in_flight requests can be awaiting a response, so callers must `receive` before submitting more; gRPC's
+    own flow control applies beneath that. Each `receive` enforces its own deadline, as a unary call would.
+
+    If the server predates `SendStream`, the stream transparently falls back to unary `Send` calls, resending any
+    requests that were already submitted.
+    """
+
+    def __init__(self, client: Client, max_in_flight: int = 2):
+        if not isinstance(max_in_flight, int) or max_in_flight < 1:
+            raise ValueError(f'max_in_flight must be a positive int, got {max_in_flight}')
+        self.client = client
+        self.max_in_flight = max_in_flight
+        # Requests are kept until their response arrives in case of a fallback to unary calls.
+        self._pending_requests = collections.deque()
+        # When each pending request was submitted and each received response arrived, for round trip timings.
+        self._submit_times = collections.deque()
+        self._arrival_times = collections.deque()
+        self._requests = queue.Queue()
+        self._responses = queue.Queue()
+        self._received_any_response = False
+        self._use_unary_fallback = False
+        self._call = client.stub.SendStream(iter(self._requests.get, _STREAM_END), metadata=client._metadata)
+        self._reader = threading.Thread(target=self._read_responses, name='kaggle-evaluation-stream-reader', daemon=True)
+        self._reader.start()
+
+    def _read_responses(self) -> None:
+        try:
+            for response in self._call:
+                self._arrival_times.append(time.perf_counter())
+                self._responses.put(response)
+            self._responses.put(_STREAM_END)
+        except grpc.RpcError as err:
+            self._responses.put(err)
+
+    def submit(self, request: kaggle_evaluation_proto.KaggleEvaluationRequest) -> None:
+        """Send a request built by `Client.serialize_request`."""
+        if len(self._pending_requests) >= self.max_in_flight:
+            raise RuntimeError(f'At most {self.max_in_flight} requests can await a response; call receive first')
+        self._pending_requests.append(request)
+        self._submit_times.append(time.perf_counter())
+        if not self._use_unary_fallback:
+            self._requests.put(request)
+
+    def receive(self, deadline_seconds: Optional[float] = None) -> Any:
+        """Wait for the response to the oldest outstanding request.
+
+        Raises:
+            GRPCDeadlineError if no response arrives within deadline_seconds, or the client's
+            endpoint_deadline_seconds by default. The stream can't be used afterwards.
+        """
+        if not self._pending_requests:
+            raise RuntimeError('No requests are awaiting a response')
+        timeout = deadline_seconds if deadline_seconds is not None else self.client.endpoint_deadline_seconds
+        request = self._pending_requests.popleft()
+        submit_time = self._submit_times.popleft()
+        if self._use_unary_fallback:
+            return self.client.send_request(request, timeout)
+
+        try:
+            response = self._responses.get(timeout=timeout)
+        except queue.Empty:
+            self._call.cancel()
+            raise GRPCDeadlineError()
+        finally:
+            self.client._release_shared_memory(request)
+        if response is _STREAM_END:
+            raise RuntimeError('Server closed the stream before responding to every request')
+        if isinstance(response, grpc.RpcError):
+            if response.code() == grpc.StatusCode.UNIMPLEMENTED and not self._received_any_response:
+                self._use_unary_fallback = True
+                return self.client.send_request(request, timeout)
+            # Keep raising the error for any later receives.
+            self._responses.put(response)
+            raise response
+        self._received_any_response = True
+        self.client._confirm_schemas(request)
+        return self.client._read_response(request.name, response, self._arrival_times.popleft() - submit_time)
+
+    def close(self) -> None:
+        """End the stream once the outstanding requests have been answered, or cancel it if any are still pending."""
+        self._requests.put(_STREAM_END)
+        if self._pending_requests:
+            self._call.cancel()
+        self._reader.join()
+
+
+class AsyncClient(Client):
+    """A Client for asyncio code, built on grpc.aio, so that requests in flight don't each block a thread.
+
+    Requests are serialized and responses read exactly as by `Client`, with the same transport negotiation, deadlines
+    and retries, but `wait_until_ready`, `send`, `send_request` and `close` are coroutines. Any number of requests can
+    be in flight at once over the client's single channel, and one event loop can drive clients for several servers.
+    To keep several requests in flight to one server, `submit` them and `receive` their responses in turn: as with
+    `RequestStream.receive`, each deadline then starts once its response is awaited, so that requests queued behind
+    others on the server aren't penalized for it. Must only be used from the event loop it was first used in, as
+    grpc.aio channels are bound to their loop.
+
+    Args:
+        See `Client`.
+    """
+
+    def __init__(self, *args, **kwargs) -> None:
+        super().__init__(*args, **kwargs)
+        self.channel: Optional[grpc.aio.Channel] = None
+        # Concurrent first requests must share one connection attempt.
+        self._connect_lock = asyncio.Lock()
+
+    async def _connect(self) -> None:
+        """Find the server as `Client._connect` does, probing every candidate port concurrently."""
+        async with self._connect_lock:
+            if self._made_first_connection:
+                return
+            ports, rendezvous_port = self._candidate_ports()
+            channels = {}
+            ready_tasks = {}
+
+            def probe(port: int) -> None:
+                channels[port] = grpc.aio.insecure_channel(f'{self.channel_address}:{port}', options=_CLIENT_CHANNEL_OPTIONS)
+                ready_tasks[asyncio.ensure_future(channels[port].channel_ready())] = port
+
+            first_call_time = time.time()
+            try:
+                probe(ports[0])
+                if rendezvous_port is not None:
+                    done, _ = await asyncio.wait(ready_tasks, timeout=_RENDEZVOUS_GRACE_SECONDS)
+                    if done:
+                        self.port = rendezvous_port
+                if self.port is None:
+                    for port in ports[1:]:
+                        probe(port)
+                # Allow time for the server to start as long as its container is running
+                while self.port is None and time.time() - first_call_time < STARTUP_LIMIT_SECONDS:
+                    done, _ = await asyncio.wait(ready_tasks, timeout=_CONNECT_POLL_SECONDS, return_when=asyncio.FIRST_COMPLETED)
+                    if done:
+                        self.port = ready_tasks[done.pop()]
+                    else:
+                        # Raises a socket.gaierror if the inference_server container is no longer running.
+                        socket.gethostbyname(self.channel_address)
+            finally:
+                for ready_task in ready_tasks:
+                    ready_task.cancel()
+                await asyncio.gather(*ready_tasks, return_exceptions=True)
+                for port, channel in channels.items():
+                    if port != self.port:
+                        await channel.close()
+
+            if self.port is None:
+                raise RuntimeError(f'Failed to connect to server after waiting {STARTUP_LIMIT_SECONDS} seconds')
+            self.channel = channels[self.port]
+            self.stub = kaggle_evaluation_grpc.KaggleEvaluationServiceStub(self.channel)
+            self._made_first_connection = True
+
+    async def wait_until_ready(self) -> Optional[List[str]]:
+        """See `Client.wait_until_ready`."""
+        if not self._made_first_connection:
+            await self._connect()
+        request = kaggle_evaluation_proto.KaggleEvaluationRequest(name=READY_ENDPOINT)
+        call = self.stub.Send(request, metadata=self._metadata, wait_for_ready=True, timeout=STARTUP_LIMIT_SECONDS)
+        try:
+            response = await call
+        except grpc.RpcError as err:
+            if f'No listener for {READY_ENDPOINT} was registered' in str(err):
+                return None
+            raise err
+        self._negotiate_transport(await call.trailing_metadata())
+        return _deserialize(response.payload)
+
+    async def _send_with_deadline(
+        self, request, deadline_seconds: Optional[float] = None, apply_deadline: bool = True
+    ) -> kaggle_evaluation_proto.KaggleEvaluationResponse:
+        """See `Client._send_with_deadline`. Requests sent before the first response arrives have no deadline, nor do
+        requests sent without apply_deadline, whose caller enforces one instead.
+        """
+        if not self._made_first_connection:
+            await self._connect()
+
+        if self._received_first_response:
+            timeout = None
+            if apply_deadline:
+                timeout = deadline_seconds if deadline_seconds is not None else self.endpoint_deadline_seconds
+            try:
+                return await self.stub.Send(request, metadata=self._metadata, wait_for_ready=False, timeout=timeout)
+            except grpc.aio.AioRpcError as err:
+                if err.code() == grpc.StatusCode.DEADLINE_EXCEEDED:
+                    raise GRPCDeadlineError()
+                raise err
+
+        # The first request has no deadline, as it may include slow one-off steps like loading a model.
+        call = self.stub.Send(request, metadata=self._metadata, wait_for_ready=False)
+        response = await call
+        self._received_first_response = True
+        self._negotiate_transport(await call.trailing_metadata())
+        return response
+
+    async def send(self, name: str, *args, **kwargs) -> Any:
+        """See `Client.send`."""
+        return await self.send_request(self.serialize_request(name, *args, **kwargs))
+
+    async def send_request(self, request: kaggle_evaluation_proto.KaggleEvaluationRequest, deadline_seconds: Optional[float] = None) -> Any:
+        """See `Client.send_request`."""
+        return await self._send_request(request, deadline_seconds)
+
+    def submit(self, request: kaggle_evaluation_proto.KaggleEvaluationRequest) -> 'asyncio.Future[Any]':
+        """Start sending a request built by `serialize_request`, to be awaited with `receive`."""
+        return asyncio.ensure_future(self._send_request(request, apply_deadline=False))
+
+    async def receive(self, response: 'asyncio.Future[Any]', deadline_seconds: Optional[float] = None) -> Any:
+        """Wait for the response to a request from `submit`.
+
+        Raises:
+            GRPCDeadlineError if the response doesn't arrive within deadline_seconds, or endpoint_deadline_seconds by
+            default, from when this is called. The request is cancelled. As with `send_request`, there's no deadline
+            before the first response.
+        """
+        if not self._received_first_response:
+            return await response
+        timeout = deadline_seconds if deadline_seconds is not None else self.endpoint_deadline_seconds
+        try:
+            return await asyncio.wait_for(response, timeout)
+        except asyncio.TimeoutError:
+            raise GRPCDeadlineError()
+
+    async def _send_request(
+        self, request: kaggle_evaluation_proto.KaggleEvaluationRequest, deadline_seconds: Optional[float] = None, apply_deadline: bool = True
+    ) -> Any:
+        start_time = time.perf_counter()
+        try:
+            try:
+                response = await self._send_with_deadline(request, deadline_seconds, apply_deadline)
+            except grpc.RpcError as err:
+                if self.schema_cache is None or _UNKNOWN_SCHEMA_MESSAGE not in str(err):
+                    raise err
+                # The server no longer has a schema it cached earlier, e.g. because it restarted.
+                self.schema_cache.attach_schemas([*request.args, *request.kwargs.values()])
+                response = await self._send_with_deadline(request, deadline_seconds, apply_deadline)
+        finally:
+            self._release_shared_memory(request)
+        round_trip_seconds = time.perf_counter() - start_time
+        self._confirm_schemas(request)
+        return self._read_response(request.name, response, round_trip_seconds)
+
+    def open_stream(self, max_in_flight: int = 2) -> 'AsyncRequestStream':
+        """See `Client.open_stream`."""
+        if not self._made_first_connection:
+            raise RuntimeError('Streams can only be opened once a connection to the server has been made')
+        return AsyncRequestStream(self, max_in_flight)
+
+    async def close(self) -> None:
+        if self.channel is not None:
+            await self.channel.close()
+        if self.shared_memory is not None:
+            self.shared_memory.release()
+        self._remove_shared_memory_probe()
+
+
+class AsyncRequestStream:
+    """A `RequestStream` for an `AsyncClient`, whose `submit`, `receive` and `close` are coroutines."""
+
+    def __init__(self, client: AsyncClient, max_in_flight: int = 2):
+        if not isinstance(max_in_flight, int) or max_in_flight < 1:
+            raise ValueError(f'max_in_flight must be a positive int, got {max_in_flight}')
+        self.client = client
+        self.max_in_flight = max_in_flight
+        # Requests are kept until their response arrives in case of a fallback to unary calls.
+        self._pending_requests = collections.deque()
+        self._submit_times = collections.deque()
+        self._received_any_response = False
+        self._use_unary_fallback = False
+        self._call = client.stub.SendStream(metadata=client._metadata)
+
+    async def submit(self, request: kaggle_evaluation_proto.KaggleEvaluationRequest) -> None:
+        """See `RequestStream.submit`."""
+        if len(self._pending_requests) >= self.max_in_flight:
+            raise RuntimeError(f'At most {self.max_in_flight} requests can await a response; call receive first')
+        self._pending_requests.append(request)
+        self._submit_times.append(time.perf_counter())
+        if not self._use_unary_fallback:
+            try:
+                await self._call.write(request)
+            except (grpc.RpcError, asyncio.InvalidStateError):
+                pass  # The call has failed, which the next receive reports.
+
+    async def receive(self, deadline_seconds: Optional[float] = None) -> Any:
+        """See `RequestStream.receive`."""
+        if not self._pending_requests:
+            raise RuntimeError('No requests are awaiting a response')
+        timeout = deadline_seconds if deadline_seconds is not None else self.client.endpoint_deadline_seconds
+        request = self._pending_requests.popleft()
+        submit_time = self._submit_times.popleft()
+        if self._use_unary_fallback:
+            return await self.client.send_request(request, timeout)
+
+        try:
+            response = await asyncio.wait_for(self._call.read(), timeout)
+        except asyncio.TimeoutError:
+            self._call.cancel()
+            raise GRPCDeadlineError()
+        except grpc.aio.AioRpcError as err:
+            if err.code() == grpc.StatusCode.UNIMPLEMENTED and not self._received_any_response:
+                self._use_unary_fallback = True
+                return await self.client.send_request(request, timeout)
+            raise err
+        finally:
+            self.client._release_shared_memory(request)
+        if response is grpc.aio.EOF:
+            raise RuntimeError('Server closed the stream before responding to every request')
+        self._received_any_response = True
+        self.client._confirm_schemas(request)
+        return self.client._read_response(request.name, response, time.perf_counter() - submit_time)
+
+    async def close(self) -> None:
+        """See `RequestStream.close`."""
+        if self._pending_requests or self._use_unary_fallback:
+            self._call.cancel()
+        else:
+            await self._call.done_writing()
 
 
 ### Server code
@@ -325,10 +1581,74 @@ class KaggleEvaluationServiceServicer(kaggle_evaluation_grpc.KaggleEvaluationSer
     to requests from the Gateway. The Gateway may also listen for requests from the inference_server in some cases.
     """
 
-    def __init__(self, listeners: Tuple[Callable]):
+    def __init__(
+        self,
+        listeners: Tuple[Callable],
+        compression_policy: Optional[CompressionPolicy] = None,
+        endpoint_concurrency: Optional[Dict[str, int]] = None,
+        process_pool: Optional[futures.ProcessPoolExecutor] = None,
+    ):
         self.listeners_map = dict((func.__name__, func) for func in listeners)
+        self._endpoint_semaphores = {name: threading.BoundedSemaphore(limit) for name, limit in (endpoint_concurrency or {}).items()}
+        self._process_pool = process_pool
+        self.compression_policy = compression_policy
+        if compression_policy is not None:
+            # Only applies to clients that don't propose a policy, which can't report which codecs they decode.
+            compression_policy.restrict_to(_BASELINE_CODECS)
+        # Policies proposed by clients, keyed by their header so adaptive measurements persist across requests.
+        self._compression_policies: Dict[str, CompressionPolicy] = {}
+        self._compression_policies_lock = threading.Lock()
+        self._capabilities_metadata = (
+            (_AVAILABLE_CODECS_METADATA_KEY, ','.join(_available_codecs())),
+            (_SCHEMA_CACHE_METADATA_KEY, 'enabled'),
+            (_NUMPY_BUFFERS_METADATA_KEY, 'enabled'),
+        )
+        # Response files are tracked until the client consumes them, so that those of calls it abandoned are removed
+        # rather than left behind in shared memory.
+        self._shared_memory = SharedMemoryTransport()
+
+    def _response_shared_memory(self, context: grpc.ServicerContext) -> Optional[SharedMemoryTransport]:
+        """Use shared memory for responses if the client proposed it and its probe file shows it's on this host."""
+        probe = dict(context.invocation_metadata()).get(_SHARED_MEMORY_METADATA_KEY)
+        if probe is None or not _is_loopback_peer(context.peer()):
+            return None
+        try:
+            probe_exists = os.path.exists(_shared_memory_path(probe))
+        except ValueError:
+            return None
+        return self._shared_memory if probe_exists else None
+
+    def _negotiate_transport(self, context: grpc.ServicerContext) -> Tuple[CompressionPolicy, Optional[SharedMemoryTransport], bool, bool]:
+        """The compression policy and shared memory transport for responses, whether the client wants timings, and
+        whether it reads numpy buffers.
+        """
+        compression_policy = self._response_compression_policy(context)
+        shared_memory = self._response_shared_memory(context)
+        trailing_metadata = self._capabilities_metadata
+        if shared_memory is not None:
+            trailing_metadata += ((_SHARED_MEMORY_METADATA_KEY, 'enabled'),)
+        context.set_trailing_metadata(trailing_metadata)
+        metadata_keys = {key for key, _ in context.invocation_metadata()}
+        return compression_policy, shared_memory, _TIMINGS_METADATA_KEY in metadata_keys, _NUMPY_BUFFERS_METADATA_KEY in metadata_keys
+
+    def _response_compression_policy(self, context: grpc.ServicerContext) -> CompressionPolicy:
+        """Use the client's proposed policy if there is one, then the server's policy, then the default for the peer."""
+        header = dict(context.invocation_metadata()).get(_COMPRESSION_POLICY_METADATA_KEY)
+        if header is None and self.compression_policy is not None:
+            return self.compression_policy
+        if header is None:
+            header = 'loopback' if _is_loopback_peer(context.peer()) else 'remote'
+        with self._compression_policies_lock:
+            if header not in self._compression_policies:
+                if header == 'loopback':
+                    policy = CompressionPolicy('none', network_bytes_per_second=_LOOPBACK_NETWORK_BYTES_PER_SECOND)
+                elif header == 'remote':
+                    policy = CompressionPolicy('lz4')
+                else:
+                    policy = CompressionPolicy.from_header(header)
+                self._compression_policies[header] = policy
+            return self._compression_policies[header]
 
-    # pylint: disable=unused-argument
     def Send(
         self, request: kaggle_evaluation_proto.KaggleEvaluationRequest, context: grpc.ServicerContext
     ) -> kaggle_evaluation_proto.KaggleEvaluationResponse:
@@ -337,7 +1657,7 @@ class KaggleEvaluationServiceServicer(kaggle_evaluation_grpc.KaggleEvaluationSer
 
         Args:
             request: The KaggleEvaluationRequest protobuf message.
-            context: (Unused) gRPC context.
+            context: gRPC context, used to negotiate response compression and shared memory.
 
         Returns:
             The KaggleEvaluationResponse protobuf message.
@@ -345,23 +1665,132 @@ class KaggleEvaluationServiceServicer(kaggle_evaluation_grpc.KaggleEvaluationSer
         Raises:
             NotImplementedError if the caller has not registered a handler for the requested endpoint.
         """
+        response = self._respond(request, *self._negotiate_transport(context))
+        if not context.add_callback(self._shared_memory.forget_consumed):
+            # The client abandoned the call before the response was ready, so it will never read the response's files.
+            self._shared_memory.release(_shared_memory_names([response.payload]))
+        return response
+
+    def SendStream(
+        self, request_iterator: Iterator[kaggle_evaluation_proto.KaggleEvaluationRequest], context: grpc.ServicerContext
+    ) -> Iterator[kaggle_evaluation_proto.KaggleEvaluationResponse]:
+        """Handler for streaming gRPC requests. Each request is handled as by `Send`, and responses are yielded in
+        request order. An exception ends the stream with the same status details a failed `Send` would report.
+        """
+        transport = self._negotiate_transport(context)
+        context.add_callback(self._shared_memory.forget_consumed)
+        for request in request_iterator:
+            try:
+                response = self._respond(request, *transport)
+            except Exception as err:
+                context.abort(grpc.StatusCode.UNKNOWN, f'Exception calling application: {err}')
+            # gRPC only asks for the next response once this one was sent, and closes the stream if the client is gone.
+            sent = False
+            try:
+                yield response
+                sent = True
+            finally:
+                if not sent:
+                    self._shared_memory.release(_shared_memory_names([response.payload]))
+
+    def close(self) -> None:
+        """Remove any response files the client never consumed, such as those of calls abandoned as they completed."""
+        self._shared_memory.release()
+
+    def _respond(
+        self,
+        request: kaggle_evaluation_proto.KaggleEvaluationRequest,
+        compression_policy: CompressionPolicy,
+        shared_memory: Optional[SharedMemoryTransport] = None,
+        record_timings: bool = False,
+        numpy_buffers: bool = False,
+    ) -> kaggle_evaluation_proto.KaggleEvaluationResponse:
+        if request.name == READY_ENDPOINT:
+            return kaggle_evaluation_proto.KaggleEvaluationResponse(payload=_serialize(sorted(self.listeners_map), compression_policy))
         if request.name not in self.listeners_map:
             raise NotImplementedError(f'No listener for {request.name} was registered.')
 
-        args = map(_deserialize, request.args)
+        start_time = time.perf_counter()
+        args = list(map(_deserialize, request.args))
         kwargs = {key: _deserialize(value) for key, value in request.kwargs.items()}
-        response_function = self.listeners_map[request.name]
-        response_payload = _serialize(response_function(*args, **kwargs))
-        return kaggle_evaluation_proto.KaggleEvaluationResponse(payload=response_payload)
+        deserialized_time = time.perf_counter()
+        response_data = self._call_listener(request.name, args, kwargs)
+        listener_time = time.perf_counter()
+        response = kaggle_evaluation_proto.KaggleEvaluationResponse(payload=_serialize(response_data, compression_policy, shared_memory, numpy_buffers=numpy_buffers))
+        if record_timings:
+            response.timings['deserialize_request'] = deserialized_time - start_time
+            response.timings['listener'] = listener_time - deserialized_time
+            response.timings['serialize_response'] = time.perf_counter() - listener_time
+        return response
+
+    def _call_listener(self, name: str, args: Sequence[Any], kwargs: Dict[str, Any]) -> Any:
+        """Run a listener, in the process pool if there is one, while holding its endpoint's concurrency slot."""
+        response_function = self.listeners_map[name]
+        with self._endpoint_semaphores.get(name, contextlib.nullcontext()):
+            if self._process_pool is not None:
+                return self._process_pool.submit(response_function, *args, **kwargs).result()
+            return response_function(*args, **kwargs)
+
+
+def _create_process_pool(num_workers: int, start_method: str) -> futures.ProcessPoolExecutor:
+    """Create a process pool whose workers are all running before any gRPC threads exist.
+
+    Spawn is the safe default: polars and gRPC can both deadlock in a forked child if their threads were active in
+    the parent. Fork lets workers inherit models already loaded by the parent and listeners that aren't importable,
+    but is only safe if the parent hasn't used polars' thread pool yet, so workers are started eagerly.
+    """
+    process_pool = futures.ProcessPoolExecutor(max_workers=num_workers, mp_context=multiprocessing.get_context(start_method))
+    # With the fork start method every worker is launched on the first submission.
+    process_pool.submit(int).result()
+    return process_pool
+
+
+def _on_server_stop(server: grpc.Server, callback: Callable[[], None]) -> None:
+    """Run a callback once the server has stopped, including any grace period for in-flight requests."""
+    stop_server = server.stop
+
+    def stop(grace: Optional[float]) -> threading.Event:
+        stopped = stop_server(grace)
+
+        def run_callback() -> None:
+            stopped.wait()
+            callback()
+
+        threading.Thread(target=run_callback, name='kaggle-evaluation-server-stop', daemon=True).start()
+        return stopped
+
+    server.stop = stop
 
 
-def define_server(*endpoint_listeners: Callable) -> grpc.server:
+def define_server(
+    *endpoint_listeners: Callable,
+    compression_policy: Optional[CompressionPolicy] = None,
+    max_workers: Optional[int] = None,
+    process_pool_workers: Optional[int] = None,
+    process_pool_start_method: str = 'spawn',
+    endpoint_concurrency: Optional[Dict[str, int]] = None,
+    port: Optional[int] = None,
+) -> grpc.server:
     """Registers the endpoints that the container is able to respond to, then starts a server which listens for
     those endpoints. The endpoints that need to be implemented will depend on the specific competition.
 
     Args:
         endpoint_listeners: Tuple of functions that define how requests to the endpoint of the function name should be
             handled.
+        compression_policy: Compression for responses to clients that don't propose their own policy.
+        max_workers: Number of requests the server can handle concurrently. Listeners must be thread safe if this is
+            greater than one. Defaults to process_pool_workers if that's set, so that every worker process can be
+            busy, and to one otherwise.
+        process_pool_workers: If set, listeners run in a pool of this many processes rather than on the server's
+            threads, so CPU bound models that hold the GIL can still handle requests in parallel. Arguments and
+            results are pickled, and listener state is not shared between worker processes. The pool is shut down
+            once the server has stopped.
+        process_pool_start_method: The multiprocessing start method for the process pool. With the default, spawn,
+            listeners must be importable functions and each worker loads its own model.
+        endpoint_concurrency: Optional map of endpoint name to the maximum number of concurrent calls to it.
+        port: Listen on this port rather than the first available port in GRPC_PORTS. The port is recorded in the
+            rendezvous file, see RENDEZVOUS_PATH_ENV_VAR, so that local clients can find it quickly. The file is removed
+            once the server has stopped, unless another server has replaced it since.
 
     Returns:
         The gRPC server object, which has been started. It should be stopped at exit time.
@@ -376,9 +1805,28 @@ def define_server(*endpoint_listeners: Callable) -> grpc.server:
             raise ValueError(f'Endpoint listeners passed to `serve` must be functions, got {type(func)}')
         if func.__name__ == '<lambda>':
             raise ValueError('Functions passed as endpoint listeners must be named')
+    if process_pool_workers is not None and (not isinstance(process_pool_workers, int) or process_pool_workers < 1):
+        raise ValueError(f'process_pool_workers must be a positive int or None, got {process_pool_workers}')
+    if max_workers is None:
+        max_workers = process_pool_workers or 1
+    if not isinstance(max_workers, int) or max_workers < 1:
+        raise ValueError(f'max_workers must be a positive int, got {max_workers}')
+    listener_names = set(func.__name__ for func in endpoint_listeners)
+    for name, limit in (endpoint_concurrency or {}).items():
+        if name not in listener_names:
+            raise ValueError(f'Concurrency limit set for unregistered endpoint {name}')
+        if not isinstance(limit, int) or limit < 1:
+            raise ValueError(f'Concurrency limit for {name} must be a positive int, got {limit}')
 
-    server = grpc.server(futures.ThreadPoolExecutor(max_workers=1), options=_GRPC_CHANNEL_OPTIONS)
-    kaggle_evaluation_grpc.add_KaggleEvaluationServiceServicer_to_server(KaggleEvaluationServiceServicer(endpoint_listeners), server)
-    grpc_port = _get_available_port()
+    process_pool = _create_process_pool(process_pool_workers, process_pool_start_method) if process_pool_workers else None
+    servicer = KaggleEvaluationServiceServicer(endpoint_listeners, compression_policy, endpoint_concurrency, process_pool)
+    server = grpc.server(futures.ThreadPoolExecutor(max_workers=max_workers), options=_GRPC_CHANNEL_OPTIONS)
+    _on_server_stop(server, servicer.close)
+    if process_pool is not None:
+        _on_server_stop(server, functools.partial(process_pool.shutdown, cancel_futures=True))
+    kaggle_evaluation_grpc.add_KaggleEvaluationServiceServicer_to_server(servicer, server)
+    grpc_port = port if port is not None else _get_available_port()
     server.add_insecure_port(f'[::]:{grpc_port}')
+    _write_rendezvous(grpc_port)
+    _on_server_stop(server, functools.partial(_remove_rendezvous, grpc_port))
     return server
@@ -0,0 +1,149 @@
+"""Incremental submission writing for long replays.
+
+Rather than holding every prediction in memory until the end of a run, each validated batch is appended to an Arrow
+IPC stream on disk as soon as it arrives, and the streams are converted to the submission parquet file one record batch
+at a time once the run completes. Memory use is therefore flat in the length of the run.
+
+A checkpoint file records how many batches have been durably written. If a run crashes, a new run with resume enabled
+picks up after the last checkpointed batch: any partially written batch is ignored, and new batches go to a fresh
+stream segment alongside the existing ones.
+"""
+
+import json
+import os
+import shutil
+
+from typing import Any, Iterator, List, Optional, Union
+
+import pandas as pd
+import polars as pl
+import pyarrow
+import pyarrow.ipc
+import pyarrow.parquet
+
+
+_CHECKPOINT_SUFFIX = '.checkpoint.json'
+_SEGMENTS_SUFFIX = '.parts'
+# Batches are typically a single row, so they're combined into larger parquet row groups when finalizing.
+_ROW_GROUP_ROWS = 1 << 16
+
+
+class SubmissionWriter:
+    """Appends submission batches to disk as they're produced, then writes the final parquet file.
+
+    Args:
+        submission_path: Where the finished submission is written.
+        resume: Continue from the checkpoint left by an earlier, incomplete run with the same submission_path, if any.
+            Otherwise any earlier progress is discarded.
+    """
+
+    def __init__(self, submission_path: str, resume: bool = False):
+        self.submission_path = str(submission_path)
+        self.checkpoint_path = self.submission_path + _CHECKPOINT_SUFFIX
+        self.segments_dir = self.submission_path + _SEGMENTS_SUFFIX
+        # Each segment is one Arrow IPC stream, written by a single run: {'path': str, 'num_batches': int}
+        self.segments: List[dict] = []
+        self.last_row_id: Any = None
+        self._schema: Optional[pyarrow.Schema] = None
+        self._writer: Optional[pyarrow.ipc.RecordBatchStreamWriter] = None
+        self._sink = None
+
+        if resume and os.path.exists(self.checkpoint_path):
+            with open(self.checkpoint_path) as f_open:
+                checkpoint = json.load(f_open)
+            self.segments = [segment for segment in checkpoint['segments'] if segment['num_batches'] > 0]
+            self.last_row_id = checkpoint['last_row_id']
+            if self.segments:
+                with pyarrow.ipc.open_stream(self.segments[0]['path']) as reader:
+                    self._schema = reader.schema
+        else:
+            self._remove_progress()
+        os.makedirs(self.segments_dir, exist_ok=True)
+
+    @property
+    def num_batches(self) -> int:
+        """The number of batches durably written so far, including those from earlier runs."""
+        return sum(segment['num_batches'] for segment in self.segments)
+
+    def _remove_progress(self) -> None:
+        if os.path.exists(self.checkpoint_path):
+            os.remove(self.checkpoint_path)
+        shutil.rmtree(self.segments_dir, ignore_errors=True)
+
+    def _write_checkpoint(self) -> None:
+        tmp_path = self.checkpoint_path + '.tmp'
+        with open(tmp_path, 'w') as f_open:
+            json.dump({'segments': self.segments, 'last_row_id': self.last_row_id}, f_open)
+        os.replace(tmp_path, self.checkpoint_path)
+
+    def _open_segment(self) -> None:
+        path = os.path.join(self.segments_dir, f'segment_{len(self.segments)}.arrows')
+        self._sink = pyarrow.OSFile(path, 'wb')
+        self._writer = pyarrow.ipc.new_stream(self._sink, self._schema)
+        self.segments.append({'path': path, 'num_batches': 0})
+
+    def append(self, submission_batch: Union[pl.DataFrame, pd.DataFrame], last_row_id: Any = None) -> None:
+        """Durably write one batch of the submission.
+
+        Args:
+            submission_batch: The batch's rows, including the row ID columns.
+            last_row_id: A JSON serializable identifier for the batch, recorded in the checkpoint for reference.
+
+        Raises:
+            ValueError if the batch's schema can't be cast to that of the first batch.
+        """
+        if isinstance(submission_batch, pd.DataFrame):
+            table = pyarrow.Table.from_pandas(submission_batch, preserve_index=False)
+        else:
+            table = submission_batch.to_arrow()
+        if self._schema is None:
+            self._schema = table.schema
+        elif table.schema != self._schema:
+            try:
+                table = table.cast(self._schema)
+            except (pyarrow.ArrowException, ValueError) as err:
+                raise ValueError(f'Submission batch with columns {table.column_names} does not match the first batch: {err}') from None
+
+        if self._writer is None:
+            self._open_segment()
+        self._writer.write_table(table)
+        self._sink.flush()
+        os.fsync(self._sink.fileno())
+        self.segments[-1]['num_batches'] += 1
+        self.last_row_id = last_row_id
+        self._write_checkpoint()
+
+    def _read_batches(self) -> Iterator[pyarrow.RecordBatch]:
+        for segment in self.segments:
+            with pyarrow.ipc.open_stream(segment['path']) as reader:
+                # Only trust the batches the checkpoint vouches for; anything after may be partially written.
+                for _ in range(segment['num_batches']):
+                    yield reader.read_next_batch()
+
+    def close(self) -> None:
+        """Stop writing without producing the submission file, leaving the checkpoint for a later resume."""
+        if self._writer is not None:
+            self._writer.close()
+            self._sink.close()
+            self._writer = None
+            self._sink = None
+
+    def finalize(self) -> None:
+        """Write the submission file from every batch written so far, then clean up the intermediate files."""
+        self.close()
+        if self._schema is None:
+            raise ValueError('No submission batches were written')
+        tmp_path = self.submission_path + '.tmp'
+        with pyarrow.parquet.ParquetWriter(tmp_path, self._schema) as writer:
+            row_group_batches = []
+            row_group_rows = 0
+            for record_batch in self._read_batches():
+                row_group_batches.append(record_batch)
+                row_group_rows += record_batch.num_rows
+                if row_group_rows >= _ROW_GROUP_ROWS:
+                    writer.write_table(pyarrow.Table.from_batches(row_group_batches, self._schema))
+                    row_group_batches, row_group_rows = [], 0
+            if row_group_batches:
+                writer.write_table(pyarrow.Table.from_batches(row_group_batches, self._schema))
+        os.replace(tmp_path, self.submission_path)
+        self._remove_progress()
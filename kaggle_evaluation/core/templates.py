@@ -5,12 +5,13 @@ import os
 import time
 import warnings
 
-from typing import Any, Callable, Generator, Optional, Tuple, Union
+from typing import Any, Callable, Generator, Optional, Sequence, Tuple, Union
 
 import pandas as pd
 import polars as pl
 
 import kaggle_evaluation.core.base_gateway
+import kaggle_evaluation.core.feature_store
 import kaggle_evaluation.core.relay
 
 
@@ -65,6 +66,35 @@ class Gateway(kaggle_evaluation.core.base_gateway.BaseGateway, abc.ABC):
         raise NotImplementedError
 
 
+class _DefaultPredictBatch:
+    """A `predict_batch` endpoint that calls `predict` once per data batch. Users with vectorized models can
+    register their own `predict_batch` listener instead, taking a list of `predict` argument tuples and returning a
+    list with one prediction per tuple.
+
+    Implemented as a class rather than a closure so that it can be pickled for process pool servers.
+    """
+
+    def __init__(self, predict: Callable):
+        self.__name__ = 'predict_batch'
+        self.predict = predict
+
+    def __call__(self, data_batches: list) -> list:
+        return [self.predict(*data_batch) for data_batch in data_batches]
+
+
+class _DeclaredValue:
+    """The listener for one of the relay's reserved endpoints through which the inference server declares something
+    about itself, e.g. relay.COLUMNS_ENDPOINT. Implemented as a class so that it can be pickled for process pool servers.
+    """
+
+    def __init__(self, endpoint: str, value: Any):
+        self.__name__ = endpoint
+        self.value = value
+
+    def __call__(self) -> Any:
+        return self.value
+
+
 class InferenceServer(abc.ABC):
     """
     Base class for competition participants to inherit from when writing their submission. In most cases, users should
@@ -72,8 +102,50 @@ class InferenceServer(abc.ABC):
     provide a mock Gateway for testing.
     """
 
-    def __init__(self, *endpoint_listeners: Callable):
-        self.server = kaggle_evaluation.core.relay.define_server(*endpoint_listeners)
+    def __init__(
+        self,
+        *endpoint_listeners: Callable,
+        feature_store: Optional[kaggle_evaluation.core.feature_store.RollingFeatureStore] = None,
+        required_columns: Optional[Sequence[str]] = None,
+        model_version: Optional[str] = None,
+        **server_options,
+    ):
+        """
+        Args:
+            endpoint_listeners: Functions to serve, each handling requests to the endpoint sharing its name.
+            feature_store: If set, updated with the first argument of every `predict` call before `predict` runs, so
+                that `predict` can read rolling features from it rather than rebuilding them from its own history.
+                `predict` calls then run one at a time, and a custom `predict_batch` listener isn't allowed, since
+                batched replay would bypass the store.
+            required_columns: The only input columns the endpoints read. Gateways that support it drop every other
+                column, apart from ones they always send such as row IDs, which cuts the time spent serializing and
+                sending data. Gateways without support send every column as usual.
+            model_version: Identifies the model's current version. Gateways with a prediction cache reuse predictions
+                cached for the same version and request, so change it whenever the model's predictions may change.
+            server_options: Forwarded to `relay.define_server`, e.g. `max_workers` or `process_pool_workers`.
+        """
+        listener_names = [func.__name__ for func in endpoint_listeners if isinstance(func, Callable)]
+        self.feature_store = feature_store
+        if feature_store is not None:
+            if 'predict' not in listener_names:
+                raise ValueError('A feature store requires a `predict` endpoint listener')
+            if server_options.get('process_pool_workers'):
+                raise ValueError('A feature store must be updated in the serving process, so it cannot be used with process_pool_workers')
+            if 'predict_batch' in listener_names:
+                # Batched replay would call it instead of `predict`, so the store would never be updated.
+                raise ValueError('A feature store is updated by `predict` calls, so it cannot be used with a custom `predict_batch` listener')
+            endpoint_listeners = tuple(
+                kaggle_evaluation.core.feature_store.FeatureStoreListener(func, feature_store) if name == 'predict' else func
+                for func, name in zip(endpoint_listeners, listener_names)
+            )
+        if 'predict' in listener_names and 'predict_batch' not in listener_names:
+            # Support the gateway's batched replay mode even if the user only wrote a `predict` function.
+            endpoint_listeners += (_DefaultPredictBatch(endpoint_listeners[listener_names.index('predict')]),)
+        if required_columns is not None:
+            endpoint_listeners += (_DeclaredValue(kaggle_evaluation.core.relay.COLUMNS_ENDPOINT, list(required_columns)),)
+        if model_version is not None:
+            endpoint_listeners += (_DeclaredValue(kaggle_evaluation.core.relay.MODEL_VERSION_ENDPOINT, str(model_version)),)
+        self.server = kaggle_evaluation.core.relay.define_server(*endpoint_listeners, **server_options)
         self.client = None  # The inference_server can have a client but it isn't typically necessary.
         self._issued_startup_time_warning = False
         self._startup_limit_seconds = kaggle_evaluation.core.relay.STARTUP_LIMIT_SECONDS
@@ -0,0 +1,190 @@
+"""Sharded offline backtests for the Mitsui gateway.
+
+Splits the replayed date_ids into contiguous shards and replays them in parallel, either with one gateway and
+inference server pair per shard on distinct ports, or with every shard's gateway sharing a single multi-worker
+server. The per-shard submissions are merged into a single submission file in date order.
+
+Stateful models typically rely on the history they accumulate from earlier dates, including the lagged labels which
+trail the test data by up to four dates. Each shard therefore starts with a warm-up window of dates from the end of the
+previous shard: the model sees them, but their predictions are dropped when the shards are merged.
+"""
+
+import multiprocessing
+import os
+import tempfile
+
+from concurrent import futures
+from typing import Callable, List, Optional, Tuple
+
+import polars as pl
+
+import kaggle_evaluation.core.relay
+
+import mitsui_gateway
+import mitsui_inference_server
+
+
+# The lagged label files trail the test data by one to four dates.
+MAX_LABEL_LAG = 4
+
+
+def split_date_ids(date_ids: List[int], num_shards: int, warmup_dates: int = MAX_LABEL_LAG) -> List[Tuple[int, int, int]]:
+    """Split sorted date_ids into up to num_shards contiguous shards of similar size.
+
+    Returns:
+        A (warmup_start, start, end) tuple per shard. The shard scores start <= date_id < end and replays
+        warmup_start <= date_id < start first to warm up the model.
+    """
+    if num_shards < 1:
+        raise ValueError(f'num_shards must be positive, got {num_shards}')
+    if warmup_dates < 0:
+        raise ValueError(f'warmup_dates must be non-negative, got {warmup_dates}')
+    num_shards = min(num_shards, len(date_ids))
+    shards = []
+    for shard_index in range(num_shards):
+        first = shard_index * len(date_ids) // num_shards
+        last = (shard_index + 1) * len(date_ids) // num_shards
+        end = date_ids[last] if last < len(date_ids) else date_ids[-1] + 1
+        shards.append((date_ids[max(0, first - warmup_dates)], date_ids[first], end))
+    return shards
+
+
+def _run_shard(
+    endpoint_listeners: Tuple[Callable],
+    data_paths: Optional[Tuple[str]],
+    date_id_range: Tuple[int, int],
+    port: int,
+    submission_path: str,
+    server_options: Optional[dict],
+    gateway_options: dict,
+) -> None:
+    """Replay one shard. Starts a dedicated inference server on `port` unless server_options is None, in which case
+    the shard connects to a server that is already running there.
+    """
+    server = None
+    if server_options is not None:
+        server = mitsui_inference_server.MitsuiInferenceServer(*endpoint_listeners, port=port, **server_options).server
+        server.start()
+    try:
+        gateway = mitsui_gateway.MitsuiGateway(data_paths, date_id_range=date_id_range, **gateway_options)
+        gateway.client.ports = [port]
+        gateway.submission_path = submission_path
+        gateway.run()
+    finally:
+        if server is not None:
+            server.stop(0)
+
+
+class MitsuiBacktestRunner:
+    def __init__(
+        self,
+        *endpoint_listeners: Callable,
+        data_paths: Optional[Tuple[str]] = None,
+        num_shards: Optional[int] = None,
+        warmup_dates: int = MAX_LABEL_LAG,
+        shared_server: bool = False,
+        server_options: Optional[dict] = None,
+        gateway_options: Optional[dict] = None,
+    ):
+        """
+        Args:
+            endpoint_listeners: The inference server's endpoint functions, e.g. `predict`. Unless shared_server is set
+                each shard runs in a spawned process, so these must be importable functions.
+            data_paths: Passed to MitsuiGateway.
+            num_shards: Number of shards to replay in parallel. Defaults to the CPU count, capped by the number of ports
+                in GRPC_PORTS when each shard runs its own server.
+            warmup_dates: Dates replayed before each shard's first scored date.
+            shared_server: Replay every shard against one server with a worker per shard, rather than one server
+                process per shard. Avoids loading the model several times, but stateful models will see interleaved
+                dates from every shard, so this is only appropriate for stateless models.
+            server_options: Extra keyword arguments for `relay.define_server`, e.g. `process_pool_workers`.
+            gateway_options: Extra keyword arguments for MitsuiGateway, e.g. `use_data_cache`.
+        """
+        if not endpoint_listeners:
+            raise ValueError('Must pass at least one endpoint listener, e.g. `predict`')
+        self.endpoint_listeners = endpoint_listeners
+        self.data_paths = data_paths
+        self.shared_server = shared_server
+        max_shards = os.cpu_count() or 1
+        if not shared_server:
+            max_shards = min(max_shards, len(kaggle_evaluation.core.relay.GRPC_PORTS))
+        self.num_shards = num_shards or max_shards
+        if not shared_server and self.num_shards > len(kaggle_evaluation.core.relay.GRPC_PORTS):
+            raise ValueError(f'At most {len(kaggle_evaluation.core.relay.GRPC_PORTS)} shards can run their own server')
+        self.warmup_dates = warmup_dates
+        self.server_options = server_options or {}
+        self.gateway_options = gateway_options or {}
+
+    def _get_date_ids(self) -> List[int]:
+        gateway = mitsui_gateway.MitsuiGateway(self.data_paths)
+        gateway.unpack_data_paths()
+        test_date_ids = pl.read_csv(gateway.competition_data_dir / 'test.csv', columns=['date_id'])['date_id']
+        return test_date_ids.unique().sort().to_list()
+
+    def run(self, output_path: str = 'submission.parquet') -> pl.DataFrame:
+        """Replay every shard, then write the merged submission to output_path.
+
+        Returns:
+            The merged submission.
+        """
+        shards = split_date_ids(self._get_date_ids(), self.num_shards, self.warmup_dates)
+        with tempfile.TemporaryDirectory() as shard_dir:
+            shard_paths = [os.path.join(shard_dir, f'submission_{i}.parquet') for i in range(len(shards))]
+            if self.shared_server:
+                self._run_shards_with_shared_server(shards, shard_paths)
+            else:
+                self._run_shards_with_dedicated_servers(shards, shard_paths)
+
+            # Drop each shard's warm-up predictions, which belong to the previous shard.
+            shard_submissions = [
+                pl.read_parquet(path).filter(pl.col('date_id') >= start) for path, (_, start, _) in zip(shard_paths, shards)
+            ]
+        submission = pl.concat(shard_submissions, how='vertical_relaxed').sort('date_id', maintain_order=True)
+        submission.write_parquet(output_path)
+        return submission
+
+    def _run_shards_with_dedicated_servers(self, shards: List[Tuple[int, int, int]], shard_paths: List[str]) -> None:
+        ports = kaggle_evaluation.core.relay._get_available_ports(len(shards))
+        # Forking is unsafe once polars has started its thread pool, which reading the date_ids already did.
+        with futures.ProcessPoolExecutor(max_workers=len(shards), mp_context=multiprocessing.get_context('spawn')) as executor:
+            shard_runs = [
+                executor.submit(
+                    _run_shard,
+                    self.endpoint_listeners,
+                    self.data_paths,
+                    (warmup_start, end),
+                    port,
+                    path,
+                    self.server_options,
+                    self.gateway_options,
+                )
+                for (warmup_start, _, end), port, path in zip(shards, ports, shard_paths)
+            ]
+            for shard_run in shard_runs:
+                shard_run.result()
+
+    def _run_shards_with_shared_server(self, shards: List[Tuple[int, int, int]], shard_paths: List[str]) -> None:
+        port = kaggle_evaluation.core.relay._get_available_port()
+        server_options = {'max_workers': len(shards), **self.server_options}
+        server = mitsui_inference_server.MitsuiInferenceServer(*self.endpoint_listeners, port=port, **server_options).server
+        server.start()
+        try:
+            # Forking is unsafe once gRPC is running, so the gateways share this process.
+            with futures.ThreadPoolExecutor(max_workers=len(shards)) as executor:
+                shard_runs = [
+                    executor.submit(
+                        _run_shard,
+                        self.endpoint_listeners,
+                        self.data_paths,
+                        (warmup_start, end),
+                        port,
+                        path,
+                        None,
+                        self.gateway_options,
+                    )
+                    for (warmup_start, _, end), path in zip(shards, shard_paths)
+                ]
+                for shard_run in shard_runs:
+                    shard_run.result()
+        finally:
+            server.stop(0)
@@ -0,0 +1,146 @@
+"""End-to-end replay benchmarks for the Mitsui gateway over synthetic data.
+
+The provided test.csv covers a few months, which is too short to show how replay time scales. This generates any
+number of dates of random walk prices with the columns of test.csv, derives consistent lagged labels from them with
+target_pairs.csv, and times full MitsuiGateway replays against a trivial inference server under several gateway
+configurations.
+
+Run from the command line with `python -m kaggle_evaluation.mitsui_benchmark --output results.json`.
+"""
+
+import argparse
+import json
+import shutil
+import tempfile
+import time
+
+from pathlib import Path
+
+import numpy as np
+import polars as pl
+
+import kaggle_evaluation.core.benchmark
+import kaggle_evaluation.core.relay
+
+import mitsui_gateway
+import mitsui_inference_server
+import mitsui_targets
+
+
+# About four years of trading days.
+DEFAULT_NUM_DATES = 1_000
+# Gateway options for each benchmarked configuration.
+DEFAULT_CONFIGURATIONS = {
+    'sequential': {},
+    'pipelined': {'pipeline_depth': 2},
+    'streamed': {'stream_max_in_flight': 4},
+    'batched': {'replay_batch_size': 32},
+    'async': {'async_max_in_flight': 4},
+}
+_NULL_FRACTION = 0.03
+_DAILY_LOG_RETURN_STD = 0.01
+
+
+def generate_synthetic_data(
+    output_dir: str | Path, source_data_dir: str | Path, num_dates: int = DEFAULT_NUM_DATES, first_date_id: int = 0, seed: int = 0
+) -> Path:
+    """Write a competition data directory of synthetic data: test.csv, target_pairs.csv and lagged_test_labels.
+
+    Args:
+        output_dir: Where to write the data.
+        source_data_dir: A competition data directory to take the test.csv columns and target_pairs.csv from.
+        num_dates: The number of dates in test.csv.
+        first_date_id: The first date_id.
+        seed: Seed for the prices and missing values.
+
+    Returns:
+        output_dir, which can be passed to MitsuiGateway as its data path.
+    """
+    source_data_dir, output_dir = Path(source_data_dir), Path(output_dir)
+    rng = np.random.default_rng(seed)
+    column_names = pl.read_csv(source_data_dir / 'test.csv', n_rows=1).columns
+    price_columns = [name for name in column_names if name not in ('date_id', 'is_scored')]
+
+    log_prices = rng.normal(np.log(100), 1, len(price_columns)) + np.cumsum(rng.normal(0, _DAILY_LOG_RETURN_STD, (num_dates, len(price_columns))), axis=0)
+    prices = np.exp(log_prices)
+    prices[rng.random(prices.shape) < _NULL_FRACTION] = np.nan
+    test = pl.from_numpy(prices, schema=price_columns).fill_nan(None).with_columns(
+        date_id=pl.int_range(first_date_id, first_date_id + num_dates, dtype=pl.Int64), is_scored=pl.lit(True)
+    )
+    test = test.select(column_names)
+
+    (output_dir / 'lagged_test_labels').mkdir(parents=True, exist_ok=True)
+    test.write_csv(output_dir / 'test.csv')
+    shutil.copy(source_data_dir / 'target_pairs.csv', output_dir / 'target_pairs.csv')
+    lagged_labels = mitsui_targets.TargetEngine(output_dir / 'target_pairs.csv').compute_lagged(test)
+    for lag, labels in lagged_labels.items():
+        labels.write_csv(output_dir / 'lagged_test_labels' / f'test_labels_lag_{lag}.csv')
+    return output_dir
+
+
+def _make_predict(target_names: list[str]):
+    predictions = pl.DataFrame({name: [0.0] for name in target_names})
+
+    def predict(test, label_lags_1, label_lags_2, label_lags_3, label_lags_4):
+        return predictions
+
+    return predict
+
+
+def benchmark_replay(data_dir: str | Path, gateway_options: dict | None = None) -> dict:
+    """Time a full MitsuiGateway replay of data_dir against a local server whose `predict` returns constants.
+
+    Returns:
+        The number of dates replayed, the wall time including server startup, and the mean time per date.
+    """
+    data_dir = Path(data_dir)
+    target_names = mitsui_targets.TargetPairs.from_csv(data_dir / 'target_pairs.csv').target_names
+    num_dates = pl.read_csv(data_dir / 'test.csv', columns=['date_id'])['date_id'].n_unique()
+    port = kaggle_evaluation.core.relay._get_available_port()
+    server = mitsui_inference_server.MitsuiInferenceServer(_make_predict(target_names), port=port).server
+    with tempfile.TemporaryDirectory() as output_dir:
+        start_time = time.perf_counter()
+        server.start()
+        try:
+            gateway = mitsui_gateway.MitsuiGateway((str(data_dir),), **(gateway_options or {}))
+            gateway.client.ports = [port]
+            gateway.submission_path = str(Path(output_dir) / 'submission.parquet')
+            gateway.run()
+        finally:
+            server.stop(0)
+        seconds = time.perf_counter() - start_time
+    return {'num_dates': num_dates, 'seconds_wall': seconds, 'seconds_per_date': seconds / num_dates}
+
+
+def run_benchmarks(
+    source_data_dir: str | Path, num_dates: int = DEFAULT_NUM_DATES, configurations: dict[str, dict] | None = None, seed: int = 0
+) -> list[dict]:
+    """Generate synthetic data once, then replay it under each named gateway configuration."""
+    configurations = configurations if configurations is not None else DEFAULT_CONFIGURATIONS
+    results = []
+    with tempfile.TemporaryDirectory() as data_dir:
+        generate_synthetic_data(data_dir, source_data_dir, num_dates, seed=seed)
+        for name, gateway_options in configurations.items():
+            result = benchmark_replay(data_dir, gateway_options)
+            results.append({'benchmark': 'mitsui_replay', 'configuration': name, 'gateway_options': gateway_options, **result})
+    return results
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description='Benchmark full Mitsui gateway replays over synthetic data.')
+    parser.add_argument('--source-data-dir', default='/kaggle/input/mitsui-commodity-prediction-challenge/')
+    parser.add_argument('--output', default='mitsui_benchmark_results.json', help='Where to write the JSON results.')
+    parser.add_argument('--num-dates', type=int, default=DEFAULT_NUM_DATES)
+    parser.add_argument(
+        '--configurations', type=json.loads, default=None, help='JSON object of named MitsuiGateway options. Defaults to DEFAULT_CONFIGURATIONS.'
+    )
+    parser.add_argument('--seed', type=int, default=0)
+    args = parser.parse_args()
+
+    results = run_benchmarks(args.source_data_dir, args.num_dates, args.configurations, args.seed)
+    settings = {'num_dates': args.num_dates, 'seed': args.seed}
+    kaggle_evaluation.core.benchmark.write_results(args.output, results, settings)
+
+
+if __name__ == '__main__':
+    main()
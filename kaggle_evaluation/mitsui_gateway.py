@@ -1,21 +1,162 @@
 """Gateway notebook for https://www.kaggle.com/competitions/mitsui-commodity-prediction-challenge/"""
 
 import os
+from collections.abc import Callable
 from pathlib import Path
 
+import numpy as np
 import pandas as pd
 import polars as pl
 
 import kaggle_evaluation.core.base_gateway
+import kaggle_evaluation.core.data_cache
+import kaggle_evaluation.core.prediction_cache
 import kaggle_evaluation.core.templates
 
+import mitsui_targets
+
+
+# Columns that are always sent, whichever columns the inference server declares that it reads.
+_INDEX_COLUMNS = ('date_id', 'label_date_id', 'is_scored')
+
+
+def mean_blend(predictions: list[pd.DataFrame | pl.DataFrame]) -> pl.DataFrame:
+    """The default ensemble blend: the mean of the models' predictions for each target, in the first model's column order."""
+    predictions = [pl.from_pandas(i) if isinstance(i, pd.DataFrame) else i for i in predictions]
+    column_names = predictions[0].columns
+    values = np.mean([i.select(column_names).to_numpy() for i in predictions], axis=0)
+    return pl.DataFrame(values, schema=column_names, orient='row')
+
+
+class _SortedBatchReader:
+    """Reads a frame sorted by date_id in streamed batches, handing out whole dates at a time."""
+
+    def __init__(self, frame: pl.LazyFrame):
+        self._batches = iter(frame.collect_batches(lazy=True))
+        # Rows read but not yet handed out, and whether the stream has ended.
+        self._pending = frame.clear().collect()
+        self._exhausted = False
+
+    def _read_batch(self) -> None:
+        batch = next(self._batches, None)
+        if batch is None:
+            self._exhausted = True
+            return
+        follows_pending = self._pending.is_empty() or batch.is_empty() or batch['date_id'][0] >= self._pending['date_id'][-1]
+        if not (follows_pending and batch['date_id'].is_sorted()):
+            raise kaggle_evaluation.core.base_gateway.GatewayRuntimeError(
+                kaggle_evaluation.core.base_gateway.GatewayRuntimeErrorType.GATEWAY_RAISED_EXCEPTION,
+                'Lazy ingestion requires the input files to be sorted by date_id',
+            )
+        self._pending = pl.concat([self._pending, batch], rechunk=False)
+
+    def _take(self, num_rows: int) -> pl.DataFrame:
+        taken, self._pending = self._pending.head(num_rows), self._pending.slice(num_rows)
+        return taken
+
+    def read_dates(self, num_dates: int) -> pl.DataFrame | None:
+        """The rows of the next num_dates date_ids, or None once every row has been read."""
+        # A date is only complete once a later date, or the end of the stream, has been read.
+        while not self._exhausted and self._pending['date_id'].n_unique() <= num_dates:
+            self._read_batch()
+        if self._pending.is_empty():
+            return None
+        last_date_id = self._pending['date_id'].unique(maintain_order=True)[:num_dates][-1]
+        return self.read_through(last_date_id)
+
+    def read_through(self, last_date_id: int) -> pl.DataFrame:
+        """The rows up to and including last_date_id that haven't been read yet."""
+        while not self._exhausted and (self._pending.is_empty() or self._pending['date_id'][-1] <= last_date_id):
+            self._read_batch()
+        return self._take(self._pending['date_id'].search_sorted(last_date_id, side='right'))
+
 
 class MitsuiGateway(kaggle_evaluation.core.templates.Gateway):
-    def __init__(self, data_paths: tuple[str] | None = None):
+    def __init__(
+        self,
+        data_paths: tuple[str] | None = None,
+        use_data_cache: bool = False,
+        cache_dir: str | None = None,
+        replay_batch_size: int | None = None,
+        pipeline_depth: int | None = None,
+        date_id_range: tuple[int, int] | None = None,
+        stream_max_in_flight: int | None = None,
+        incremental_submission: bool = False,
+        resume_submission: bool = False,
+        verify_lagged_labels: bool = False,
+        shared_memory_transport: bool = False,
+        cache_schemas: bool = False,
+        record_timings: bool = False,
+        strict_validation: bool = False,
+        lazy_chunk_dates: int | None = None,
+        cache_predictions: bool = False,
+        async_max_in_flight: int | None = None,
+        ensemble_servers: list[int | str] | None = None,
+        ensemble_blend: Callable[[list], pd.DataFrame | pl.DataFrame] = mean_blend,
+        parquet_inputs: bool = False,
+    ):
+        """
+        Args:
+            data_paths: The competition data directory. Defaults to the standard Kaggle input path.
+            use_data_cache: Convert the input CSVs to memory mapped Arrow files once and reuse them on later runs.
+            cache_dir: Where to store the data and prediction caches. See `data_cache.default_cache_dir` for the default.
+            replay_batch_size: Send this many dates per request to `predict_batch`. Only intended for offline replays.
+            pipeline_depth: Prepare up to this many requests ahead of the one in flight and validate in the background.
+            date_id_range: Only replay dates with start <= date_id < end, e.g. for one shard of a backtest.
+            stream_max_in_flight: Send requests over one streaming call, with up to this many awaiting a response.
+            incremental_submission: Write each date's prediction to disk as it arrives instead of at the end of the run.
+            resume_submission: Continue an incremental submission left incomplete by an earlier run.
+            verify_lagged_labels: Recompute the lagged labels from test.csv prices and target_pairs.csv as the replay
+                proceeds, and raise if they don't match the provided lagged_test_labels.
+            shared_memory_transport: Pass large frames, e.g. batched replay requests, to a server on the same host
+                through shared memory.
+            cache_schemas: Send the schema of the test and label frames once rather than with every date's batch.
+            record_timings: Write percentiles of the time spent on each stage of every date's request, and of payload
+                sizes, next to the submission, e.g. to submission.parquet.timings.json and submission.parquet.timings.csv.
+            strict_validation: Also require each prediction's columns to be exactly the target names with the label
+                files' dtypes, and every value to be a finite number.
+            lazy_chunk_dates: Stream the input files in one pass, this many dates at a time, instead of reading them
+                whole, which bounds memory use for long replays. The files must be sorted by date_id.
+            cache_predictions: Reuse predictions from earlier replays of the same dates, if the inference server
+                reports a model_version, rather than calling `predict` for them again.
+            async_max_in_flight: Send requests from an asyncio event loop, with up to this many unary requests in flight.
+            ensemble_servers: Send each date to every one of these inference servers concurrently, given as ports or
+                'host:port' strings, and submit ensemble_blend of their predictions.
+            ensemble_blend: Combines the ensemble's predictions for a date. Defaults to the mean of each target.
+            parquet_inputs: Read each input file from a Parquet copy with the same name instead, e.g. test.parquet,
+                whose row groups lazy ingestion can skip by date_id. The copies must be kept up to date by the caller.
+        """
         super().__init__(data_paths, file_share_dir=None)
         self.data_paths = data_paths
+        self.data_cache = kaggle_evaluation.core.data_cache.DataCache(cache_dir) if use_data_cache else None
+        self.date_id_range = date_id_range
+        self.verify_lagged_labels = verify_lagged_labels
+        self.strict_validation = strict_validation
+        if lazy_chunk_dates is not None and lazy_chunk_dates < 1:
+            raise ValueError(f'Lazy chunk size must be a positive int or None, got {lazy_chunk_dates}')
+        self.lazy_chunk_dates = lazy_chunk_dates
+        self.parquet_inputs = parquet_inputs
+        # The columns every prediction must have, and their dtypes, taken once from the label files.
+        self.target_column_names: list[str] | None = None
+        self.target_dtypes: list[pl.DataType] = []
+        self._target_column_set: frozenset[str] = frozenset()
+        # The numpy dtype of each target's polars dtype, to check pandas predictions against.
+        self._target_numpy_dtypes: list[np.dtype] = []
+        self._projected_columns: frozenset[str] | None = None
         self.row_id_column_name = 'date_id'
         self.set_response_timeout_seconds(60 * 5)
+        self.set_replay_batch_size(replay_batch_size)
+        self.set_pipeline_depth(pipeline_depth)
+        self.set_streaming(stream_max_in_flight)
+        self.set_async_replay(async_max_in_flight)
+        self.set_ensemble(ensemble_servers, ensemble_blend if ensemble_servers is not None else None)
+        self.set_incremental_submission(incremental_submission, resume_submission)
+        self.set_shared_memory_transport(shared_memory_transport)
+        self.set_schema_cache(cache_schemas)
+        self.set_timings(record_timings)
+        if cache_predictions:
+            prediction_cache_dir = os.path.join(cache_dir, 'predictions') if cache_dir else None
+            self.set_prediction_cache(kaggle_evaluation.core.prediction_cache.PredictionCache(prediction_cache_dir))
 
     def unpack_data_paths(self):
         if not self.data_paths:
@@ -24,34 +165,213 @@ class MitsuiGateway(kaggle_evaluation.core.templates.Gateway):
             self.competition_data_dir = self.data_paths[0]
         self.competition_data_dir = Path(self.competition_data_dir)
 
-    def generate_data_batches(self):
-        test = pl.read_csv(self.competition_data_dir / 'test.csv')
+    def read_csv(self, path: Path) -> pl.DataFrame:
+        if self.parquet_inputs:
+            return pl.read_parquet(path.with_suffix('.parquet'))
+        if self.data_cache is not None:
+            return self.data_cache.read_csv(path)
+        return pl.read_csv(path)
+
+    def scan(self, path: Path) -> pl.LazyFrame:
+        """Lazily scan an input CSV, or its Parquet copy if parquet_inputs is set."""
+        if self.parquet_inputs:
+            return pl.scan_parquet(path.with_suffix('.parquet'))
+        if self.data_cache is not None:
+            return pl.scan_ipc(self.data_cache.cached_path(path), memory_map=True)
+        return pl.scan_csv(path)
 
+    def _input_paths(self) -> list[Path]:
         label_lag_dir = self.competition_data_dir / 'lagged_test_labels'
-        label_lags_1 = pl.read_csv(label_lag_dir / 'test_labels_lag_1.csv')
-        label_lags_2 = pl.read_csv(label_lag_dir / 'test_labels_lag_2.csv')
-        label_lags_3 = pl.read_csv(label_lag_dir / 'test_labels_lag_3.csv')
-        label_lags_4 = pl.read_csv(label_lag_dir / 'test_labels_lag_4.csv')
+        return [self.competition_data_dir / 'test.csv'] + [label_lag_dir / f'test_labels_lag_{lag}.csv' for lag in range(1, 5)]
 
-        date_ids = test['date_id'].unique(maintain_order=True).to_list()
-        for date_id in date_ids:
-            test_batch = test.filter(pl.col('date_id') == date_id)
-            label_lags_1_batch = label_lags_1.filter(pl.col('date_id') == date_id)
-            label_lags_2_batch = label_lags_2.filter(pl.col('date_id') == date_id)
-            label_lags_3_batch = label_lags_3.filter(pl.col('date_id') == date_id)
-            label_lags_4_batch = label_lags_4.filter(pl.col('date_id') == date_id)
+    def _in_date_id_range(self, date_ids: list[int]) -> list[int]:
+        if self.date_id_range is None:
+            return date_ids
+        start_date_id, end_date_id = self.date_id_range
+        return [date_id for date_id in date_ids if start_date_id <= date_id < end_date_id]
 
-            yield (
-                (test_batch, label_lags_1_batch, label_lags_2_batch, label_lags_3_batch, label_lags_4_batch),
-                date_id,
+    def _set_input_columns(self, test_schema: pl.Schema, label_lags_schemas: list[pl.Schema]) -> None:
+        """Record the target columns, and the columns to send if the inference server declared which it reads."""
+        self._set_target_columns(label_lags_schemas)
+        self._projected_columns = None
+        if self.required_columns is None:
+            return
+        unknown_columns = set(self.required_columns).difference(test_schema, *label_lags_schemas)
+        if unknown_columns:
+            raise kaggle_evaluation.core.base_gateway.GatewayRuntimeError(
+                kaggle_evaluation.core.base_gateway.GatewayRuntimeErrorType.INVALID_SUBMISSION,
+                f'The inference server requires columns that are not in the data: {sorted(unknown_columns)[:5]}',
             )
+        self._projected_columns = frozenset(self.required_columns).union(_INDEX_COLUMNS)
+
+    def _project(self, df: pl.DataFrame | pl.LazyFrame) -> pl.DataFrame | pl.LazyFrame:
+        """Drop the columns the inference server doesn't read, keeping the others in order."""
+        if self._projected_columns is None:
+            return df
+        return df.select([name for name in df.collect_schema().names() if name in self._projected_columns])
+
+    def _project_inputs(self, frames: list) -> list:
+        """Project whole input frames, unless verifying lagged labels, which needs every column of each date's batches."""
+        if self.verify_lagged_labels:
+            return frames
+        return [self._project(i) for i in frames]
+
+    def _read_inputs(self):
+        """Read every input file whole, as a single chunk of all the date_ids to replay."""
+        test, *label_lags = (self.read_csv(path) for path in self._input_paths())
+        self._set_input_columns(test.schema, [i.schema for i in label_lags])
+        date_ids = self._in_date_id_range(test['date_id'].unique(maintain_order=True).to_list())
+        test, *label_lags = self._project_inputs([test, *label_lags])
+        yield date_ids, test, label_lags
+
+    def _scan_inputs(self):
+        """Stream the input files in one forward pass, `lazy_chunk_dates` date_ids at a time, so only about one chunk
+        of each is ever in memory and the first chunk is sent as soon as it's read. The files must be sorted by date_id.
+        """
+        test, *label_lags = (self.scan(path) for path in self._input_paths())
+        self._set_input_columns(test.collect_schema(), [i.collect_schema() for i in label_lags])
+        # Projecting the scans means only the required columns are ever parsed.
+        test, *label_lags = self._project_inputs([test, *label_lags])
+        if self.date_id_range is not None:
+            start_date_id, end_date_id = self.date_id_range
+            test, *label_lags = (i.filter(pl.col('date_id').is_between(start_date_id, end_date_id, closed='left')) for i in (test, *label_lags))
+        test_reader, *label_lags_readers = (_SortedBatchReader(i) for i in (test, *label_lags))
+        while (test_chunk := test_reader.read_dates(self.lazy_chunk_dates)) is not None:
+            chunk_date_ids = test_chunk['date_id'].unique(maintain_order=True).to_list()
+            label_lags_chunks = [i.read_through(chunk_date_ids[-1]) for i in label_lags_readers]
+            yield chunk_date_ids, test_chunk, label_lags_chunks
+
+    def generate_data_batches(self):
+        target_engine = None
+        if self.verify_lagged_labels:
+            target_engine = mitsui_targets.TargetEngine(self.competition_data_dir / 'target_pairs.csv')
+
+        chunks = self._scan_inputs() if self.lazy_chunk_dates is not None else self._read_inputs()
+        for date_ids, test, label_lags in chunks:
+            # Partition every frame once up front rather than re-scanning each frame for every date.
+            label_lags_batches = [self._partition_by_date(i) for i in label_lags]
+            test_batches = self._partition_by_date(test)
+            empty_label_lags = [i.clear() for i in label_lags]
+
+            for date_id in date_ids:
+                test_batch = test_batches[date_id]
+                label_lags_1_batch, label_lags_2_batch, label_lags_3_batch, label_lags_4_batch = (
+                    batches.get(date_id, empty) for batches, empty in zip(label_lags_batches, empty_label_lags)
+                )
+                if target_engine is not None:
+                    self._verify_lagged_labels(
+                        target_engine, test_batch, (label_lags_1_batch, label_lags_2_batch, label_lags_3_batch, label_lags_4_batch)
+                    )
+                    test_batch, label_lags_1_batch, label_lags_2_batch, label_lags_3_batch, label_lags_4_batch = (
+                        self._project(i) for i in (test_batch, label_lags_1_batch, label_lags_2_batch, label_lags_3_batch, label_lags_4_batch)
+                    )
+
+                yield (
+                    (test_batch, label_lags_1_batch, label_lags_2_batch, label_lags_3_batch, label_lags_4_batch),
+                    date_id,
+                )
+
+    @staticmethod
+    def _partition_by_date(df: pl.DataFrame) -> dict[int, pl.DataFrame]:
+        """Split a frame into per-date_id batches with a single pass over the data.
+
+        The frame is sorted by date_id (skipped if already sorted) so that every batch is a zero-copy slice.
+        Rows within a date keep their original order, matching the output of `filter(pl.col('date_id') == date_id)`.
+        """
+        if not df['date_id'].is_sorted():
+            df = df.sort('date_id', maintain_order=True)
+        run_lengths = df.group_by('date_id', maintain_order=True).len()
+        batches = {}
+        offset = 0
+        for date_id, length in run_lengths.iter_rows():
+            batches[date_id] = df.slice(offset, length)
+            offset += length
+        return batches
+
+    @staticmethod
+    def _verify_lagged_labels(target_engine: mitsui_targets.TargetEngine, test_batch: pl.DataFrame, label_lags_batches: tuple) -> None:
+        mismatches = target_engine.verify_update(test_batch, dict(enumerate(label_lags_batches, start=1)))
+        if mismatches:
+            raise kaggle_evaluation.core.base_gateway.GatewayRuntimeError(
+                kaggle_evaluation.core.base_gateway.GatewayRuntimeErrorType.GATEWAY_RAISED_EXCEPTION,
+                f'Lagged labels for date_id {test_batch["date_id"][0]} do not match target_pairs.csv: {mismatches}',
+            )
+
+    def _set_target_columns(self, label_lags_schemas: list[pl.Schema]) -> None:
+        targets = [(name, dtype) for schema in label_lags_schemas for name, dtype in schema.items() if name not in _INDEX_COLUMNS]
+        self.target_column_names = [name for name, _ in targets]
+        self.target_dtypes = [dtype for _, dtype in targets]
+        self._target_column_set = frozenset(self.target_column_names)
+        numpy_dtypes = {dtype: pl.Series(dtype=dtype).to_numpy().dtype for dtype in set(self.target_dtypes)}
+        self._target_numpy_dtypes = [numpy_dtypes[dtype] for dtype in self.target_dtypes]
 
     def competition_specific_validation(self, prediction, row_ids, data_batch) -> None:
-        assert isinstance(prediction, (pd.DataFrame, pl.DataFrame))
-        assert len(prediction) == 1
-        assert 'date_id' not in prediction.columns
-        provided_label_lags = pl.concat([i.drop(['date_id', 'label_date_id']) for i in data_batch[1:]], how='horizontal')
-        assert len(prediction.columns) == len(provided_label_lags.columns)
+        if not isinstance(prediction, (pd.DataFrame, pl.DataFrame)):
+            raise kaggle_evaluation.core.base_gateway.GatewayRuntimeError(
+                kaggle_evaluation.core.base_gateway.GatewayRuntimeErrorType.INVALID_SUBMISSION,
+                f'Predictions must be a pandas or polars DataFrame, got {type(prediction)}',
+            )
+        if len(prediction) != 1:
+            raise kaggle_evaluation.core.base_gateway.GatewayRuntimeError(
+                kaggle_evaluation.core.base_gateway.GatewayRuntimeErrorType.INVALID_SUBMISSION,
+                f'Predictions must have exactly 1 row, got {len(prediction)}',
+            )
+        if 'date_id' in prediction.columns:
+            raise kaggle_evaluation.core.base_gateway.GatewayRuntimeError(
+                kaggle_evaluation.core.base_gateway.GatewayRuntimeErrorType.INVALID_SUBMISSION,
+                'Predictions must not include the date_id column',
+            )
+        if self.target_column_names is None:
+            # Only needed if the batches didn't come from generate_data_batches. Every date's label batches share the
+            # label files' columns.
+            self._set_target_columns([i.schema for i in data_batch[1:]])
+        if prediction.shape[1] != len(self.target_column_names):
+            raise kaggle_evaluation.core.base_gateway.GatewayRuntimeError(
+                kaggle_evaluation.core.base_gateway.GatewayRuntimeErrorType.INVALID_SUBMISSION,
+                f'Predictions must have {len(self.target_column_names)} columns, got {prediction.shape[1]}',
+            )
+        if self.strict_validation:
+            self._strict_validation(prediction)
+
+    def _strict_validation(self, prediction: pd.DataFrame | pl.DataFrame) -> None:
+        """Check the column names and values of a single row prediction without building any frames."""
+        column_names = list(prediction.columns)
+        # Predictions almost always list the targets in the label files' order, which is the cheapest comparison.
+        if column_names != self.target_column_names and frozenset(column_names) != self._target_column_set:
+            missing = [name for name in self.target_column_names if name not in frozenset(column_names)]
+            unexpected = [name for name in column_names if name not in self._target_column_set]
+            raise kaggle_evaluation.core.base_gateway.GatewayRuntimeError(
+                kaggle_evaluation.core.base_gateway.GatewayRuntimeErrorType.INVALID_SUBMISSION,
+                f'Prediction columns must be the target names. Missing: {missing[:5]}; unexpected: {unexpected[:5]}',
+            )
+        if isinstance(prediction, pl.DataFrame):
+            dtypes, expected_dtypes = prediction.dtypes, self.target_dtypes
+        else:
+            dtypes, expected_dtypes = list(prediction.dtypes), self._target_numpy_dtypes
+        if column_names != self.target_column_names:
+            expected_dtypes_by_name = dict(zip(self.target_column_names, expected_dtypes))
+            expected_dtypes = [expected_dtypes_by_name[name] for name in column_names]
+        if dtypes != expected_dtypes:
+            mismatches = [
+                f'{name}: {dtype} (expected {expected})' for name, dtype, expected in zip(column_names, dtypes, expected_dtypes) if dtype != expected
+            ]
+            raise kaggle_evaluation.core.base_gateway.GatewayRuntimeError(
+                kaggle_evaluation.core.base_gateway.GatewayRuntimeErrorType.INVALID_SUBMISSION,
+                f'Prediction columns must have the label files\' dtypes, found {len(mismatches)} mismatches, e.g. {mismatches[:5]}',
+            )
+        values = prediction.to_numpy()
+        if values.dtype.kind not in 'iuf':
+            raise kaggle_evaluation.core.base_gateway.GatewayRuntimeError(
+                kaggle_evaluation.core.base_gateway.GatewayRuntimeErrorType.INVALID_SUBMISSION,
+                f'Predictions must all be numeric, found values of type {values.dtype}',
+            )
+        is_finite = np.isfinite(values)
+        if not is_finite.all():
+            invalid_columns = [name for name, finite in zip(column_names, is_finite.all(axis=0)) if not finite]
+            raise kaggle_evaluation.core.base_gateway.GatewayRuntimeError(
+                kaggle_evaluation.core.base_gateway.GatewayRuntimeErrorType.INVALID_SUBMISSION,
+                f'Predictions must be finite numbers, found missing or infinite values in {len(invalid_columns)} columns, e.g. {invalid_columns[:5]}',
+            )
 
 
 if __name__ == '__main__':
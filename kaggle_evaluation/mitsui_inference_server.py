@@ -4,5 +4,5 @@ import mitsui_gateway
 
 
 class MitsuiInferenceServer(kaggle_evaluation.core.templates.InferenceServer):
-    def _get_gateway_for_test(self, data_paths=None, file_share_dir=None):
-        return mitsui_gateway.MitsuiGateway(data_paths)
+    def _get_gateway_for_test(self, data_paths=None, file_share_dir=None, *args, **kwargs):
+        return mitsui_gateway.MitsuiGateway(data_paths, *args, **kwargs)
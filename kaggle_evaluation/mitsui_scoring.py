@@ -0,0 +1,123 @@
+"""Offline scoring for the Mitsui competition metric.
+
+The metric is a Sharpe ratio of daily rank correlations: for each date, the Spearman correlation between the predicted
+and actual values across every target with a non-null label, then the mean of those daily correlations divided by
+their (population) standard deviation.
+
+Ranks are computed for every date at once with a single sort of the (num_dates, num_targets) matrix, so scoring a
+submission costs a few array operations rather than a Python loop over dates.
+"""
+
+from pathlib import Path
+
+import numpy as np
+import polars as pl
+
+
+def load_labels(lagged_test_labels_dir: str | Path) -> pl.DataFrame:
+    """Assemble the labels for each date_id from the lagged_test_labels files.
+
+    Each file holds the targets for one lag, keyed by label_date_id. The labels a prediction made on a date is scored
+    against are those with that date as label_date_id.
+
+    Returns:
+        A frame with a date_id column followed by every target column.
+    """
+    labels = None
+    for path in sorted(Path(lagged_test_labels_dir).glob('test_labels_lag_*.csv')):
+        lag_labels = pl.read_csv(path).drop('date_id').rename({'label_date_id': 'date_id'})
+        labels = lag_labels if labels is None else labels.join(lag_labels, on='date_id', how='full', coalesce=True)
+    if labels is None:
+        raise ValueError(f'No lagged label files found in {lagged_test_labels_dir}')
+    return labels.select('date_id', pl.exclude('date_id')).sort('date_id')
+
+
+def rank_rows(values: np.ndarray) -> np.ndarray:
+    """Rank each row of a matrix, ignoring NaNs.
+
+    Matches `pandas.Series.rank(method='average')` applied to every row: ties share the average of their ranks and
+    NaN entries keep a NaN rank.
+    """
+    num_rows, num_columns = values.shape
+    order = np.argsort(values, axis=1, kind='stable')  # NaNs sort last
+    sorted_values = np.take_along_axis(values, order, axis=1)
+
+    # Flatten so that runs of tied values can be found with a single pass. A new run starts at the first column of
+    # every row and wherever the value changes; as NaN != NaN, each NaN is a run of its own.
+    run_starts = np.ones_like(sorted_values, dtype=bool)
+    run_starts[:, 1:] = sorted_values[:, 1:] != sorted_values[:, :-1]
+    run_starts = run_starts.ravel()
+    run_ids = np.cumsum(run_starts) - 1
+    start_positions = np.flatnonzero(run_starts)
+    end_positions = np.append(start_positions[1:], run_starts.size) - 1
+    # Average of the 1-based ordinal ranks within each run.
+    run_ranks = (start_positions + end_positions) / 2 % num_columns + 1
+
+    ranks = np.empty_like(sorted_values, dtype=np.float64)
+    np.put_along_axis(ranks, order, run_ranks[run_ids].reshape(num_rows, num_columns), axis=1)
+    ranks[np.isnan(values)] = np.nan
+    return ranks
+
+
+def daily_rank_correlations(predictions: np.ndarray, labels: np.ndarray) -> np.ndarray:
+    """Spearman correlation between each row of predictions and labels, using only the targets with a label.
+
+    Raises:
+        ValueError if a date has no labels.
+        ZeroDivisionError if either the labels or predictions for a date are constant.
+    """
+    has_label = ~np.isnan(labels)
+    if not has_label.any(axis=1).all():
+        raise ValueError('No non-null target values found')
+    predictions = np.where(has_label, predictions, np.nan)
+    prediction_ranks = rank_rows(predictions)
+    label_ranks = rank_rows(labels)
+
+    num_labels = has_label.sum(axis=1, keepdims=True)
+    prediction_deviations = np.where(has_label, prediction_ranks - np.nansum(prediction_ranks, axis=1, keepdims=True) / num_labels, 0.0)
+    label_deviations = np.where(has_label, label_ranks - np.nansum(label_ranks, axis=1, keepdims=True) / num_labels, 0.0)
+    prediction_norms = np.sqrt((prediction_deviations**2).sum(axis=1))
+    label_norms = np.sqrt((label_deviations**2).sum(axis=1))
+    if ((prediction_norms == 0) | (label_norms == 0)).any():
+        raise ZeroDivisionError('Denominator is zero, unable to compute rank correlation.')
+    return (prediction_deviations * label_deviations).sum(axis=1) / (prediction_norms * label_norms)
+
+
+def sharpe_ratio(daily_correlations: np.ndarray) -> float:
+    std_dev = daily_correlations.std()
+    if std_dev == 0:
+        raise ZeroDivisionError('Denominator is zero, unable to compute Sharpe ratio.')
+    return float(daily_correlations.mean() / std_dev)
+
+
+def align(submission: pl.DataFrame, labels: pl.DataFrame, row_id_column_name: str = 'date_id') -> tuple[np.ndarray, np.ndarray, pl.Series]:
+    """Match submission rows to label rows on the row ID column, and target columns by name.
+
+    Rows present in only one of the frames are dropped.
+
+    Returns:
+        The predictions and labels as (num_dates, num_targets) float matrices, with NaN for missing labels, and the
+        matched row IDs.
+    """
+    target_columns = [i for i in labels.columns if i != row_id_column_name]
+    missing_columns = [i for i in target_columns if i not in submission.columns]
+    if missing_columns:
+        raise ValueError(f'Submission is missing {len(missing_columns)} target columns, e.g. {missing_columns[:5]}')
+    joined = labels.join(submission.select([row_id_column_name] + target_columns), on=row_id_column_name, how='inner', suffix='_prediction')
+    joined = joined.sort(row_id_column_name)
+    label_values = joined.select(target_columns).cast(pl.Float64).to_numpy()
+    prediction_values = joined.select([i + '_prediction' for i in target_columns]).cast(pl.Float64).to_numpy()
+    return prediction_values, label_values, joined[row_id_column_name]
+
+
+def score(submission: pl.DataFrame, labels: pl.DataFrame, row_id_column_name: str = 'date_id') -> float:
+    """Score a submission against labels, e.g. from `load_labels`, with the competition metric."""
+    predictions, label_values, _ = align(submission, labels, row_id_column_name)
+    if len(label_values) == 0:
+        raise ValueError('No submission rows match the labels')
+    return sharpe_ratio(daily_rank_correlations(predictions, label_values))
+
+
+def score_file(submission_path: str | Path = 'submission.parquet', lagged_test_labels_dir: str | Path = 'lagged_test_labels') -> float:
+    """Score a submission parquet file, such as the one written by the gateway."""
+    return score(pl.read_parquet(submission_path), load_labels(lagged_test_labels_dir))
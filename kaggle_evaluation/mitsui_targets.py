@@ -0,0 +1,237 @@
+"""Vectorized computation of the Mitsui targets from raw prices.
+
+target_pairs.csv defines each target as the log return of a single price column, or the difference between the log
+returns of two price columns ("A - B"), over a lag of one to four dates. For the label of date t at lag k:
+
+    log(price[t + k + 1] / price[t + 1])
+
+with returns measured by row position, so a missing price yields a missing label rather than skipping a date.
+
+The target definitions are parsed once into index arrays over a log price matrix. Every target sharing a lag is then
+a single fancy-indexed subtraction, so a whole price panel takes a handful of array operations. A column of zeros is
+appended to the log prices so that single asset targets use the same code path as pairs.
+"""
+
+from pathlib import Path
+
+import numpy as np
+import polars as pl
+
+
+MAX_LAG = 4
+# Incremental updates need the prices at both ends of the longest return window, plus the date before it which the
+# label belongs to.
+_HISTORY_LENGTH = MAX_LAG + 2
+
+
+class TargetPairs:
+    """The parsed contents of target_pairs.csv.
+
+    Attributes:
+        target_names: Target column names, in file order.
+        lags: The lag of each target.
+        asset_names: Every price column referenced by a target, in order of first use.
+        asset_indices: Index into asset_names of each target's first asset.
+        pair_indices: Index into asset_names of each target's subtracted asset, or len(asset_names) for single asset
+            targets. That position refers to the column of zeros appended to the log prices.
+    """
+
+    def __init__(self, target_pairs: pl.DataFrame):
+        self.target_names: list[str] = target_pairs['target'].to_list()
+        self.lags = target_pairs['lag'].to_numpy().astype(np.int64)
+        if self.lags.min() < 1 or self.lags.max() > MAX_LAG:
+            raise ValueError(f'Target lags must be between 1 and {MAX_LAG}')
+
+        self.asset_names: list[str] = []
+        asset_positions: dict[str, int] = {}
+        legs = []
+        for pair in target_pairs['pair'].to_list():
+            names = [name.strip() for name in pair.split(' - ')]
+            if len(names) not in (1, 2):
+                raise ValueError(f'Invalid target pair: {pair}')
+            for name in names:
+                if name not in asset_positions:
+                    asset_positions[name] = len(self.asset_names)
+                    self.asset_names.append(name)
+            legs.append([asset_positions[name] for name in names])
+
+        no_asset = len(self.asset_names)
+        self.asset_indices = np.array([i[0] for i in legs], dtype=np.int64)
+        self.pair_indices = np.array([i[1] if len(i) == 2 else no_asset for i in legs], dtype=np.int64)
+        # Targets are grouped by lag, so that each lag is computed with one pair of gathers.
+        self.lag_positions = {int(lag): np.flatnonzero(self.lags == lag) for lag in np.unique(self.lags)}
+        self.lag_target_names = {lag: [self.target_names[i] for i in positions] for lag, positions in self.lag_positions.items()}
+
+    @classmethod
+    def from_csv(cls, path: str | Path) -> 'TargetPairs':
+        return cls(pl.read_csv(path))
+
+    def log_prices(self, prices: pl.DataFrame) -> np.ndarray:
+        """Log prices of the referenced assets as a (num_dates, num_assets + 1) matrix, with a final column of zeros.
+
+        Nulls and non-positive prices become NaN.
+        """
+        matrix = prices.select(self.asset_names).cast(pl.Float64).to_numpy()
+        log_prices = np.zeros((matrix.shape[0], len(self.asset_names) + 1))
+        with np.errstate(divide='ignore', invalid='ignore'):
+            log_prices[:, :-1] = np.log(np.where(matrix > 0, matrix, np.nan))
+        return log_prices
+
+
+class TargetEngine:
+    """Computes every target for a price panel, or incrementally as each date's prices arrive.
+
+    Args:
+        target_pairs: Path to target_pairs.csv, or an already parsed TargetPairs.
+    """
+
+    def __init__(self, target_pairs: str | Path | TargetPairs):
+        self.pairs = target_pairs if isinstance(target_pairs, TargetPairs) else TargetPairs.from_csv(target_pairs)
+        # Ring buffer of the most recent dates' log prices, for incremental updates.
+        self._recent_log_prices = np.full((_HISTORY_LENGTH, len(self.pairs.asset_names) + 1), np.nan)
+        self._recent_date_ids = np.zeros(_HISTORY_LENGTH, dtype=np.int64)
+        self._num_updates = 0
+
+    def _spread_returns(self, end_log_prices: np.ndarray, start_log_prices: np.ndarray, lag: int) -> np.ndarray:
+        """The lag's targets from log prices at the end and start of each return window. Works on rows or matrices."""
+        positions = self.pairs.lag_positions[lag]
+        log_returns = end_log_prices - start_log_prices
+        return log_returns[..., self.pairs.asset_indices[positions]] - log_returns[..., self.pairs.pair_indices[positions]]
+
+    def compute(self, prices: pl.DataFrame) -> pl.DataFrame:
+        """Compute every target for each date in a price panel such as test.csv.
+
+        Args:
+            prices: One row per date, in date order, with a date_id column and the price columns.
+
+        Returns:
+            A frame with a date_id column followed by the targets in target_pairs.csv order. Labels that depend on
+            dates beyond the end of the panel are null.
+        """
+        log_prices = self.pairs.log_prices(prices)
+        num_dates = len(log_prices)
+        targets = np.full((num_dates, len(self.pairs.target_names)), np.nan)
+        for lag, positions in self.pairs.lag_positions.items():
+            # Row t uses log_prices[t + lag + 1] - log_prices[t + 1]
+            num_complete = max(num_dates - lag - 1, 0)
+            targets[:num_complete, positions] = self._spread_returns(log_prices[lag + 1 :], log_prices[1 : num_complete + 1], lag)
+        return pl.DataFrame({'date_id': prices['date_id']}).hstack(
+            pl.from_numpy(targets, schema=self.pairs.target_names).fill_nan(None)
+        )
+
+    def compute_lagged(self, prices: pl.DataFrame) -> dict[int, pl.DataFrame]:
+        """Compute every target for a price panel, laid out like the lagged_test_labels files.
+
+        Returns:
+            For each lag, a frame with date_id, the lag's targets, then label_date_id. Each row's date_id is the date
+            whose prices complete the label for label_date_id, so only labels computable from the panel are included.
+        """
+        targets = self.compute(prices)
+        date_ids = prices['date_id']
+        lagged_labels = {}
+        for lag in self.pairs.lag_positions:
+            num_complete = max(len(prices) - lag - 1, 0)
+            lagged_labels[lag] = (
+                targets.head(num_complete)
+                .select(self.pairs.lag_target_names[lag])
+                .with_columns(date_id=date_ids.slice(lag + 1, num_complete), label_date_id=date_ids.head(num_complete))
+                .select('date_id', pl.exclude('date_id'))
+            )
+        return lagged_labels
+
+    def reset(self) -> None:
+        """Forget the dates seen by `update`."""
+        self._recent_log_prices[:] = np.nan
+        self._num_updates = 0
+
+    def update_values(self, prices: pl.DataFrame) -> dict[int, tuple[int, np.ndarray]]:
+        """Add the next date's prices and return the labels they complete, as arrays.
+
+        Args:
+            prices: A single row of prices with a date_id column, e.g. one test.csv batch from the gateway.
+
+        Returns:
+            For each lag with enough history, the label_date_id and the values of the lag's targets, in the order of
+            `pairs.lag_target_names[lag]`. Missing labels are NaN.
+        """
+        if len(prices) != 1:
+            raise ValueError(f'Incremental updates take one date at a time, got {len(prices)} rows')
+        slot = self._num_updates % _HISTORY_LENGTH
+        self._recent_log_prices[slot] = self.pairs.log_prices(prices)[0]
+        self._recent_date_ids[slot] = prices['date_id'][0]
+        self._num_updates += 1
+
+        labels = {}
+        for lag in self.pairs.lag_positions:
+            if self._num_updates < lag + 2:
+                continue
+            start_slot = (slot - lag) % _HISTORY_LENGTH
+            label_slot = (slot - lag - 1) % _HISTORY_LENGTH
+            values = self._spread_returns(self._recent_log_prices[slot], self._recent_log_prices[start_slot], lag)
+            labels[lag] = (int(self._recent_date_ids[label_slot]), values)
+        return labels
+
+    def update(self, prices: pl.DataFrame) -> dict[int, pl.DataFrame]:
+        """Add the next date's prices and return the labels they complete.
+
+        Returns:
+            For each lag with enough history, a single row frame laid out like the matching lagged_test_labels file:
+            date_id, the lag's targets, then label_date_id.
+        """
+        date_id = prices['date_id'][0]
+        labels = {}
+        for lag, (label_date_id, values) in self.update_values(prices).items():
+            targets = pl.from_numpy(values[np.newaxis, :], schema=self.pairs.lag_target_names[lag]).fill_nan(None)
+            labels[lag] = pl.DataFrame(
+                [pl.Series('date_id', [date_id], pl.Int64), *targets.get_columns(), pl.Series('label_date_id', [label_date_id], pl.Int64)]
+            )
+        return labels
+
+    def verify_update(self, prices: pl.DataFrame, lagged_labels: dict[int, pl.DataFrame], rtol: float = 1e-5, atol: float = 1e-8) -> dict[int, list[str]]:
+        """Add the next date's prices and check the labels they complete against provided ones.
+
+        Cheaper than comparing the frames from `update`, as no frames are built for the computed labels.
+
+        Args:
+            prices: A single row of prices with a date_id column.
+            lagged_labels: The provided labels for the same date, by lag, e.g. the gateway's lagged_test_labels batches.
+                Lags without a provided row are skipped.
+
+        Returns:
+            The names of any mismatched targets, by lag. Nulls must line up.
+        """
+        mismatches = {}
+        for lag, (label_date_id, values) in self.update_values(prices).items():
+            expected = lagged_labels.get(lag)
+            if expected is None or len(expected) == 0:
+                continue
+            if expected['label_date_id'][0] != label_date_id:
+                raise ValueError(f'Lag {lag} labels are for label_date_id {expected["label_date_id"][0]}, expected {label_date_id}')
+            target_names = self.pairs.lag_target_names[lag]
+            mismatched = _mismatched_columns(expected[target_names].to_numpy().astype(np.float64), values[np.newaxis, :], target_names, rtol, atol)
+            if mismatched:
+                mismatches[lag] = mismatched
+        return mismatches
+
+
+def _mismatched_columns(expected_values: np.ndarray, actual_values: np.ndarray, names: list[str], rtol: float, atol: float) -> list[str]:
+    matches = np.isclose(actual_values, expected_values, rtol=rtol, atol=atol, equal_nan=True).all(axis=0)
+    return [name for name, match in zip(names, matches) if not match]
+
+
+def compare_labels(expected: pl.DataFrame, actual: pl.DataFrame, rtol: float = 1e-5, atol: float = 1e-8) -> list[str]:
+    """Compare generated labels against provided ones, e.g. a lagged_test_labels batch.
+
+    Only the columns in `expected` and the date_ids present in both frames are compared. Nulls must line up.
+
+    Returns:
+        The names of the mismatched target columns.
+    """
+    target_columns = [i for i in expected.columns if i not in ('date_id', 'label_date_id')]
+    _, expected_rows, actual_rows = np.intersect1d(expected['date_id'].to_numpy(), actual['date_id'].to_numpy(), return_indices=True)
+    if len(expected_rows) == 0:
+        return []
+    # Converting to float turns nulls into NaN.
+    expected_values = expected[target_columns].to_numpy().astype(np.float64)[expected_rows]
+    actual_values = actual[target_columns].to_numpy().astype(np.float64)[actual_rows]
+    return _mismatched_columns(expected_values, actual_values, target_columns, rtol, atol)
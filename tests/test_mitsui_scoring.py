@@ -0,0 +1,58 @@
+import numpy as np
+import pandas as pd
+import polars as pl
+
+import kaggle_evaluation.mitsui_scoring
+
+
+def reference_score(merged_df: pd.DataFrame) -> float:
+    """The competition's original row-by-row pandas implementation of the metric."""
+    prediction_cols = [col for col in merged_df.columns if col.startswith('prediction_')]
+    target_cols = [col for col in merged_df.columns if col.startswith('target_')]
+
+    def _compute_rank_correlation(row):
+        non_null_targets = [col for col in target_cols if not pd.isnull(row[col])]
+        matching_predictions = [col for col in prediction_cols if col.replace('prediction', 'target') in non_null_targets]
+        if not non_null_targets:
+            raise ValueError('No non-null target values found')
+        if row[non_null_targets].std(ddof=0) == 0 or row[matching_predictions].std(ddof=0) == 0:
+            raise ZeroDivisionError('Denominator is zero, unable to compute rank correlation.')
+        return np.corrcoef(row[matching_predictions].rank(method='average'), row[non_null_targets].rank(method='average'))[0, 1]
+
+    daily_rank_corrs = merged_df.apply(_compute_rank_correlation, axis=1)
+    std_dev = daily_rank_corrs.std(ddof=0)
+    if std_dev == 0:
+        raise ZeroDivisionError('Denominator is zero, unable to compute Sharpe ratio.')
+    return float(daily_rank_corrs.mean() / std_dev)
+
+
+def test_score_matches_pandas_reference_with_ties_and_nans():
+    rng = np.random.default_rng(0)
+    num_dates, num_targets = 40, 30
+    # Rounding to a few distinct values makes ties common in both the labels and the predictions.
+    label_values = rng.integers(-3, 4, size=(num_dates, num_targets)).astype(np.float64)
+    label_values[rng.random(label_values.shape) < 0.3] = np.nan
+    prediction_values = np.round(rng.normal(size=(num_dates, num_targets)), 1)
+    date_ids = np.arange(num_dates)
+    labels = pl.DataFrame({'date_id': date_ids, **{f'target_{i}': label_values[:, i] for i in range(num_targets)}})
+    # Submission rows arrive out of order and include a date without labels, which scoring must drop.
+    submission = pl.DataFrame(
+        {'date_id': np.append(date_ids[::-1], num_dates), **{f'target_{i}': np.append(prediction_values[::-1, i], 0.0) for i in range(num_targets)}}
+    )
+
+    merged_df = pd.DataFrame(
+        {
+            **{f'prediction_{i}': prediction_values[:, i] for i in range(num_targets)},
+            **{f'target_{i}': label_values[:, i] for i in range(num_targets)},
+        }
+    )
+    expected = reference_score(merged_df)
+    assert np.isclose(kaggle_evaluation.mitsui_scoring.score(submission, labels), expected, rtol=1e-12, atol=1e-12)
+
+
+def test_rank_rows_matches_pandas_rank():
+    rng = np.random.default_rng(1)
+    values = rng.integers(0, 5, size=(20, 12)).astype(np.float64)
+    values[rng.random(values.shape) < 0.25] = np.nan
+    expected = pd.DataFrame(values).rank(axis=1, method='average').to_numpy()
+    np.testing.assert_allclose(kaggle_evaluation.mitsui_scoring.rank_rows(values), expected)
@@ -0,0 +1,53 @@
+import os
+
+import polars as pl
+
+import kaggle_evaluation.core.prediction_cache
+
+
+def _batch(date_id):
+    return pl.DataFrame({'date_id': [date_id], 'feature': [date_id * 0.5]})
+
+
+def _prediction(date_id):
+    return pl.DataFrame({'target_0': [date_id * 0.25], 'target_1': [-date_id * 0.25]})
+
+
+def test_hit_returns_stored_prediction(tmp_path):
+    cache = kaggle_evaluation.core.prediction_cache.PredictionCache(tmp_path)
+    key = cache.key('v1', [_batch(1)])
+    assert cache.get(key, 'missing') == 'missing'
+    cache.put(key, _prediction(1))
+    # Equal arguments built separately, and a new cache on the same directory, must find the entry.
+    reopened = kaggle_evaluation.core.prediction_cache.PredictionCache(tmp_path)
+    assert reopened.get(reopened.key('v1', [_batch(1)])).equals(_prediction(1))
+    assert cache.get(cache.key('v1', [_batch(2)]), 'missing') == 'missing'
+
+
+def test_changed_model_version_misses(tmp_path):
+    cache = kaggle_evaluation.core.prediction_cache.PredictionCache(tmp_path)
+    cache.put(cache.key('v1', [_batch(1)]), _prediction(1))
+    assert cache.key('v2', [_batch(1)]) != cache.key('v1', [_batch(1)])
+    assert cache.get(cache.key('v2', [_batch(1)]), 'missing') == 'missing'
+    cache.invalidate('v1')
+    assert cache.get(cache.key('v1', [_batch(1)]), 'missing') == 'missing'
+
+
+def test_least_recently_used_entry_is_evicted(tmp_path):
+    probe = kaggle_evaluation.core.prediction_cache.PredictionCache(tmp_path / 'probe')
+    probe.put(probe.key('v1', [_batch(0)]), _prediction(0))
+    entry_bytes = probe._size_bytes
+
+    # Room for three entries; the fourth pushes the cache over its limit.
+    cache = kaggle_evaluation.core.prediction_cache.PredictionCache(tmp_path / 'cache', max_size_bytes=int(entry_bytes * 3.5))
+    keys = {date_id: cache.key('v1', [_batch(date_id)]) for date_id in range(4)}
+    for access_time, date_id in enumerate(range(3), start=1):
+        cache.put(keys[date_id], _prediction(date_id))
+        os.utime(cache._path(keys[date_id]), (access_time, access_time))
+    # Reading the oldest entry makes the second one the least recently used.
+    assert cache.get(keys[0]).equals(_prediction(0))
+    cache.put(keys[3], _prediction(3))
+
+    assert cache.get(keys[1], 'missing') == 'missing'
+    for date_id in [0, 2, 3]:
+        assert cache.get(keys[date_id]).equals(_prediction(date_id))
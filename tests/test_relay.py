@@ -0,0 +1,103 @@
+import json
+import os
+import subprocess
+import sys
+import threading
+import time
+
+import numpy as np
+import polars as pl
+import pytest
+
+import kaggle_evaluation.core.relay
+
+
+def increment(values):
+    values += 1
+    return values
+
+
+def test_received_numpy_arrays_are_writable():
+    port = kaggle_evaluation.core.relay._get_available_port()
+    server = kaggle_evaluation.core.relay.define_server(increment, port=port)
+    server.start()
+    client = kaggle_evaluation.core.relay.Client(port=port)
+    try:
+        # The first response negotiates numpy buffers, so later requests and responses use them.
+        for _ in range(3):
+            result = client.send('increment', np.arange(3.0))
+            np.testing.assert_array_equal(result, [1.0, 2.0, 3.0])
+            result += 1
+        assert client._numpy_buffers_supported
+    finally:
+        client.close()
+        server.stop(0)
+
+
+listener_finished = threading.Event()
+
+
+def large_frame(delay_seconds):
+    listener_finished.wait(delay_seconds)
+    return pl.DataFrame({'values': np.zeros(100_000)})
+
+
+def _shared_memory_files():
+    prefix = kaggle_evaluation.core.relay._SHARED_MEMORY_PREFIX
+    return {name for name in os.listdir(kaggle_evaluation.core.relay._SHARED_MEMORY_DIR) if name.startswith(prefix)}
+
+
+def test_abandoned_shared_memory_responses_are_removed():
+    port = kaggle_evaluation.core.relay._get_available_port()
+    server = kaggle_evaluation.core.relay.define_server(large_frame, port=port)
+    server.start()
+    client = kaggle_evaluation.core.relay.Client(port=port, shared_memory=True)
+    try:
+        # The first response negotiates shared memory, so later responses use it.
+        assert client.send('large_frame', 0).height == 100_000
+        assert client._shared_memory_confirmed
+        files_before = _shared_memory_files()
+        with pytest.raises(kaggle_evaluation.core.relay.GRPCDeadlineError):
+            client.send_request(client.serialize_request('large_frame', 1), deadline_seconds=0.1)
+        # Let the listener finish, then make a request that the server handles once the abandoned one is done.
+        listener_finished.set()
+        assert client.send('large_frame', 0).height == 100_000
+        assert _shared_memory_files() <= files_before
+    finally:
+        client.close()
+        server.stop(0)
+
+
+def test_rendezvous_file_is_removed_when_its_server_stops(tmp_path, monkeypatch):
+    monkeypatch.setenv(kaggle_evaluation.core.relay.RENDEZVOUS_PATH_ENV_VAR, str(tmp_path / 'rendezvous.json'))
+    port = kaggle_evaluation.core.relay._get_available_port()
+    server = kaggle_evaluation.core.relay.define_server(increment, port=port)
+    server.start()
+    assert kaggle_evaluation.core.relay._read_rendezvous() == port
+    server.stop(0).wait()
+    # The file is removed by a thread that waits for the server to stop.
+    deadline = time.time() + 5
+    while os.path.exists(tmp_path / 'rendezvous.json') and time.time() < deadline:
+        time.sleep(0.01)
+    assert not os.path.exists(tmp_path / 'rendezvous.json')
+
+
+def test_rendezvous_of_exited_process_is_ignored(tmp_path, monkeypatch):
+    rendezvous_path = tmp_path / 'rendezvous.json'
+    monkeypatch.setenv(kaggle_evaluation.core.relay.RENDEZVOUS_PATH_ENV_VAR, str(rendezvous_path))
+    process = subprocess.run([sys.executable, '-c', 'import os; print(os.getpid())'], capture_output=True, text=True, check=True)
+    rendezvous_path.write_text(json.dumps({'port': 50051, 'pid': int(process.stdout)}))
+    assert kaggle_evaluation.core.relay._read_rendezvous() is None
+    rendezvous_path.write_text(json.dumps({'port': 50051, 'pid': os.getpid()}))
+    assert kaggle_evaluation.core.relay._read_rendezvous() == 50051
+
+
+def test_compressed_record_batches_round_trip_without_schema():
+    cache = kaggle_evaluation.core.relay.ArrowSchemaCache()
+    policy = kaggle_evaluation.core.relay.CompressionPolicy('lz4', min_size_bytes=0)
+    for height in [1, 0, 1000]:
+        table = pl.DataFrame({f'column_{i}': np.arange(height, dtype=np.float64) for i in range(50)}).to_arrow()
+        # Each table reuses the schema's writer, so its messages mustn't carry what earlier tables wrote.
+        for _ in range(2):
+            encoded = cache.encode(table, policy)
+            assert kaggle_evaluation.core.relay._read_arrow_record_batches(encoded).equals(table)
@@ -0,0 +1,31 @@
+import polars as pl
+
+import kaggle_evaluation.core.submission_writer
+
+
+def _batch(row_id):
+    return pl.DataFrame({'row_id': [row_id], 'prediction': [row_id / 2]})
+
+
+def test_resumed_submission_has_every_row_once_in_order(tmp_path):
+    submission_path = tmp_path / 'submission.parquet'
+    writer = kaggle_evaluation.core.submission_writer.SubmissionWriter(submission_path)
+    for row_id in range(5):
+        writer.append(_batch(row_id), last_row_id=row_id)
+    # Simulate a crash partway through the next batch: it reaches the stream but never the checkpoint.
+    writer._writer.write_table(_batch(5).to_arrow())
+    writer._sink.flush()
+    del writer
+
+    writer = kaggle_evaluation.core.submission_writer.SubmissionWriter(submission_path, resume=True)
+    assert writer.num_batches == 5
+    assert writer.last_row_id == 4
+    for row_id in range(5, 10):
+        writer.append(_batch(row_id), last_row_id=row_id)
+    writer.finalize()
+
+    submission = pl.read_parquet(submission_path)
+    assert submission['row_id'].to_list() == list(range(10))
+    assert submission['prediction'].to_list() == [row_id / 2 for row_id in range(10)]
+    assert not (tmp_path / 'submission.parquet.checkpoint.json').exists()
+    assert not (tmp_path / 'submission.parquet.parts').exists()